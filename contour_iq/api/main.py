@@ -1,10 +1,11 @@
 import os
-import uvicorn
 import logging
 import inspect
 import importlib
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from pipeline.tasks.segmentation import get_segmenter
+from pipeline.tasks.warmup import warm_up, WARMUP, PRELOAD_SEGMENTER
 
 ROUTERS_DIR = os.path.dirname(__file__) + "/routers"
 ROUTERS = [
@@ -53,12 +54,18 @@ def create_app() -> FastAPI:
                 app.include_router(module.endpoint.router)
         except ImportError as err:
             logging.error(f'Failed to import {R}: {err}')
-    
+
+    # With gunicorn --preload this runs once in the master, before the workers are forked
+    if PRELOAD_SEGMENTER:
+        get_segmenter()
+    if WARMUP:
+        logging.info(f'Warm-up took {warm_up(segmenter=PRELOAD_SEGMENTER):.3f} s')
+
     return app
 
 app = create_app()
 
 
 if __name__ == "__main__":
-    import os
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv('API_PORT')), log_level="debug", reload=True)
\ No newline at end of file
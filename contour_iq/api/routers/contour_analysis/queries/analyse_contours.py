@@ -12,8 +12,24 @@ from fastapi import APIRouter
 from pydantic import BaseModel
 from typing import List
 import io
-from ultralytics import YOLO
-from pipeline.main import run_contour_pipeline
+import base64
+import binascii
+from typing import Iterator, Union
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from pipeline.main import run_contour_pipeline, iter_contour_pipeline, run_contour_pipeline_batch
+from pipeline.tasks.persistence import persist_run
+from common_utils.executor.core import ConcurrencyLimiter
+from common_utils.contour_set import ContourSet
+from common_utils.streaming.core import ndjson_response, wants_ndjson
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Errors of a malformed request body, answered with a 400. Anything else is a server error.
+DECODE_ERRORS = (ValueError, KeyError, binascii.Error) + ((msgpack.UnpackException,) if msgpack else ())
 
 class TimedRoute(APIRoute):
     def get_route_handler(self):
@@ -29,6 +45,8 @@ class TimedRoute(APIRoute):
         return custom_route_handler
 
 router = APIRouter(route_class=TimedRoute)
+limiter = ConcurrencyLimiter("analyze_contours")
+batch_limiter = ConcurrencyLimiter("analyze_contours_batch")
 
 
 class Threshold(BaseModel):
@@ -36,7 +54,7 @@ class Threshold(BaseModel):
     value: float
 
 class Features(BaseModel):
-    area: float
+    area: float = None
     circularity: float = None
     eccentricity: float = None
     solidity: float = None
@@ -54,19 +72,145 @@ class ObjectAnalysis(BaseModel):
 
 class ContoursRequest(BaseModel):
     input_shape: List[int]
-    contours: List[List[List[int]]]  # List of contours with each contour as a list of points (x, y)
-    thresholds: List[Threshold]  # List of thresholds to classify the objects
+    contours: List[List[List[int]]] = []  # List of contours with each contour as a list of points (x, y)
+    # Compact alternative to `contours`: base64 of little-endian int32 buffers, flat x, y
+    # coordinates and the n + 1 point offsets of the contours
+    points: Optional[str] = None
+    offsets: Optional[str] = None
+    thresholds: List[Threshold] = []  # Overrides of the attribute rule thresholds, by name
+    features: Optional[List[str]] = None  # Features and attributes to return, all of them when omitted
+    camera: Optional[str] = None  # Camera of the image, stored with the run when persisted
+
+    def contour_set(self) -> Union[List[List[List[int]]], ContourSet]:
+        """
+        The request's contours, decoded into a ContourSet when sent as base64 buffers.
+        """
+        if self.points is None and self.offsets is None:
+            return self.contours
+        if self.points is None or self.offsets is None:
+            raise ValueError("points and offsets must be sent together")
+        return ContourSet.from_buffers(base64.b64decode(self.points), base64.b64decode(self.offsets))
+
+def thresholds_to_dict(thresholds: List[Threshold]) -> dict:
+    """
+    Convert request thresholds to overrides for the rule engine. Entries without a name are ignored.
+    """
+    return {t.name: t.value for t in thresholds or [] if t.name}
 
 class ContoursResponse(BaseModel):
     analyzed_objects: List[ObjectAnalysis]
 
+class ContoursBatchRequest(BaseModel):
+    items: List[ContoursRequest]
+
+class ContoursBatchItem(BaseModel):
+    index: int
+    analyzed_objects: Optional[List[ObjectAnalysis]] = None
+    error: Optional[str] = None  # Set instead of analyzed_objects when this item failed
+
+class ContoursBatchResponse(BaseModel):
+    items: List[ContoursBatchItem]
+
+def decode_octet_stream(body: bytes, query_params) -> tuple:
+    """
+    Decode an application/octet-stream request.
+
+    The body holds little-endian values: uint32 contour count n, n + 1 int32 point offsets,
+    then the int32 x, y coordinates of all points. input_shape (comma separated), thresholds
+    (JSON list), features (comma separated) and camera are query parameters.
+
+    Returns:
+    - (ContoursRequest without contours, ContourSet viewing the body)
+    """
+    if len(body) < 4:
+        raise ValueError("Body too short")
+    count = int(np.frombuffer(body, dtype="<u4", count=1)[0])
+    points_start = 4 * (count + 2)
+    if len(body) < points_start:
+        raise ValueError(f"Body too short for {count} contours")
+    view = memoryview(body)
+    contours = ContourSet.from_buffers(view[points_start:], view[4:points_start])
+
+    if "input_shape" not in query_params:
+        raise ValueError("input_shape query parameter is required")
+    features = query_params.get("features")
+    request = ContoursRequest(
+        input_shape=[int(v) for v in query_params["input_shape"].split(",")],
+        thresholds=json.loads(query_params.get("thresholds") or "[]"),
+        features=[name for name in features.split(",") if name] if features else None,
+        camera=query_params.get("camera"),
+    )
+    return request, contours
+
+def decode_msgpack(body: bytes) -> tuple:
+    """
+    Decode an application/msgpack request: a map with input_shape, points and offsets (bin, same
+    layout as the base64 JSON fields) and optionally thresholds and features.
+
+    Returns:
+    - (ContoursRequest without contours, ContourSet viewing the decoded buffers)
+    """
+    if msgpack is None:
+        raise HTTPException(status_code=415, detail="msgpack is not installed on this server")
+    payload = msgpack.unpackb(body, raw=False)
+    if (
+        not isinstance(payload, dict)
+        or not all(isinstance(key, str) for key in payload)
+        or not isinstance(payload.get("points"), bytes)
+        or not isinstance(payload.get("offsets"), bytes)
+    ):
+        raise ValueError("msgpack body must be a map with input_shape, points and offsets (bin)")
+    contours = ContourSet.from_buffers(payload.pop("points"), payload.pop("offsets"))
+    return ContoursRequest(**payload), contours
+
+async def parse_contours_request(request: Request) -> tuple:
+    """
+    Decode the request body according to its content type.
+
+    Returns:
+    - (ContoursRequest, contours as nested lists or a ContourSet)
+    """
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    body = await request.body()
+    try:
+        if content_type == "application/octet-stream":
+            return decode_octet_stream(body, request.query_params)
+        if content_type in ("application/msgpack", "application/x-msgpack"):
+            return decode_msgpack(body)
+        if content_type != "application/json":
+            raise HTTPException(status_code=415, detail=f"Unsupported content type '{content_type}'")
+        contours_request = ContoursRequest.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    except DECODE_ERRORS as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+
+    try:
+        return contours_request, contours_request.contour_set()
+    except DECODE_ERRORS as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+
 # Function to analyze the contours based on thresholds
-def analyze_contours(contours: List[List[List[int]]], input_shape:tuple, thresholds: List[Threshold]) -> List[ObjectAnalysis]:
+def analyze_contours(
+    contours: Union[List[List[List[int]]], ContourSet],
+    input_shape:tuple,
+    thresholds: List[Threshold],
+    features: List[str] = None,
+    camera: str = None,
+) -> List[ObjectAnalysis]:
     analyzed_objects = []
 
     cv_image = np.zeros(shape=input_shape, dtype=np.uint8)
-    output = run_contour_pipeline(cv_image, segments=contours, render_individual=False)
-    
+    thresholds = thresholds_to_dict(thresholds)
+    output = run_contour_pipeline(
+        cv_image,
+        segments=contours,
+        render_individual=False,
+        thresholds=thresholds,
+        features=features,
+    )
+    persist_run(output, "analyze_contours", input_shape, thresholds=thresholds, camera=camera)
+
     for i, obj in enumerate(output['contours']):
         analyzed_objects.append(
             ObjectAnalysis(
@@ -78,13 +222,145 @@ def analyze_contours(contours: List[List[List[int]]], input_shape:tuple, thresho
 
     return analyzed_objects
 
-@router.api_route("/analyze_contours", methods=["POST"], response_model=ContoursResponse)
-async def analyze_contours_api(request: ContoursRequest):
+def analyze_contours_batch_items(items: List[ContoursRequest]) -> List[ContoursBatchItem]:
+    """
+    Analyze the items of a batch request together, see run_contour_pipeline_batch.
+    """
+    frames = []
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            segments = item.contour_set()
+        except DECODE_ERRORS as e:
+            errors[index] = str(e)
+            segments = []
+        frames.append({
+            "image_shape": item.input_shape,
+            "segments": segments,
+            "thresholds": thresholds_to_dict(item.thresholds),
+            "features": item.features,
+        })
+
+    outputs = run_contour_pipeline_batch([frame for index, frame in enumerate(frames) if index not in errors])
+    outputs = iter(outputs)
+
+    results = []
+    for index in range(len(items)):
+        output = {"error": errors[index]} if index in errors else next(outputs)
+        if "error" in output:
+            results.append(ContoursBatchItem(index=index, error=output["error"]))
+            continue
+        persist_run(
+            output, "analyze_contours_batch", items[index].input_shape, thresholds=frames[index]["thresholds"], camera=items[index].camera
+        )
+        results.append(ContoursBatchItem(
+            index=index,
+            analyzed_objects=[
+                ObjectAnalysis(
+                    id=str(i),
+                    features=output["results"][i],
+                    attributes=[attr for attr, v in output["attributes"][i].items() if v]
+                )
+                for i in range(len(output["contours"]))
+            ],
+        ))
+    return results
+
+def analyze_contours_stream(
+    contours: Union[List[List[List[int]]], ContourSet],
+    input_shape:tuple,
+    thresholds: List[Threshold],
+    features: List[str] = None,
+    camera: str = None,
+) -> Iterator[List[ObjectAnalysis]]:
+    """
+    Same analysis as analyze_contours, one chunk of objects at a time.
+    Invalid thresholds or features raise a ValueError right away.
+    The run is persisted once the last chunk is analyzed, not when the stream is cut short.
+    """
+    cv_image = np.zeros(shape=input_shape, dtype=np.uint8)
+    thresholds = thresholds_to_dict(thresholds)
+    chunks = iter_contour_pipeline(
+        cv_image,
+        segments=contours,
+        thresholds=thresholds,
+        features=features,
+    )
+
+    def analyzed_chunks():
+        index = 0
+        output = {"contours": [], "results": [], "attributes": []}
+        for chunk in chunks:
+            analyzed = []
+            for obj in chunk:
+                output["contours"].append(obj["contour"])
+                output["results"].append(obj["results"])
+                output["attributes"].append(obj["attributes"])
+                analyzed.append(
+                    ObjectAnalysis(
+                        id=str(index),
+                        features=obj["results"],
+                        attributes=[attr for attr, v in obj["attributes"].items() if v]
+                    )
+                )
+                index += 1
+            yield analyzed
+        persist_run(output, "analyze_contours", input_shape, thresholds=thresholds, camera=camera)
+
+    return analyzed_chunks()
+
+@router.api_route(
+    "/analyze_contours",
+    methods=["POST"],
+    response_model=ContoursResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "object", "description": "ContoursRequest"}},
+                "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+                "application/msgpack": {"schema": {"type": "string", "format": "binary"}},
+            },
+        },
+    },
+)
+async def analyze_contours_api(request: Request):
     """
     Receives a list of contours and thresholds, analyzes the contours, and returns the features and attributes.
+
+    Contours are accepted as JSON point lists, as base64 int32 buffers inside the JSON body
+    (`points` and `offsets`), as application/octet-stream or as application/msgpack.
+    The binary forms are decoded without copying the points.
+
+    With `?stream=true` or `Accept: application/x-ndjson`, the response is streamed as one
+    ObjectAnalysis JSON object per line, sent as soon as its chunk of contours is analyzed.
     """
+    contours_request, contours = await parse_contours_request(request)
+    if wants_ndjson(request):
+        try:
+            chunks = analyze_contours_stream(
+                contours, contours_request.input_shape, contours_request.thresholds, contours_request.features,
+                contours_request.camera,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return ndjson_response(chunks, lambda obj: obj.model_dump_json(), limiter)
+
     try:
-        analyzed_objects = analyze_contours(request.contours, request.input_shape, request.thresholds)
-        return ContoursResponse(analyzed_objects=analyzed_objects)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        analyzed_objects = await limiter.run(
+            analyze_contours, contours, contours_request.input_shape, contours_request.thresholds, contours_request.features,
+            contours_request.camera,
+        )
+    except ValueError as e:
+        # Unknown features or thresholds, or an invalid input_shape
+        raise HTTPException(status_code=400, detail=str(e))
+    return ContoursResponse(analyzed_objects=analyzed_objects)
+
+@router.api_route("/analyze_contours/batch", methods=["POST"], response_model=ContoursBatchResponse)
+async def analyze_contours_batch_api(request: ContoursBatchRequest):
+    """
+    Analyze the contour sets of many frames in one request. Items take the same fields as
+    /analyze_contours and are processed together; each gets its own result or error.
+    """
+    items = await batch_limiter.run(analyze_contours_batch_items, request.items)
+    return ContoursBatchResponse(items=items)
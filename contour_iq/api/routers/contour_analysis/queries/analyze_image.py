@@ -2,21 +2,24 @@
 import cv2
 import time
 import json
+import asyncio
 import numpy as np
 from fastapi import HTTPException
 from fastapi import FastAPI, File, UploadFile, Body, Depends, Form, Query
 from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from fastapi import Request, Response
-from typing import Callable, Optional
+from typing import Callable, Iterator, Optional
 from fastapi import APIRouter
 from pydantic import BaseModel
 from typing import List
 import io
-from ultralytics import YOLO
-from pipeline.main import run_contour_pipeline
-
-model = YOLO('/media/amk.front.segmentation.v1.pt')
+from pipeline.main import run_contour_pipeline, iter_contour_pipeline, resolve_outputs
+from pipeline.tasks.analysis import resolve_thresholds
+from pipeline.tasks.segmentation import get_segmentation_batcher
+from pipeline.tasks.persistence import persist_run
+from common_utils.executor.core import ConcurrencyLimiter, get_cpu_executor
+from common_utils.streaming.core import ndjson_response, wants_ndjson
 
 # Define the Pydantic models for the response
 class Label(BaseModel):
@@ -26,7 +29,7 @@ class Label(BaseModel):
     attributes: List[str]
 
 class Features(BaseModel):
-    area: float
+    area: float = None
     circularity: float = None
     eccentricity: float = None
     solidity: float = None
@@ -73,51 +76,104 @@ class TimedRoute(APIRoute):
         return custom_route_handler
 
 router = APIRouter(route_class=TimedRoute)
+limiter = ConcurrencyLimiter("analyze_image")
+
 
+def parse_thresholds(thresholds: Optional[str]) -> List[Threshold]:
+    """
+    Parse the `thresholds` form field, a JSON list of {"name": ..., "value": ...} objects.
+    Unknown threshold names raise a ValueError, entries without a name are ignored.
+    """
+    if not thresholds:
+        return []
+    parsed = [Threshold(**item) for item in json.loads(thresholds)]
+    resolve_thresholds({t.name: t.value for t in parsed if t.name})
+    return parsed
 
-def yolo_segmentation_to_masks(results, image_shape):
-    segments = []
-    if results[0].masks is None:
-        return segments
-    for mask in results[0].masks.data:
-        binary_mask = mask.cpu().numpy().astype(np.uint8) * 255
-        resized_mask = cv2.resize(binary_mask, (image_shape[1], image_shape[0]), interpolation=cv2.INTER_NEAREST)
-        segments.append((resized_mask > 127).astype(np.uint8))
-    return segments
+def parse_features(features: Optional[str]) -> Optional[List[str]]:
+    """
+    Parse the `features` form field, a JSON list of feature and attribute names.
+    Unknown names raise a ValueError, an empty field selects everything.
+    """
+    if not features:
+        return None
+    parsed = json.loads(features)
+    if not isinstance(parsed, list) or not all(isinstance(name, str) for name in parsed):
+        raise ValueError("features must be a list of names")
+    resolve_outputs(parsed)
+    return parsed
 
 # Function to simulate contour analysis (mock implementation)
-def analyze_image_with_thresholds(image_bytes: bytes, thresholds: List[Threshold], attributes: List[Attribute]) -> AnalyzedImage:
+def contour_record(index: int, contour: np.ndarray, attributes: dict, results: dict) -> dict:
+    """
+    Contour entry of the response for one analyzed object.
+    """
+    M = cv2.moments(contour)
+    if M["m00"] != 0:
+        cx = int(M["m10"] / M["m00"])
+        cy = int(M["m01"] / M["m00"])
+    else:
+        cx, cy = (int(v) for v in contour.reshape(-1, 2).mean(axis=0))
+
+    color = "rgba(36, 99, 235, 0.4)" if attributes.get("manmade") else "rgba(255, 0, 0, 0.4)"
+    color = "rgba(255, 165, 0, 0.4)" if attributes.get("long") else color
+    color = "rgba(255, 0, 165, 0.4)" if attributes.get("rigid") else color
+
+    return {
+        "id": str(index),
+        "points": [{"x": x, "y": y} for x, y in contour.reshape(-1, 2).tolist()],
+        "color": color,
+        "labels": [{"id": f"{index}-1", "x": cx, "y": cy, "attributes": [attr for attr, v in attributes.items() if v]}],
+        "features": results,
+    }
+
+def decode_image(image_bytes: bytes) -> np.ndarray:
     cv_image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if cv_image is None:
+        raise HTTPException(status_code=400, detail="Cannot decode image")
+    return cv_image
+
+async def segment_image(image_bytes: bytes) -> tuple:
+    """
+    Decode the uploaded image on the CPU executor and segment it with the model
+    (CONTOUR_IQ_SEGMENTER, loaded by the first request unless preloaded, see get_segmenter).
+
+    The model call is awaited on the event loop, outside the endpoint's concurrency limit:
+    images of concurrent requests have to reach the batcher together to go through the model
+    in one call (see get_segmentation_batcher).
+
+    Returns:
+    - (decoded image, list of binary masks)
+    """
+    loop = asyncio.get_running_loop()
+    cv_image = await loop.run_in_executor(get_cpu_executor(), decode_image, image_bytes)
+    masks = await asyncio.wrap_future(get_segmentation_batcher().submit(cv_image))
+    return cv_image, masks
+
+def analyze_image_with_thresholds(
+    cv_image: np.ndarray,
+    masks: list,
+    thresholds: List[Threshold],
+    attributes: List[Attribute],
+    features: List[str] = None,
+    camera: str = None,
+) -> AnalyzedImage:
     height, width, _ = cv_image.shape
 
-    contours = []
-    results = model(cv_image)
-    masks = yolo_segmentation_to_masks(results, cv_image.shape)
-    output = run_contour_pipeline(cv_image, masks, render_individual=False)
-
-    for i, obj in enumerate(output['contours']):
-        print(output["attributes"][i])
-        M = cv2.moments(obj)
-        if M["m00"] != 0:
-            cx = int(M["m10"] / M["m00"])
-            cy = int(M["m01"] / M["m00"])
-
-        color = "rgba(36, 99, 235, 0.4)" if output["attributes"][i].get("manmade") else "rgba(255, 0, 0, 0.4)"
-        color = "rgba(255, 165, 0, 0.4)" if output["attributes"][i].get("long") else color
-        color = "rgba(255, 0, 165, 0.4)" if output["attributes"][i].get("rigid") else color
-
-        contours.append({
-            "id": str(i),
-            "points": [
-                {
-                    "x": int(x),
-                    "y": int(y)
-                } for x, y in obj.squeeze()
-            ],
-            "color": color,
-            "labels": [{"id": f"{i}-1", "x": cx, "y": cy, "attributes": [attr for attr, v in output['attributes'][i].items() if v]}],
-            "features": output["results"][i],
-        })
+    thresholds = {t.name: t.value for t in thresholds or [] if t.name}
+    output = run_contour_pipeline(
+        cv_image,
+        masks,
+        render_individual=False,
+        thresholds=thresholds,
+        features=features,
+    )
+    persist_run(output, "analyze_image", cv_image.shape, thresholds=thresholds, camera=camera)
+
+    contours = [
+        contour_record(i, obj, output["attributes"][i], output["results"][i])
+        for i, obj in enumerate(output['contours'])
+    ]
 
     # Return the analyzed image with contours
     return AnalyzedImage(
@@ -127,6 +183,36 @@ def analyze_image_with_thresholds(image_bytes: bytes, thresholds: List[Threshold
         contours=contours
     )
 
+def analyze_image_stream(
+    cv_image: np.ndarray,
+    masks: list,
+    thresholds: List[Threshold],
+    features: List[str] = None,
+    camera: str = None,
+) -> Iterator[List[dict]]:
+    """
+    Same analysis as analyze_image_with_thresholds, yielding Contour records chunk by chunk.
+    The run is persisted once the last chunk is analyzed, not when the stream is cut short.
+    """
+    index = 0
+    thresholds = {t.name: t.value for t in thresholds or [] if t.name}
+    output = {"contours": [], "results": [], "attributes": []}
+    for chunk in iter_contour_pipeline(
+        cv_image,
+        masks,
+        thresholds=thresholds,
+        features=features,
+    ):
+        records = []
+        for obj in chunk:
+            output["contours"].append(obj["contour"])
+            output["results"].append(obj["results"])
+            output["attributes"].append(obj["attributes"])
+            records.append(contour_record(index, obj["contour"], obj["attributes"], obj["results"]))
+            index += 1
+        yield records
+    persist_run(output, "analyze_image", cv_image.shape, thresholds=thresholds, camera=camera)
+
 
 # FastAPI endpoint to handle image and thresholds
 @router.post("/analyze_image")
@@ -134,11 +220,33 @@ async def analyze_image(request: Request, image: UploadFile = File(...)):
     """
     Analyze the uploaded image with the given thresholds and attributes.
     Returns the contours and features of the detected objects.
+
+    With `?stream=true` or `Accept: application/x-ndjson`, the response is streamed as one
+    Contour JSON object per line, sent as soon as its chunk of masks is analyzed.
+
+    An optional `camera` form field is stored with the run when results are persisted.
     """
     form_data = await request.form()
     thresholds = form_data.get('thresholds')
     attributes = form_data.get("attributes")
 
-    image_bytes = await image.read()
-    result = analyze_image_with_thresholds(image_bytes, thresholds=thresholds, attributes=attributes)
+    try:
+        thresholds = parse_thresholds(thresholds)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid thresholds: {e}")
+
+    try:
+        features = parse_features(form_data.get("features"))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid features: {e}")
+
+    cv_image, masks = await segment_image(await image.read())
+    if wants_ndjson(request):
+        chunks = analyze_image_stream(cv_image, masks, thresholds, features, form_data.get("camera"))
+        return ndjson_response(chunks, json.dumps, limiter)
+
+    result = await limiter.run(
+        analyze_image_with_thresholds, cv_image, masks, thresholds=thresholds, attributes=attributes, features=features,
+        camera=form_data.get("camera"),
+    )
     return JSONResponse(content=result.model_dump())
@@ -0,0 +1,90 @@
+import time
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Iterator, Optional
+from fastapi import APIRouter, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from fastapi.routing import APIRoute
+from pipeline.tasks.persistence.core import setup_django
+from pipeline.tasks.feature_export import core as feature_export
+from common_utils.executor.core import ConcurrencyLimiter
+from common_utils.streaming.core import iterate_in_executor
+
+logger = logging.getLogger(__name__)
+
+class TimedRoute(APIRoute):
+    def get_route_handler(self):
+        original_route_handler = super().get_route_handler()
+
+        async def custom_route_handler(request):
+            before = time.time()
+            response: Response = await original_route_handler(request)
+            duration = time.time() - before
+            response.headers["X-Response-Time"] = str(duration)
+            return response
+
+        return custom_route_handler
+
+router = APIRouter(route_class=TimedRoute)
+limiter = ConcurrencyLimiter("export_features")
+
+def export_stream(
+    format: str,
+    source: Optional[str] = None,
+    camera: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Iterator[bytes]:
+    """
+    Feature table of the stored runs matching the filters, encoded chunk by chunk.
+    """
+    setup_django()
+    from pipeline.models import AnalysisRun
+
+    runs = AnalysisRun.objects.all()
+    if source:
+        runs = runs.filter(source=source)
+    if camera is not None:
+        runs = runs.filter(camera=camera)
+    if since:
+        runs = runs.filter(created_at__gte=since)
+    if until:
+        runs = runs.filter(created_at__lt=until)
+    return feature_export.iter_feature_table(feature_export.stored_feature_batches(runs), format)
+
+async def logged(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception:
+        # The body is cut short, which leaves a file without its footer (end of stream for Arrow)
+        logger.exception("Feature export failed")
+        raise
+
+@router.get("/export_features")
+async def export_features(
+    format: str = "parquet",
+    source: Optional[str] = None,
+    camera: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Download the per-object features of the stored runs (see CONTOUR_IQ_PERSIST) as one Parquet
+    file (`format=parquet`) or Arrow IPC stream (`format=arrow`), optionally filtered by source
+    endpoint, camera and creation time (`since` inclusive, `until` exclusive).
+
+    The table is read from the database and sent a row group at a time, ordered by camera and
+    time; a row group never mixes dates or cameras. Requires pyarrow on the server.
+    """
+    if feature_export.pa is None:
+        raise HTTPException(status_code=501, detail="pyarrow is not installed on this server")
+    if format not in feature_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected one of {', '.join(feature_export.FORMATS)}")
+
+    chunks = export_stream(format, source, camera, since, until)
+    return StreamingResponse(
+        logged(iterate_in_executor(chunks, limiter)),
+        media_type=feature_export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="features.{format}"'},
+    )
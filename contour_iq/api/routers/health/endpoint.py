@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["Health"],
+)
+
+
+@router.get("/health")
+async def health():
+    """
+    Liveness check, answered directly on the event loop.
+    """
+    return {"status": "ok"}
@@ -0,0 +1,358 @@
+import time
+import asyncio
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import json
+import base64
+import httpx
+import numpy as np
+from django.test import SimpleTestCase, TransactionTestCase
+from fastapi import FastAPI
+
+from common_utils.executor import core as executor
+from common_utils.contour_set import ContourSet
+from api.routers.health import endpoint as health
+from api.routers.metrics import endpoint as metrics
+from api.routers.contour_analysis.queries import analyse_contours, analyze_image, export_features
+from pipeline.tasks import feature_export
+
+
+def create_test_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(health.router)
+    app.include_router(metrics.router)
+    app.include_router(analyse_contours.router, prefix="/api/v1")
+    return app
+
+
+SQUARE = {
+    "input_shape": [480, 640, 3],
+    "contours": [[[10, 10], [100, 10], [100, 60], [10, 60]]],
+    "thresholds": [],
+}
+
+
+class EventLoopBlockingTest(SimpleTestCase):
+    heavy_seconds = 1.5
+
+    async def test_light_requests_stay_fast_during_heavy_request(self):
+        original = analyse_contours.analyze_contours
+
+        def slow_analyze_contours(contours, *args):
+            # A blocking call standing in for a large frame
+            if len(contours) > 1:
+                time.sleep(self.heavy_seconds)
+            return original(contours, *args)
+
+        # Two slots, so light requests do not queue behind the heavy one whatever the host's CPU count
+        pool = ThreadPoolExecutor(max_workers=2)
+        transport = httpx.ASGITransport(app=create_test_app())
+        with mock.patch.object(analyse_contours, "analyze_contours", slow_analyze_contours), \
+                mock.patch.object(analyse_contours, "limiter", executor.ConcurrencyLimiter("analyze_contours", limit=2)), \
+                mock.patch.object(executor, "_executor", pool):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                heavy = asyncio.create_task(
+                    client.post("/api/v1/analyze_contours", json={**SQUARE, "contours": SQUARE["contours"] * 2})
+                )
+                await asyncio.sleep(0.1)
+
+                latencies = []
+                for _ in range(5):
+                    for method, url, kwargs in (
+                        ("GET", "/api/v1/health", {}),
+                        ("POST", "/api/v1/analyze_contours", {"json": SQUARE}),
+                    ):
+                        start = time.perf_counter()
+                        response = await client.request(method, url, **kwargs)
+                        latencies.append(time.perf_counter() - start)
+                        self.assertEqual(response.status_code, 200)
+
+                self.assertFalse(heavy.done())
+                self.assertEqual((await heavy).status_code, 200)
+        pool.shutdown()
+
+        self.assertLess(max(latencies), 0.25)
+
+
+class MetricsEndpointTest(SimpleTestCase):
+    async def test_metrics_after_analysis(self):
+        transport = httpx.ASGITransport(app=create_test_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            self.assertEqual((await client.post("/api/v1/analyze_contours", json=SQUARE)).status_code, 200)
+            response = await client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn('contour_iq_stage_seconds_count{stage="run_pipeline"}', response.text)
+
+
+class BinaryContourPayloadTest(SimpleTestCase):
+    input_shape = [480, 640, 3]
+
+    def polygons(self):
+        rng = np.random.default_rng(0)
+        polygons = []
+        for _ in range(30):
+            center = rng.uniform((50, 50), (590, 430))
+            angles = np.sort(rng.uniform(0, 2 * np.pi, int(rng.integers(3, 20))))
+            radii = rng.uniform(5, 60, len(angles))
+            points = center + np.stack([radii * np.cos(angles), radii * np.sin(angles)], axis=1)
+            polygons.append(points.astype(int).tolist())
+        return polygons
+
+    async def post(self, **kwargs):
+        transport = httpx.ASGITransport(app=create_test_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/v1/analyze_contours", **kwargs)
+
+    async def test_encodings_match_json(self):
+        polygons = self.polygons()
+        thresholds = [{"name": "round_circularity", "value": 0.7}]
+        expected = await self.post(json={"input_shape": self.input_shape, "contours": polygons, "thresholds": thresholds})
+        self.assertEqual(expected.status_code, 200)
+
+        points, offsets = ContourSet.from_polygons(polygons).to_buffers()
+        count = np.array([len(polygons)], dtype="<u4").tobytes()
+        responses = [
+            await self.post(json={
+                "input_shape": self.input_shape,
+                "points": base64.b64encode(points).decode(),
+                "offsets": base64.b64encode(offsets).decode(),
+                "thresholds": thresholds,
+            }),
+            await self.post(
+                content=count + offsets + points,
+                headers={"content-type": "application/octet-stream"},
+                params={"input_shape": "480,640,3", "thresholds": json.dumps(thresholds)},
+            ),
+        ]
+        try:
+            import msgpack
+        except ImportError:
+            msgpack = None
+        if msgpack is not None:
+            responses.append(await self.post(
+                content=msgpack.packb({"input_shape": self.input_shape, "points": points, "offsets": offsets, "thresholds": thresholds}),
+                headers={"content-type": "application/msgpack"},
+            ))
+
+        for response in responses:
+            self.assertEqual(response.status_code, 200, response.text)
+            self.assertEqual(response.json(), expected.json())
+
+    async def test_invalid_payloads(self):
+        points, offsets = ContourSet.from_polygons(self.polygons()).to_buffers()
+        bad_offsets = await self.post(json={
+            "input_shape": self.input_shape,
+            "points": base64.b64encode(points).decode(),
+            "offsets": base64.b64encode(offsets[:-4]).decode(),
+        })
+        self.assertEqual(bad_offsets.status_code, 400)
+        truncated = await self.post(
+            content=np.array([1000], dtype="<u4").tobytes() + offsets,
+            headers={"content-type": "application/octet-stream"},
+            params={"input_shape": "480,640,3"},
+        )
+        self.assertEqual(truncated.status_code, 400)
+        self.assertEqual((await self.post(json={"contours": []})).status_code, 422)
+        self.assertEqual((await self.post(content=b"x", headers={"content-type": "text/plain"})).status_code, 415)
+        self.assertEqual((await self.post(json={**SQUARE, "points": "not base64!", "offsets": "AAAA"})).status_code, 400)
+        try:
+            import msgpack
+        except ImportError:
+            return
+        for body in (b"\xc1", msgpack.packb([1, 2]), msgpack.packb({"input_shape": self.input_shape, "points": 1, "offsets": 2})):
+            response = await self.post(content=body, headers={"content-type": "application/msgpack"})
+            self.assertEqual(response.status_code, 400, body)
+
+    async def test_server_errors_are_not_reported_as_invalid_requests(self):
+        def failing_analyze_contours(*args):
+            raise RuntimeError("database is down")
+
+        transport = httpx.ASGITransport(app=create_test_app(), raise_app_exceptions=False)
+        with mock.patch.object(analyse_contours, "analyze_contours", failing_analyze_contours):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.post("/api/v1/analyze_contours", json=SQUARE)
+        self.assertEqual(response.status_code, 500)
+
+
+class StreamingResponseTest(SimpleTestCase):
+    async def test_ndjson_matches_json_response(self):
+        polygons = BinaryContourPayloadTest.polygons(self)
+        body = {"input_shape": [480, 640, 3], "contours": polygons}
+        transport = httpx.ASGITransport(app=create_test_app())
+        with mock.patch("pipeline.main.STREAM_CHUNK_SIZE", 8):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                expected = await client.post("/api/v1/analyze_contours", json=body)
+                streamed = await client.post("/api/v1/analyze_contours", json=body, params={"stream": "true"})
+                accepted = await client.post(
+                    "/api/v1/analyze_contours", json=body, headers={"accept": "application/x-ndjson"}
+                )
+                invalid = await client.post(
+                    "/api/v1/analyze_contours", json={**body, "features": ["nope"]}, params={"stream": "true"}
+                )
+
+        self.assertEqual(streamed.headers["content-type"], "application/x-ndjson")
+        objects = expected.json()["analyzed_objects"]
+        for response in (streamed, accepted):
+            self.assertEqual([json.loads(line) for line in response.text.splitlines()], objects)
+        self.assertEqual(invalid.status_code, 400)
+
+    async def test_stream_holds_one_slot_until_it_ends(self):
+        from common_utils.streaming.core import iterate_in_executor
+
+        limiter = executor.ConcurrencyLimiter("stream_test", limit=1)
+        first = iterate_in_executor(iter([[1], [2]]), limiter)
+        second = iterate_in_executor(iter([[3]]), limiter)
+        self.assertEqual(await first.__anext__(), [1])
+        # The first stream keeps its slot between chunks
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(asyncio.shield(pending := asyncio.ensure_future(second.__anext__())), 0.2)
+        self.assertEqual([chunk async for chunk in first], [[2]])
+        self.assertEqual(await asyncio.wait_for(pending, 5), [3])
+        self.assertEqual([chunk async for chunk in second], [])
+
+        # A stream closed early gives its slot back
+        third = iterate_in_executor(iter([[4], [5]]), limiter)
+        self.assertEqual(await third.__anext__(), [4])
+        await third.aclose()
+        self.assertFalse(limiter.semaphore.locked())
+
+    async def test_streamed_run_is_persisted_with_camera(self):
+        polygons = BinaryContourPayloadTest.polygons(self)
+        body = {"input_shape": [480, 640, 3], "contours": polygons, "camera": "north"}
+        transport = httpx.ASGITransport(app=create_test_app())
+        with mock.patch("pipeline.main.STREAM_CHUNK_SIZE", 8), \
+                mock.patch("api.routers.contour_analysis.queries.analyse_contours.persist_run") as persist_run:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                streamed = await client.post("/api/v1/analyze_contours", json=body, params={"stream": "true"})
+
+        persist_run.assert_called_once()
+        (output, source, image_shape), kwargs = persist_run.call_args
+        self.assertEqual((source, tuple(image_shape), kwargs["camera"]), ("analyze_contours", (480, 640, 3), "north"))
+        self.assertEqual(len(output["contours"]), len(streamed.text.splitlines()))
+        self.assertEqual(len(output["results"]), len(output["attributes"]))
+
+
+class BatchEndpointTest(SimpleTestCase):
+    async def test_batch_items_and_errors(self):
+        polygons = BinaryContourPayloadTest.polygons(self)
+        points, offsets = ContourSet.from_polygons(polygons).to_buffers()
+        items = [
+            {"input_shape": [480, 640, 3], "contours": polygons},
+            {"input_shape": [480, 640, 3], "points": base64.b64encode(points).decode(), "offsets": base64.b64encode(offsets).decode()},
+            {"input_shape": [480, 640, 3], "contours": polygons, "thresholds": [{"name": "nope", "value": 1}]},
+            {"input_shape": [480, 640, 3], "points": base64.b64encode(points).decode()},
+        ]
+        transport = httpx.ASGITransport(app=create_test_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            single = await client.post("/api/v1/analyze_contours", json=items[0])
+            response = await client.post("/api/v1/analyze_contours/batch", json={"items": items})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["items"]
+        self.assertEqual([item["index"] for item in results], [0, 1, 2, 3])
+        for item in results[:2]:
+            self.assertIsNone(item["error"])
+            self.assertEqual(item["analyzed_objects"], single.json()["analyzed_objects"])
+        self.assertIn("nope", results[2]["error"])
+        self.assertIn("together", results[3]["error"])
+
+
+class StartupTest(SimpleTestCase):
+    def test_app_starts_without_the_model(self):
+        import os
+        import sys
+        import subprocess
+
+        code = (
+            "import sys, api.main; "
+            "assert api.main.app.routes; "
+            "assert 'ultralytics' not in sys.modules and 'torch' not in sys.modules, 'model imported'"
+        )
+        env = {**os.environ, "CONTOUR_IQ_WARMUP": "1", "CONTOUR_IQ_PRELOAD_SEGMENTER": "0"}
+        completed = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+
+
+@unittest.skipIf(feature_export.core.pa is None, "requires pyarrow")
+class FeatureExportEndpointTest(TransactionTestCase):
+    def store_runs(self) -> list:
+        from datetime import datetime, timezone
+        from pipeline.main import run_contour_pipeline
+        from pipeline.tasks.persistence.core import run_record, write_runs
+
+        polygons = BinaryContourPayloadTest.polygons(self)
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        records = [
+            run_record(run_contour_pipeline(image, polygons[: 5 + i]), "test", image.shape, f"{i}.jpg", camera=camera)._replace(
+                created_at=datetime(2026, 5, day, 12, i, tzinfo=timezone.utc)
+            )
+            for i, (camera, day) in enumerate([("north", 1), ("south", 1), ("north", 2), ("north", 1), ("", 2)])
+        ]
+        write_runs(records)
+        return records
+
+    async def test_stored_runs_are_streamed_by_partition(self):
+        import io
+        from asgiref.sync import sync_to_async
+        from pyarrow import ipc, parquet
+
+        records = await sync_to_async(self.store_runs)()
+        app = FastAPI()
+        app.include_router(export_features.router, prefix="/api/v1")
+        transport = httpx.ASGITransport(app=app)
+        with mock.patch.object(feature_export.core, "EXPORT_CHUNK_RUNS", 2):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                response = await client.get("/api/v1/export_features")
+                north = await client.get("/api/v1/export_features", params={"format": "arrow", "camera": "north"})
+                invalid = await client.get("/api/v1/export_features", params={"format": "csv"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/vnd.apache.parquet")
+        data = parquet.ParquetFile(io.BytesIO(response.content))
+        table = data.read()
+        self.assertEqual(table.num_rows, sum(len(record.results) for record in records))
+        # Runs without a camera come first
+        first = [result["area"] for result in records[4].results]
+        self.assertEqual(table.column("area").to_pylist()[: len(first)], first)
+        for i in range(data.num_row_groups):
+            group = data.read_row_group(i, columns=["date", "camera"])
+            self.assertEqual(len(set(zip(group.column("date").to_pylist(), group.column("camera").to_pylist()))), 1)
+        self.assertEqual(data.num_row_groups, 4)
+
+        self.assertEqual(set(ipc.open_stream(north.content).read_all().column("image_id").to_pylist()), {"0.jpg", "2.jpg", "3.jpg"})
+        self.assertEqual(invalid.status_code, 400)
+
+
+class ImageMicroBatchingTest(SimpleTestCase):
+    async def test_concurrent_requests_share_model_calls(self):
+        import cv2
+        from common_utils.micro_batch.core import MicroBatcher
+        from pipeline.tasks.segmentation import StubSegmenter, segment_batch
+
+        segmenter = StubSegmenter(call_seconds=0.05, image_seconds=0)
+        batcher = MicroBatcher(lambda images: segment_batch(segmenter, images), max_batch_size=8, max_wait=0.05)
+        image = np.zeros((120, 160, 3), dtype=np.uint8)
+        image[20:60, 30:90] = 255
+        encoded = cv2.imencode(".png", image)[1].tobytes()
+
+        app = FastAPI()
+        app.include_router(analyze_image.router, prefix="/api/v1")
+        transport = httpx.ASGITransport(app=app)
+        # One analysis slot: the requests still reach the model together
+        with mock.patch.object(analyze_image, "get_segmentation_batcher", lambda: batcher), \
+                mock.patch.object(analyze_image, "limiter", executor.ConcurrencyLimiter("analyze_image", limit=1)):
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                responses = await asyncio.gather(*(
+                    client.post("/api/v1/analyze_image", files={"image": ("frame.png", encoded, "image/png")})
+                    for _ in range(6)
+                ))
+
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()["contours"]), 1)
+        self.assertEqual(sum(segmenter.batch_sizes), 6)
+        self.assertGreater(max(segmenter.batch_sizes), 1)
@@ -0,0 +1,44 @@
+"""
+Compare analyzing a burst of frames with one run_contour_pipeline call per frame against a
+single run_contour_pipeline_batch call.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.batch_throughput --frames 32 --objects 50
+"""
+import argparse
+import numpy as np
+from benchmarks.synthetic import SHAPES, synthetic_polygons
+from benchmarks.pipeline_stages import measure, parse_frame
+from pipeline.main import run_contour_pipeline, run_contour_pipeline_batch
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=32, help="Frames per burst")
+    parser.add_argument("--objects", type=int, default=50, help="Objects per frame")
+    parser.add_argument("--frame-size", type=parse_frame, default=(480, 640), help="WIDTHxHEIGHT")
+    parser.add_argument("--shape", choices=SHAPES, default="mixed")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    image_shape = (*args.frame_size, 3)
+    frames = [
+        {"image_shape": image_shape, "segments": synthetic_polygons(image_shape, args.objects, shape=args.shape, seed=seed)}
+        for seed in range(args.frames)
+    ]
+
+    def single_calls():
+        return [
+            run_contour_pipeline(np.zeros(image_shape, dtype=np.uint8), frame["segments"])
+            for frame in frames
+        ]
+
+    _, single = measure(single_calls, args.repeat)
+    _, batch = measure(lambda: run_contour_pipeline_batch(frames), args.repeat)
+
+    print(f"{args.frames} frames x {args.objects} objects, {args.frame_size[1]}x{args.frame_size[0]}")
+    print(f"single calls: {single['min']:.4f} s  {args.frames / single['min']:8.1f} frames/s")
+    print(f"batch:        {batch['min']:.4f} s  {args.frames / batch['min']:8.1f} frames/s  ({single['min'] / batch['min']:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare two pipeline_stages result files, stage by stage.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.compare baseline.json candidate.json --threshold 1.10
+
+Prints candidate / baseline ratios of the minimum run time and exits with status 1 when
+any stage got slower than --threshold.
+"""
+import sys
+import json
+import argparse
+from typing import Dict, List, Tuple
+
+def workload_key(workload: Dict) -> Tuple:
+    return tuple(workload["frame"]), workload["objects"], workload["shape"], workload["input"]
+
+def compare(baseline: Dict, candidate: Dict, min_seconds: float = 0.001) -> List[Dict]:
+    """
+    Ratios of candidate to baseline minimum timings for the workloads and stages both files have.
+    Stages faster than `min_seconds` in the baseline are left out, their ratios are mostly noise.
+    """
+    reference = {workload_key(w): w for w in baseline["workloads"] if "stages" in w}
+    rows = []
+    for workload in candidate["workloads"]:
+        old = reference.get(workload_key(workload))
+        if old is None or "stages" not in workload:
+            continue
+        for stage, timing in workload["stages"].items():
+            if stage not in old["stages"] or old["stages"][stage]["min"] < min_seconds:
+                continue
+            rows.append({
+                "workload": workload_key(workload),
+                "stage": stage,
+                "baseline": old["stages"][stage]["min"],
+                "candidate": timing["min"],
+                "ratio": timing["min"] / old["stages"][stage]["min"],
+            })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=1.10, help="Largest accepted slowdown ratio")
+    parser.add_argument("--min-seconds", type=float, default=0.001)
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.min_seconds)
+    regressions = 0
+    for row in rows:
+        (height, width), objects, shape, input_kind = row["workload"]
+        flag = ""
+        if row["ratio"] > args.threshold:
+            flag = "  <-- slower"
+            regressions += 1
+        print(
+            f"{width}x{height:<5} {objects:>5} {shape:<8} {input_kind:<8} {row['stage']:<30} "
+            f"{row['baseline']:>10.4f} {row['candidate']:>10.4f} {row['ratio']:>6.2f}x{flag}"
+        )
+    print(f"{len(rows)} stages compared, {regressions} slower than {args.threshold}x")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Throughput and peak memory of the columnar feature export:
+
+    stream   FeatureDatasetWriter: rows are appended a row group at a time
+    collect  every image's rows gathered in one table, written at the end
+
+One pipeline output is exported again and again as images of a few cameras over a few days.
+Every mode runs in a fresh interpreter; peak RSS is reported above the RSS before the export.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.feature_export
+    python -m benchmarks.feature_export --images 20000 --objects 100
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+from time import perf_counter
+from datetime import datetime, timedelta, timezone
+
+MODES = ("stream", "collect")
+
+def run_child(mode: str, images: int, objects: int) -> dict:
+    import numpy as np
+    import pyarrow as pa
+    from pyarrow import parquet
+    from benchmarks.synthetic import synthetic_polygons
+    from pipeline.main import run_contour_pipeline
+    from pipeline.tasks.feature_export import FeatureDatasetWriter, feature_batch
+
+    image_shape = (1080, 1920, 3)
+    output = run_contour_pipeline(np.zeros(image_shape, dtype=np.uint8), synthetic_polygons(image_shape, objects, seed=0))
+    output = {key: output[key] for key in ("contours", "results", "attributes")}
+    start_time = datetime(2026, 5, 1, tzinfo=timezone.utc)
+
+    def batches():
+        for i in range(images):
+            captured_at = start_time + timedelta(seconds=i * 3 * 86400 // images)
+            yield feature_batch(output, f"{i}.jpg", f"camera_{i % 4}", captured_at)
+
+    root = tempfile.mkdtemp()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = perf_counter()
+    rows = 0
+    if mode == "stream":
+        with FeatureDatasetWriter(root) as writer:
+            for batch in batches():
+                writer.write(batch)
+        rows = writer.rows
+    else:
+        table = pa.Table.from_batches(list(batches()))
+        parquet.write_table(table, os.path.join(root, "features.parquet"))
+        rows = table.num_rows
+    seconds = perf_counter() - start
+    size = sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(root) for name in names)
+    shutil.rmtree(root)
+    return {
+        "rows": rows, "seconds": seconds, "size_mib": size / 2**20,
+        "peak_mib": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline) / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=5000)
+    parser.add_argument("--objects", type=int, default=100, help="Objects per image")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.images, args.objects)))
+        return
+
+    for mode in args.modes:
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.feature_export", "--child", mode, "--images", str(args.images), "--objects", str(args.objects)],
+            capture_output=True, text=True, check=True,
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(
+            f"{mode:<8} {result['rows']} rows in {result['seconds']:.2f} s: {result['rows'] / result['seconds']:.0f} rows/s  "
+            f"files {result['size_mib']:.1f} MiB  peak +{result['peak_mib']:.0f} MiB",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
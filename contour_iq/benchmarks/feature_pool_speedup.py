@@ -0,0 +1,56 @@
+"""
+Speedup of the feature process pool from 1 to N workers.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.feature_pool_speedup --objects 2000 --max-workers 8
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from benchmarks.synthetic import synthetic_polygons
+from pipeline.tasks.preprocessing import preprocess_segmentation
+from pipeline.tasks.contour_extraction import extract_all_contours
+from pipeline.tasks.feature_pool import FeatureProcessPool
+
+
+def synthetic_contours(image_shape, count, seed=0):
+    polygons = synthetic_polygons(image_shape, count, shape="mixed", seed=seed)
+    masks = preprocess_segmentation(np.zeros(image_shape, dtype=np.uint8), polygons, roi=True)
+    return [c for contours in extract_all_contours(masks) for c in contours]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=2000)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--height", type=int, default=2048)
+    parser.add_argument("--width", type=int, default=2448)
+    args = parser.parse_args()
+
+    image_shape = (args.height, args.width, 3)
+    contours = synthetic_contours(image_shape, args.objects)
+
+    curve = []
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        pool = FeatureProcessPool(max_workers=workers)
+        pool.extract(contours, mask_shape=image_shape[:2])  # start the workers
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pool.extract(contours, mask_shape=image_shape[:2])
+            timings.append(time.perf_counter() - start)
+        pool.shutdown()
+
+        best = min(timings)
+        baseline = baseline or best
+        curve.append({"workers": workers, "seconds": round(best, 4), "speedup": round(baseline / best, 2)})
+
+    print(json.dumps({"contours": len(contours), "cpu_count": os.cpu_count(), "curve": curve}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
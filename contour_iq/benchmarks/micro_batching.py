@@ -0,0 +1,70 @@
+"""
+Segmentation throughput and latency of concurrent requests, one model call per request against
+micro-batched calls (see MicroBatcher), with StubSegmenter standing in for the model.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.micro_batching
+    python -m benchmarks.micro_batching --clients 1 4 8 16 --call-ms 40 --image-ms 4 --max-wait-ms 5
+"""
+import sys
+import argparse
+import statistics
+import numpy as np
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from common_utils.micro_batch.core import MicroBatcher
+from pipeline.tasks.segmentation import StubSegmenter, segment_batch
+
+def run_clients(segment, clients: int, requests: int, image: np.ndarray) -> dict:
+    """
+    `clients` threads each segment `requests` images one after the other.
+    """
+    def client(_):
+        latencies = []
+        for _ in range(requests):
+            start = perf_counter()
+            segment(image)
+            latencies.append(perf_counter() - start)
+        return latencies
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = sorted(latency for result in executor.map(client, range(clients)) for latency in result)
+    seconds = perf_counter() - start
+    return {
+        "images_per_s": len(latencies) / seconds,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", nargs="+", type=int, default=[1, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=10, help="Requests per client")
+    parser.add_argument("--call-ms", type=float, default=40, help="Stub model cost per call")
+    parser.add_argument("--image-ms", type=float, default=4, help="Stub model cost per image")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    image[100:200, 100:300] = 255
+
+    for clients in args.clients:
+        segmenter = StubSegmenter(args.call_ms / 1000, args.image_ms / 1000)
+        direct = run_clients(segmenter, clients, args.requests, image)
+
+        segmenter = StubSegmenter(args.call_ms / 1000, args.image_ms / 1000)
+        batcher = MicroBatcher(lambda images: segment_batch(segmenter, images), args.batch_size, args.max_wait_ms / 1000)
+        batched = run_clients(batcher, clients, args.requests, image)
+
+        print(
+            f"{clients:>3} clients  per request {direct['images_per_s']:>6.1f} img/s p50 {direct['p50_ms']:>6.1f} ms p95 {direct['p95_ms']:>6.1f} ms  |  "
+            f"batched {batched['images_per_s']:>6.1f} img/s p50 {batched['p50_ms']:>6.1f} ms p95 {batched['p95_ms']:>6.1f} ms  "
+            f"mean batch {statistics.mean(segmenter.batch_sizes):.1f}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
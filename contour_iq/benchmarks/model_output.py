@@ -0,0 +1,84 @@
+"""
+Cost and accuracy of turning a model's low-resolution mask stack into pipeline input:
+
+    per-mask   the former yolo_segmentation_to_masks: scale, resize and re-threshold each mask
+    masks      resize_mask_stack: threshold once, resize into one block
+    polygons   mask_stack_to_polygons: trace at model resolution, no full-frame mask
+
+Objects are ellipses drawn at full resolution (the ground truth), area-downsampled to the model
+resolution and binarized. Reported are the conversion and pipeline times, and for some features the
+median ratio to the ground truth and the 90th percentile of the relative error.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.model_output
+    python -m benchmarks.model_output --frame 2448x2048 --model-size 612x512 --objects 200
+"""
+import sys
+import argparse
+import cv2
+import numpy as np
+from benchmarks.pipeline_stages import measure, parse_frame
+from pipeline.main import run_contour_pipeline
+from pipeline.tasks.segmentation import mask_stack_to_polygons, resize_mask_stack
+
+FEATURES = ("area", "circularity", "solidity", "eccentricity")
+
+def per_mask(masks: np.ndarray, image_shape: tuple) -> list:
+    segments = []
+    for mask in masks:
+        binary_mask = mask.astype(np.uint8) * 255
+        resized_mask = cv2.resize(binary_mask, (image_shape[1], image_shape[0]), interpolation=cv2.INTER_NEAREST)
+        segments.append((resized_mask > 127).astype(np.uint8))
+    return segments
+
+CONVERSIONS = {"per-mask": per_mask, "masks": resize_mask_stack, "polygons": mask_stack_to_polygons}
+
+def synthetic_model_output(image_shape: tuple, model_shape: tuple, count: int, seed: int = 0) -> tuple:
+    """
+    Returns:
+    - (ground truth ellipses as polygons, (count, h, w) float32 mask stack)
+    """
+    rng = np.random.default_rng(seed)
+    height, width = image_shape[:2]
+    truth, stack = [], np.empty((count, *model_shape), dtype=np.float32)
+    scratch = np.empty((height, width), dtype=np.float32)
+    for i in range(count):
+        axes = (int(rng.integers(15, 120)), int(rng.integers(15, 120)))
+        center = (int(rng.integers(130, width - 130)), int(rng.integers(130, height - 130)))
+        polygon = cv2.ellipse2Poly(center, axes, int(rng.integers(0, 180)), 0, 360, 2)
+        truth.append(polygon.tolist())
+        scratch[:] = 0
+        cv2.fillPoly(scratch, [polygon], 1)
+        stack[i] = cv2.resize(scratch, model_shape[::-1], interpolation=cv2.INTER_AREA)
+    # Models hand out binarized masks
+    return truth, (stack > 0.5).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frame", type=parse_frame, default=(2048, 2448), help="WIDTHxHEIGHT")
+    parser.add_argument("--model-size", type=parse_frame, default=(160, 192), help="Mask resolution, WIDTHxHEIGHT")
+    parser.add_argument("--objects", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    image = np.zeros((*args.frame, 3), dtype=np.uint8)
+    truth, stack = synthetic_model_output(image.shape, args.model_size, args.objects)
+    expected = run_contour_pipeline(image, truth)["results"]
+
+    for name, convert in CONVERSIONS.items():
+        segments, convert_time = measure(lambda: convert(stack, image.shape), args.repeat)
+        output, pipeline_time = measure(lambda: run_contour_pipeline(image, segments), args.repeat)
+        accuracy = []
+        for feature in FEATURES:
+            # Features left out for an object (e.g. eccentricity of outlines with few points) are skipped
+            ratios = np.array([r.get(feature, np.nan) for r in output["results"]]) / np.array([r.get(feature, np.nan) for r in expected])
+            accuracy.append(f"{feature} {np.nanmedian(ratios):.3f}/{np.nanpercentile(np.abs(ratios - 1), 90):.3f}")
+        print(
+            f"{name:<9} convert {convert_time['median'] * 1000:>7.1f} ms  pipeline {pipeline_time['median'] * 1000:>7.1f} ms  "
+            f"objects {len(output['results']):>4}  " + "  ".join(accuracy),
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
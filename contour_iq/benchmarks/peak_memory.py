@@ -0,0 +1,94 @@
+"""
+Peak resident memory of run_contour_pipeline on synthetic workloads.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.peak_memory
+    python -m benchmarks.peak_memory --frames 1920x1080 --objects 100 1000 3000 --inputs polygons labels
+
+Every workload runs in a fresh interpreter. Reported are the peak RSS once the inputs are
+built and after the pipeline ran, and their difference: the memory the pipeline itself needed.
+"""
+import sys
+import json
+import argparse
+import resource
+import subprocess
+from typing import Dict
+
+INPUTS = ("polygons", "labels")
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_workload(frame: tuple, count: int, input_kind: str, roi: bool) -> Dict:
+    """
+    Build the inputs and run the pipeline once, in the current process.
+    """
+    import cv2
+    import numpy as np
+    from benchmarks.synthetic import synthetic_image, synthetic_polygons
+    from pipeline.main import run_contour_pipeline
+
+    image_shape = (*frame, 3)
+    image = synthetic_image(image_shape)
+    polygons = synthetic_polygons(image_shape, count, shape="blob")
+    segments = polygons
+    if input_kind == "labels":
+        segments = np.zeros(frame, dtype=np.int32)
+        for label, polygon in enumerate(polygons, start=1):
+            cv2.fillPoly(segments, [np.asarray(polygon, dtype=np.int32)], color=label)
+
+    before = peak_rss_mib()
+    output = run_contour_pipeline(image, segments, roi=roi)
+    after = peak_rss_mib()
+    return {
+        "frame": list(frame), "objects": count, "input": input_kind, "roi": roi,
+        "contours": len(output["contours"]),
+        "inputs_mib": round(before, 1), "peak_mib": round(after, 1), "pipeline_mib": round(after - before, 1),
+    }
+
+def parse_frame(value: str) -> tuple:
+    width, height = value.lower().split("x")
+    return int(height), int(width)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", nargs="+", type=parse_frame, default=[(1080, 1920)], help="Frame sizes as WIDTHxHEIGHT")
+    parser.add_argument("--objects", nargs="+", type=int, default=[100, 1000, 3000])
+    parser.add_argument("--inputs", nargs="+", choices=INPUTS, default=list(INPUTS))
+    parser.add_argument("--full-frame", action="store_true", help="Run with roi=False (one full-frame mask per object)")
+    parser.add_argument("--output", help="JSON file to write")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        frame, count, input_kind, roi = json.loads(args.child)
+        print(json.dumps(run_workload(tuple(frame), count, input_kind, roi)))
+        return
+
+    results = []
+    for frame in args.frames:
+        for count in args.objects:
+            for input_kind in args.inputs:
+                child = json.dumps([frame, count, input_kind, not args.full_frame])
+                completed = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.peak_memory", "--child", child],
+                    capture_output=True, text=True, check=True,
+                )
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                results.append(result)
+                print(
+                    f"{frame[1]}x{frame[0]:<5} {count:>6} {input_kind:<9} roi={result['roi']!s:<5} "
+                    f"inputs {result['inputs_mib']:>8.1f} MiB  peak {result['peak_mib']:>8.1f} MiB  "
+                    f"pipeline {result['pipeline_mib']:>8.1f} MiB",
+                    file=sys.stderr,
+                )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Throughput of the write-behind result writer, and the time requests spend handing it a run.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.persistence_throughput
+    python -m benchmarks.persistence_throughput --runs 200 --objects 100
+
+Writes to a temporary SQLite database unless DATABASE_NAME points to PostgreSQL (see
+contour_iq/settings.py), in which case the tables must exist (manage.py migrate) and the
+written runs are deleted afterwards.
+"""
+import os
+import sys
+import argparse
+import tempfile
+import statistics
+from time import perf_counter
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--objects", type=int, default=100, help="Objects per run")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "contour_iq.settings")
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    temporary = None
+    if not os.getenv("DATABASE_NAME"):
+        temporary = tempfile.TemporaryDirectory()
+        settings.DATABASES["default"]["NAME"] = os.path.join(temporary.name, "benchmark.sqlite3")
+    django.setup()
+    if temporary:
+        call_command("migrate", "pipeline", verbosity=0)
+
+    import numpy as np
+    from benchmarks.synthetic import synthetic_polygons
+    from pipeline.main import run_contour_pipeline
+    from pipeline.models import AnalysisRun
+    from pipeline.tasks.persistence import ResultWriter
+    from pipeline.tasks.persistence.core import run_record
+
+    image_shape = (1080, 1920, 3)
+    output = run_contour_pipeline(np.zeros(image_shape, dtype=np.uint8), synthetic_polygons(image_shape, args.objects, seed=0))
+    record = run_record(output, "benchmark", image_shape)
+
+    writer = ResultWriter(spill_dir=tempfile.mkdtemp())
+    submit = []
+    start = perf_counter()
+    for _ in range(args.runs):
+        began = perf_counter()
+        writer.submit(record)
+        submit.append(perf_counter() - began)
+    written = writer.flush()
+    seconds = perf_counter() - start
+    if not written:
+        sys.exit(f"Writing failed, runs are left in {writer.spill_dir}")
+
+    objects = args.runs * len(output["results"])
+    features = sum(not isinstance(value, bool) for value in output["results"][0].values())
+    print(
+        f"{args.runs} runs, {objects} objects ({objects * features} feature rows) in {seconds:.2f} s: "
+        f"{objects / seconds:.0f} objects/s, submit median {statistics.median(submit) * 1e6:.0f} us "
+        f"max {max(submit) * 1e6:.0f} us",
+        file=sys.stderr,
+    )
+    if not temporary:
+        AnalysisRun.objects.filter(source="benchmark").delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Time every pipeline stage on synthetic segmentation workloads and write the results as JSON.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.pipeline_stages --output stages.json
+    python -m benchmarks.pipeline_stages --quick --output stages.json
+    python -m benchmarks.compare baseline.json stages.json
+
+Each workload is one (frame size, object count, shape family, input kind) combination.
+Stage timings are the minimum and median over --repeat runs, in seconds.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import statistics
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Tuple
+
+import cv2
+import numpy as np
+from benchmarks.synthetic import SHAPES, synthetic_image, synthetic_polygons, polygons_to_masks
+from pipeline.main import run_contour_pipeline
+from pipeline.tasks.preprocessing import preprocess_segmentation
+from pipeline.tasks.contour_extraction import extract_all_contours
+from pipeline.tasks.feature_extraction import extract_shape_features, extract_shape_features_batch, feature_table_to_records
+from pipeline.tasks.feature_pool import core as feature_pool
+from pipeline.tasks.analysis import analyze_contour, analyze_contours_batch, attribute_table_to_records
+from pipeline.tasks.annotation import annotate_image
+
+FRAME_SIZES = [(480, 640), (960, 1280), (1080, 1920), (2048, 2448)]
+OBJECT_COUNTS = [10, 100, 1000, 5000]
+
+QUICK_FRAME_SIZES = [(480, 640), (2048, 2448)]
+QUICK_OBJECT_COUNTS = [10, 500]
+
+INPUTS = ("polygons", "masks")
+
+def measure(func: Callable, repeat: int):
+    """
+    Run `func` `repeat` times.
+
+    Returns:
+    - (result of the last run, {"min": seconds, "median": seconds})
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, {"min": round(min(timings), 6), "median": round(statistics.median(timings), 6)}
+
+def benchmark_workload(
+    image_shape: tuple,
+    count: int,
+    shape: str,
+    input_kind: str,
+    repeat: int,
+    seed: int = 0,
+) -> Dict:
+    """
+    Time each stage on one synthetic workload, every stage fed with the previous stage's output.
+    """
+    image = synthetic_image(image_shape, seed)
+    mask_shape = image_shape[:2]
+    polygons = synthetic_polygons(image_shape, count, shape=shape, seed=seed)
+    segments = polygons_to_masks(polygons, image_shape) if input_kind == "masks" else polygons
+
+    stages = {}
+    masks, stages["preprocess_segmentation"] = measure(lambda: preprocess_segmentation(image, segments, roi=True), repeat)
+    found, stages["extract_all_contours"] = measure(lambda: extract_all_contours(masks), repeat)
+    contours = [contour for contours in found for contour in contours]
+
+    records, stages["extract_shape_features"] = measure(
+        lambda: [extract_shape_features(contour, mask_shape=mask_shape) for contour in contours], repeat
+    )
+    table, stages["extract_shape_features_batch"] = measure(
+        lambda: extract_shape_features_batch(contours, mask_shape=mask_shape), repeat
+    )
+
+    attributes, stages["analyze_contour"] = measure(lambda: [analyze_contour(features) for features in records], repeat)
+    _, stages["analyze_contours_batch"] = measure(lambda: attribute_table_to_records(analyze_contours_batch(table)), repeat)
+
+    _, stages["annotate_image"] = measure(lambda: annotate_image(image, contours, attributes), repeat)
+
+    _, stages["run_contour_pipeline"] = measure(lambda: run_contour_pipeline(image, segments), repeat)
+    _, stages["run_contour_pipeline_rendered"] = measure(
+        lambda: run_contour_pipeline(image, segments)["annotated_image"], repeat
+    )
+
+    return {
+        "frame": list(mask_shape),
+        "objects": count,
+        "shape": shape,
+        "input": input_kind,
+        "contours": len(contours),
+        "points": int(sum(len(contour) for contour in contours)),
+        "stages": stages,
+    }
+
+def git_revision() -> Tuple[str, bool]:
+    """
+    Current commit and whether the working tree has changes, (None, False) outside of git.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+def environment() -> Dict:
+    commit, dirty = git_revision()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "feature_workers": feature_pool.FEATURE_WORKERS,
+    }
+
+def run_benchmarks(
+    frame_sizes: List[Tuple[int, int]],
+    object_counts: List[int],
+    shapes: List[str],
+    inputs: List[str],
+    repeat: int = 3,
+    max_mask_bytes: int = 1 << 30,
+    seed: int = 0,
+    progress: Callable[[str], None] = None,
+) -> Dict:
+    """
+    Run every workload of the grid.
+
+    Mask inputs hold one full frame per object, workloads above `max_mask_bytes` are
+    listed with a "skipped" reason instead of stage timings.
+    """
+    workloads = []
+    for height, width in frame_sizes:
+        for count in object_counts:
+            for shape in shapes:
+                for input_kind in inputs:
+                    if input_kind == "masks" and count * height * width > max_mask_bytes:
+                        workloads.append({
+                            "frame": [height, width], "objects": count, "shape": shape, "input": input_kind,
+                            "skipped": f"masks need {count * height * width / 2**30:.1f} GiB (--max-mask-bytes)",
+                        })
+                        continue
+                    if progress:
+                        progress(f"{width}x{height} {count} {shape} {input_kind}")
+                    workloads.append(benchmark_workload((height, width, 3), count, shape, input_kind, repeat, seed))
+    return {"environment": environment(), "repeat": repeat, "seed": seed, "workloads": workloads}
+
+def parse_frame(value: str) -> Tuple[int, int]:
+    width, height = value.lower().split("x")
+    return int(height), int(width)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="stages.json", help="JSON file to write")
+    parser.add_argument("--quick", action="store_true", help="Small grid, for a fast check")
+    parser.add_argument("--frames", nargs="+", type=parse_frame, help="Frame sizes as WIDTHxHEIGHT")
+    parser.add_argument("--objects", nargs="+", type=int, help="Object counts")
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=["blob", "fragment"])
+    parser.add_argument("--inputs", nargs="+", choices=INPUTS, default=["polygons"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-mask-bytes", type=int, default=1 << 30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    frames = args.frames or (QUICK_FRAME_SIZES if args.quick else FRAME_SIZES)
+    objects = args.objects or (QUICK_OBJECT_COUNTS if args.quick else OBJECT_COUNTS)
+    results = run_benchmarks(
+        frames, objects, args.shapes, args.inputs,
+        repeat=args.repeat, max_mask_bytes=args.max_mask_bytes, seed=args.seed,
+        progress=lambda name: print(f"[Benchmark] {name}", file=sys.stderr),
+    )
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[Benchmark] Wrote {len(results['workloads'])} workloads to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
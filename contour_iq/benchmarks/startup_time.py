@@ -0,0 +1,102 @@
+"""
+Startup time of an API worker: importing api.main (which creates the app), then the first and
+second /analyze_contours requests.
+
+Usage (from the contour_iq directory):
+    python -m benchmarks.startup_time
+    python -m benchmarks.startup_time --modes lazy warm preload --repeat 5
+
+Modes:
+    lazy     CONTOUR_IQ_WARMUP=0, nothing done before the first request
+    warm     CONTOUR_IQ_WARMUP=1 (default), the pipeline is warmed up when the app is created
+    preload  warm, and the segmentation model is loaded when the app is created
+
+Every measurement runs in a fresh interpreter. Also reported: whether ultralytics and torch
+were imported, and the peak RSS of the worker.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from time import perf_counter
+
+MODES = {
+    "lazy": {"CONTOUR_IQ_WARMUP": "0", "CONTOUR_IQ_PRELOAD_SEGMENTER": "0"},
+    "warm": {"CONTOUR_IQ_WARMUP": "1", "CONTOUR_IQ_PRELOAD_SEGMENTER": "0"},
+    "preload": {"CONTOUR_IQ_WARMUP": "1", "CONTOUR_IQ_PRELOAD_SEGMENTER": "1"},
+}
+
+REQUEST = {
+    "input_shape": [480, 640, 3],
+    "contours": [[[10, 10], [100, 10], [100, 60], [10, 60]], [[200, 200], [260, 210], [230, 300]]],
+    "thresholds": [],
+}
+
+def run_child() -> dict:
+    """
+    Import the app and send two requests, in the current process.
+    """
+    import asyncio
+    import resource
+
+    start = perf_counter()
+    import api.main
+    app_seconds = perf_counter() - start
+
+    import httpx
+
+    async def post() -> float:
+        transport = httpx.ASGITransport(app=api.main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            start = perf_counter()
+            response = await client.post("/api/v1/analyze_contours", json=REQUEST)
+            response.raise_for_status()
+            return perf_counter() - start
+
+    first, second = asyncio.run(post()), asyncio.run(post())
+    return {
+        "app_s": app_seconds, "first_request_s": first, "second_request_s": second,
+        "ultralytics": "ultralytics" in sys.modules, "torch": "torch" in sys.modules,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="JSON file to write")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child()))
+        return
+
+    results = {}
+    for mode in args.modes:
+        runs = []
+        for _ in range(args.repeat):
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup_time", "--child"],
+                env={**os.environ, **MODES[mode]}, capture_output=True, text=True, check=True,
+            )
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        result = {key: statistics.median(run[key] for run in runs) for key in ("app_s", "first_request_s", "second_request_s", "peak_rss_mib")}
+        result.update(ultralytics=runs[0]["ultralytics"], torch=runs[0]["torch"])
+        results[mode] = result
+        print(
+            f"{mode:<8} app {result['app_s'] * 1000:>7.0f} ms  first request {result['first_request_s'] * 1000:>6.1f} ms  "
+            f"second {result['second_request_s'] * 1000:>6.1f} ms  peak {result['peak_rss_mib']:>6.1f} MiB  "
+            f"ultralytics={result['ultralytics']} torch={result['torch']}",
+            file=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
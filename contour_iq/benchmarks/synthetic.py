@@ -0,0 +1,84 @@
+"""
+Reproducible synthetic segmentation workloads: frames with polygons or binary masks.
+
+Shapes:
+- blob: convex hull of random points around a center, like boxes, stones, bags
+- fragment: long thin jagged strip along a random walk, like wires, sticks, shards
+- mixed: half of each
+"""
+import cv2
+import numpy as np
+from typing import List, Tuple
+
+SHAPES = ("blob", "fragment", "mixed")
+
+def object_size(image_shape: tuple, count: int) -> float:
+    """
+    Typical object radius so that `count` objects cover about a third of the frame.
+    """
+    height, width = image_shape[:2]
+    return float(np.clip(np.sqrt(height * width / (3 * np.pi * max(count, 1))), 4, min(height, width) / 4))
+
+def blob_polygon(rng: np.random.Generator, center: np.ndarray, radius: float) -> np.ndarray:
+    points = center + rng.normal(0, radius / 2, (int(rng.integers(8, 40)), 2))
+    return cv2.convexHull(points.astype(np.float32)).reshape(-1, 2)
+
+def fragment_polygon(rng: np.random.Generator, center: np.ndarray, radius: float) -> np.ndarray:
+    steps = int(rng.integers(6, 30))
+    step_length = 3 * radius / steps
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.35, steps))
+    spine = center + np.cumsum(np.stack([np.cos(heading), np.sin(heading)], axis=1) * step_length, axis=0)
+    spine -= spine.mean(axis=0) - center
+
+    # Offset the spine on both sides by a jagged half width
+    tangent = np.gradient(spine, axis=0)
+    normal = np.stack([-tangent[:, 1], tangent[:, 0]], axis=1)
+    normal /= np.maximum(np.linalg.norm(normal, axis=1, keepdims=True), 1e-9)
+    half_width = np.maximum(radius * 0.08, 1.5) * rng.uniform(0.5, 1.5, (steps, 1))
+    return np.concatenate([spine + normal * half_width, (spine - normal * half_width)[::-1]])
+
+def synthetic_polygons(image_shape: tuple, count: int, shape: str = "mixed", seed: int = 0) -> List[List[Tuple[int, int]]]:
+    """
+    Generate `count` polygons of the given shape family, some of them crossing the frame border.
+
+    Parameters:
+    - image_shape: Shape of the frame
+    - count: Number of objects
+    - shape: One of SHAPES
+    - seed: Random seed, the same arguments always give the same polygons
+
+    Returns:
+    - List of polygons as lists of (x, y) points
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape '{shape}', expected one of {SHAPES}")
+
+    rng = np.random.default_rng(seed)
+    height, width = image_shape[:2]
+    radius = object_size(image_shape, count)
+    polygons = []
+    for i in range(count):
+        center = rng.uniform((-radius / 2, -radius / 2), (width + radius / 2, height + radius / 2))
+        size = radius * rng.uniform(0.5, 1.5)
+        fragment = shape == "fragment" or (shape == "mixed" and i % 2)
+        polygon = fragment_polygon(rng, center, size) if fragment else blob_polygon(rng, center, size)
+        polygons.append([tuple(p) for p in np.round(polygon).astype(int).tolist()])
+    return polygons
+
+def polygons_to_masks(polygons: List[List[Tuple[int, int]]], image_shape: tuple) -> List[np.ndarray]:
+    """
+    Rasterize polygons into full-frame binary masks, as a segmentation model would return them.
+    """
+    masks = []
+    for polygon in polygons:
+        mask = np.zeros(image_shape[:2], dtype=np.uint8)
+        cv2.fillPoly(mask, [np.asarray(polygon, dtype=np.int32)], color=1)
+        masks.append(mask)
+    return masks
+
+def synthetic_image(image_shape: tuple, seed: int = 0) -> np.ndarray:
+    """
+    Noisy frame, so rendering stages do not work on an all-zero image.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, image_shape, dtype=np.uint8)
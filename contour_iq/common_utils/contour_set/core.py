@@ -0,0 +1,157 @@
+import numpy as np
+from typing import Iterator, List, Sequence, Union
+
+# Wire dtype of points and offsets: little-endian int32
+WIRE_DTYPE = np.dtype("<i4")
+
+class ContourSet:
+    """
+    Ragged set of polygons stored in one contiguous point array.
+
+    - points: (N, 2) int32 array of (x, y) points, polygon after polygon
+    - offsets: (n + 1,) int64 array, polygon i is points[offsets[i]:offsets[i + 1]]
+
+    Indexing returns views, no points are copied. Slicing with step 1 returns a ContourSet
+    sharing the same points. The (N, 2) views are accepted by the OpenCV contour functions.
+    """
+
+    def __init__(self, points: np.ndarray, offsets: np.ndarray):
+        points = np.asarray(points)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        if points.ndim != 2 or points.shape[1] != 2:
+            raise ValueError(f"points must have shape (N, 2), got {points.shape}")
+        if offsets.ndim != 1 or len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(points):
+            raise ValueError("offsets must start at 0 and end at the number of points")
+        if np.any(np.diff(offsets) < 0):
+            raise ValueError("offsets must be non-decreasing")
+        self.points = points
+        self.offsets = offsets
+        self._bboxes = None
+
+    @classmethod
+    def from_buffers(cls, points: Union[bytes, memoryview], offsets: Union[bytes, memoryview]) -> "ContourSet":
+        """
+        Wrap little-endian int32 buffers without copying them.
+
+        Parameters:
+        - points: Flat x0, y0, x1, y1, ... coordinates
+        - offsets: n + 1 point offsets, starting at 0
+        """
+        if len(points) % (2 * WIRE_DTYPE.itemsize) or len(offsets) % WIRE_DTYPE.itemsize:
+            raise ValueError("Buffer sizes must be multiples of the int32 (x, y) point size")
+        return cls(np.frombuffer(points, dtype=WIRE_DTYPE).reshape(-1, 2), np.frombuffer(offsets, dtype=WIRE_DTYPE))
+
+    @classmethod
+    def from_polygons(cls, polygons: Sequence[Sequence[Sequence[int]]]) -> "ContourSet":
+        """
+        Pack polygons given as lists of (x, y) points or as point arrays.
+        """
+        counts = np.fromiter((len(p) for p in polygons), dtype=np.int64, count=len(polygons))
+        offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if offsets[-1] == 0:
+            return cls(np.zeros((0, 2), dtype=np.int32), offsets)
+        points = np.concatenate([np.asarray(p, dtype=np.int32).reshape(-1, 2) for p in polygons if len(p)])
+        return cls(points, offsets)
+
+    @classmethod
+    def concatenate(cls, sets: Sequence["ContourSet"]) -> "ContourSet":
+        """
+        One ContourSet holding the contours of `sets`, in order.
+        """
+        if not sets:
+            return cls(np.zeros((0, 2), dtype=np.int32), np.zeros(1, dtype=np.int64))
+        offsets = [np.zeros(1, dtype=np.int64)]
+        total = 0
+        for contour_set in sets:
+            offsets.append(contour_set.offsets[1:] + total)
+            total += len(contour_set.points)
+        return cls(np.concatenate([contour_set.points for contour_set in sets]), np.concatenate(offsets))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Number of points of each contour.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def bboxes(self) -> np.ndarray:
+        """
+        (n, 4) int64 bounding boxes as x, y, w, h, same as cv2.boundingRect. Computed once.
+        Contours without points get an all-zero box.
+        """
+        if self._bboxes is None:
+            bboxes = np.zeros((len(self), 4), dtype=np.int64)
+            filled = self.counts > 0
+            if filled.any():
+                starts = self.offsets[:-1][filled]
+                low = np.minimum.reduceat(self.points, starts, axis=0)
+                high = np.maximum.reduceat(self.points, starts, axis=0)
+                bboxes[filled, :2] = low
+                bboxes[filled, 2:] = high - low + 1
+            self._bboxes = bboxes
+        return self._bboxes
+
+    def take(self, indices: Sequence[int]) -> "ContourSet":
+        """
+        New ContourSet with the contours at `indices`, in that order (the points are copied).
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = self.counts[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        # Point index of every output point: its contour's start plus its rank in the contour
+        starts = np.repeat(self.offsets[indices] - offsets[:-1], counts)
+        return ContourSet(self.points[starts + np.arange(offsets[-1])], offsets)
+
+    def translate(self, dx: int, dy: int) -> "ContourSet":
+        """
+        All contours moved by (dx, dy), in one vectorized pass.
+        """
+        return ContourSet(self.points + np.array([dx, dy], dtype=self.points.dtype), self.offsets)
+
+    def scale(self, sx: float, sy: float = None) -> "ContourSet":
+        """
+        All contours scaled around the origin, rounded back to integer points.
+        """
+        factors = np.array([sx, sx if sy is None else sy])
+        return ContourSet(np.rint(self.points * factors).astype(np.int32), self.offsets)
+
+    def clip(self, shape: tuple) -> "ContourSet":
+        """
+        Points clamped to a frame of the given (height, width, ...) shape.
+        """
+        limits = np.array([shape[1] - 1, shape[0] - 1], dtype=self.points.dtype)
+        return ContourSet(np.clip(self.points, 0, limits), self.offsets)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[np.ndarray, "ContourSet"]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("ContourSet slices must be contiguous")
+            stop = max(stop, start)
+            first, last = self.offsets[start], self.offsets[stop]
+            return ContourSet(self.points[first:last], self.offsets[start:stop + 1] - first)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.points[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        points, offsets = self.points, self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield points[start:end]
+
+    def to_buffers(self) -> tuple:
+        """
+        (points, offsets) as little-endian int32 bytes, the inverse of from_buffers.
+        """
+        return self.points.astype(WIRE_DTYPE, copy=False).tobytes(), self.offsets.astype(WIRE_DTYPE).tobytes()
+
+    def to_polygons(self) -> List[List[List[int]]]:
+        return [polygon.tolist() for polygon in self]
@@ -0,0 +1,59 @@
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+# Threads running CPU-bound request work (contour pipeline, model inference) off the event loop
+CPU_WORKERS = int(os.getenv("CONTOUR_IQ_CPU_WORKERS", str(os.cpu_count() or 4)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide bounded executor for CPU-bound request work, created on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="contour-iq-cpu")
+        return _executor
+
+async def run_in_cpu_executor(func: Callable, *args, **kwargs):
+    """
+    Run `func(*args, **kwargs)` on the CPU executor in a copy of the current context, without
+    blocking the event loop. Callers are responsible for bounding concurrency (see ConcurrencyLimiter).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_cpu_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+class ConcurrencyLimiter:
+    """
+    Caps how many requests of one endpoint run at the same time; further requests wait their turn.
+    The limit is read from CONTOUR_IQ_<NAME>_CONCURRENCY and defaults to CONTOUR_IQ_CPU_WORKERS.
+    """
+
+    def __init__(self, name: str, limit: int = None):
+        self.name = name
+        self.limit = limit or int(os.getenv(f"CONTOUR_IQ_{name.upper()}_CONCURRENCY", str(CPU_WORKERS)))
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # One semaphore per event loop, asyncio primitives cannot be shared between loops
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.limit)
+        return self._semaphores[loop]
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` on the CPU executor once a slot is free, without blocking the event loop.
+        """
+        async with self.semaphore:
+            return await run_in_cpu_executor(func, *args, **kwargs)
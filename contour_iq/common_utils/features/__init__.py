@@ -2,4 +2,5 @@ from .area.core import contour_area
 from .perimeter.core import contour_perimeter
 from .circularity.core import contour_circularity
 from .aspect_ratio.core import contour_aspect_ratio
-from .extent.core import contour_extent
\ No newline at end of file
+from .extent.core import contour_extent
+from .skeleton_length.core import contour_skeleton_length
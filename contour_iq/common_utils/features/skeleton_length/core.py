@@ -0,0 +1,29 @@
+import cv2
+import numpy as np
+from skimage.morphology import skeletonize
+
+# The crop is skeletonized at the fixed scale the whole frame used to be, so lengths stay
+# comparable with the rule thresholds (skeleton_length > 300). Finer scales are not used: the
+# corner branches of thick objects lengthen the skeleton by up to 20%, enough to move objects
+# of about 200 px across the fractured threshold.
+SKELETON_SCALE = 0.15
+
+def contour_skeleton_length(contour: np.ndarray, mask_shape: tuple):
+    """
+    Approximate skeleton length (in full-resolution pixels) of a filled contour.
+    Only the contour's bounding box, clipped to `mask_shape`, is rasterized.
+    """
+    x, y, w, h = cv2.boundingRect(contour)
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, mask_shape[1]), min(y + h, mask_shape[0])
+    if x1 <= x0 or y1 <= y0:
+        return 0
+
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    cv2.drawContours(mask, [contour], -1, 1, thickness=cv2.FILLED, offset=(-x0, -y0))
+
+    scale = SKELETON_SCALE
+    size = (max(int(round((x1 - x0) * scale)), 1), max(int(round((y1 - y0) * scale)), 1))
+    small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST)
+    small_skeleton = skeletonize(small_mask).astype(np.uint8)
+    return int(np.count_nonzero(small_skeleton) / scale)
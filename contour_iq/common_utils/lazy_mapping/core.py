@@ -0,0 +1,97 @@
+import threading
+from collections.abc import MutableMapping, Sequence
+from typing import Any, Callable, Dict, Iterator, List, Union
+
+class LazyMapping(MutableMapping):
+    """
+    Mapping whose expensive entries are computed on first access and then cached. Entries can
+    be set and deleted like in a dict; setting an entry replaces its factory.
+
+    Parameters:
+    - values: Entries available right away
+    - factories: Entries computed on demand, as key -> function without arguments
+
+    Keys keep the order of `values` followed by `factories`. Iterating over keys does not
+    compute anything, reading values (including items() and values()) does.
+    """
+
+    def __init__(self, values: Dict[str, Any] = None, factories: Dict[str, Callable[[], Any]] = None):
+        self._values = dict(values or {})
+        self._factories = dict(factories or {})
+        self._keys = list(self._values) + [key for key in self._factories if key not in self._values]
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+        with self._lock:
+            if key not in self._values:
+                if key not in self._factories:
+                    raise KeyError(key)
+                self._values[key] = self._factories.pop(key)()
+            return self._values[key]
+
+    def __setitem__(self, key: str, value: Any):
+        with self._lock:
+            if key not in self._values and key not in self._factories:
+                self._keys.append(key)
+            self._factories.pop(key, None)
+            self._values[key] = value
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            if key not in self._values and key not in self._factories:
+                raise KeyError(key)
+            self._values.pop(key, None)
+            self._factories.pop(key, None)
+            self._keys.remove(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def is_computed(self, key: str) -> bool:
+        """
+        Whether the entry is available without computing it.
+        """
+        return key in self._values
+
+    def __repr__(self) -> str:
+        entries = ", ".join(f"{key!r}: {'...' if key not in self._values else type(self._values[key]).__name__}" for key in self._keys)
+        return f"{type(self).__name__}({{{entries}}})"
+
+
+class LazySequence(Sequence):
+    """
+    Read-only sequence whose items are computed on every access and never cached, so
+    iterating over it holds one item at a time.
+
+    Parameters:
+    - length: Number of items
+    - item: Function computing the item at an index
+    """
+
+    def __init__(self, length: int, item: Callable[[int], Any]):
+        self._length = length
+        self._item = item
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Any, List[Any]]:
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._item(index)
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(self._length):
+            yield self._item(index)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._length} items)"
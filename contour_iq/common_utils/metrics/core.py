@@ -0,0 +1,186 @@
+import os
+import bisect
+import threading
+import contextvars
+from time import perf_counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence
+
+# Set CONTOUR_IQ_METRICS=0 to turn timers into no-ops
+METRICS_ENABLED = os.getenv("CONTOUR_IQ_METRICS", "1") != "0"
+
+STAGE = "stage"
+FEATURE = "feature"
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FEATURE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+class Histogram:
+    """
+    Thread-safe histogram with one label, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str, buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # Per-bucket (non cumulative) counts, the last one for +Inf, then sum
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total!r}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+class Counter:
+    """
+    Thread-safe counter with one label, rendered in the Prometheus text format.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value: str, amount: int = 1):
+        with self._lock:
+            self._series[label_value] = self._series.get(label_value, 0) + amount
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for label_value, count in sorted(series.items()):
+            lines.append(f'{self.name}{{{self.label}="{label_value}"}} {count}')
+        return lines
+
+HISTOGRAMS = {
+    STAGE: Histogram("contour_iq_stage_seconds", "Duration of pipeline stages.", "stage", STAGE_BUCKETS),
+    FEATURE: Histogram("contour_iq_feature_seconds", "Duration of shape feature computations.", "feature", FEATURE_BUCKETS),
+}
+
+COUNTERS = {
+    "feature_cache": Counter("contour_iq_feature_cache_total", "Feature cache lookups and evictions.", "result"),
+    "persistence": Counter("contour_iq_persisted_runs_total", "Analysis runs stored, spilled to disk or dropped.", "result"),
+}
+
+# Timings of the current request (see timing_scope), None outside of a scope
+_request_timings = contextvars.ContextVar("contour_iq_request_timings", default=None)
+
+class Timer:
+    """
+    Context manager recording one duration into a histogram and into the current timing scope.
+    """
+    __slots__ = ("kind", "name", "start")
+
+    def __init__(self, kind: str, name: str):
+        self.kind = kind
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, perf_counter() - self.start, self.kind)
+        return False
+
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+def record(name: str, seconds: float, kind: str = STAGE):
+    """
+    Record a duration measured by the caller, e.g. the summed time of interleaved stages,
+    into the histogram and the current timing scope.
+    """
+    if not METRICS_ENABLED:
+        return
+    HISTOGRAMS[kind].observe(name, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        kind_timings = timings[kind]
+        kind_timings[name] = kind_timings.get(name, 0.0) + seconds
+
+def timed(name: str, kind: str = STAGE):
+    """
+    Time a block: `with timed("preprocessing"): ...`
+
+    Parameters:
+    - name: Stage or feature name, used as the histogram label
+    - kind: STAGE or FEATURE
+
+    Returns:
+    - A context manager, a shared no-op one when metrics are disabled
+    """
+    if not METRICS_ENABLED:
+        return NULL_TIMER
+    return Timer(kind, name)
+
+@contextmanager
+def timing_scope(timings: Dict[str, Dict[str, float]] = None) -> Iterator[Dict[str, Dict[str, float]]]:
+    """
+    Collect the timings of the current request (thread or task) apart from concurrent ones.
+
+    Parameters:
+    - timings: Timings of an earlier scope to add to, e.g. for work deferred after a request
+
+    Yields:
+    - Dictionary {kind: {name: seconds}} filled by the timers run inside the scope
+    """
+    if timings is None:
+        timings = {STAGE: {}, FEATURE: {}}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+def render_metrics() -> str:
+    """
+    All histograms and counters in the Prometheus text exposition format.
+    """
+    lines = []
+    for histogram in HISTOGRAMS.values():
+        lines.extend(histogram.render())
+    for counter in COUNTERS.values():
+        lines.extend(counter.render())
+    return "\n".join(lines) + "\n"
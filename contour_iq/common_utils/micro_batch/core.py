@@ -0,0 +1,92 @@
+import os
+import queue
+import threading
+from time import perf_counter
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+# Largest batch handed to the batch function, 1 turns batching off
+MAX_BATCH_SIZE = int(os.getenv("CONTOUR_IQ_INFERENCE_BATCH_SIZE", "8"))
+
+# Longest time the first call of a batch waits for more calls to join it
+MAX_WAIT_MS = float(os.getenv("CONTOUR_IQ_INFERENCE_MAX_WAIT_MS", "5"))
+
+class MicroBatcher:
+    """
+    Gathers concurrent calls into batches for a function that handles a list of items at once.
+
+    A batch starts with the first waiting call and runs once it holds `max_batch_size` items or
+    `max_wait` seconds after it started, whichever comes first. Each caller gets its own result
+    back; when the batch function raises, every caller of the batch gets the exception.
+
+    The batches run on one daemon thread, started on first use (and again in a forked child),
+    so creating a batcher before a server forks its workers is safe.
+
+    Parameters:
+    - func: Called with a list of items, returns one result per item in the same order
+    - max_batch_size: Defaults to CONTOUR_IQ_INFERENCE_BATCH_SIZE
+    - max_wait: Seconds, defaults to CONTOUR_IQ_INFERENCE_MAX_WAIT_MS
+    - name: Name of the thread
+    """
+
+    def __init__(self, func: Callable[[List[Any]], List[Any]], max_batch_size: int = None, max_wait: float = None, name: str = "micro-batch"):
+        self.func = func
+        self.max_batch_size = max(max_batch_size or MAX_BATCH_SIZE, 1)
+        self.max_wait = MAX_WAIT_MS / 1000 if max_wait is None else max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """
+        Queue one item, returns a future of its result.
+        """
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item: Any) -> Any:
+        """
+        Result of one item, blocks until its batch ran.
+        """
+        return self.submit(item).result()
+
+    def _collect(self, source: queue.Queue) -> list:
+        batch = [source.get()]
+        deadline = perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(source.get(timeout=max(deadline - perf_counter(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, source: queue.Queue):
+        while True:
+            # Calls cancelled while waiting are dropped from the batch
+            batch = [(item, future) for item, future in self._collect(source) if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items, futures = zip(*batch)
+            items = list(items)
+            try:
+                results = self.func(items)
+                if len(results) != len(items):
+                    raise ValueError(f"{self.name}: {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
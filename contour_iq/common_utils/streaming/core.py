@@ -0,0 +1,60 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Iterator, List
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from common_utils.executor.core import ConcurrencyLimiter, run_in_cpu_executor
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+logger = logging.getLogger(__name__)
+
+def wants_ndjson(request: Request) -> bool:
+    """
+    Whether the client asked for a streamed response, with `?stream=true` or `Accept: application/x-ndjson`.
+    """
+    if request.query_params.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+async def iterate_in_executor(chunks: Iterator[List[Any]], limiter: ConcurrencyLimiter) -> AsyncIterator[List[Any]]:
+    """
+    Pull chunks from a blocking iterator on the CPU executor, one chunk per executor call.
+
+    The stream holds one slot of `limiter` from its first chunk until it ends or is closed,
+    so at most `limiter.limit` streams of the endpoint are open at once, however slowly their
+    clients read.
+    """
+    done = object()
+    async with limiter.semaphore:
+        while True:
+            chunk = await run_in_cpu_executor(next, chunks, done)
+            if chunk is done:
+                return
+            yield chunk
+
+def ndjson_response(
+    chunks: Iterator[List[Any]],
+    encode: Callable[[Any], str],
+    limiter: ConcurrencyLimiter,
+) -> StreamingResponse:
+    """
+    Stream records as newline-delimited JSON, one chunk of lines as soon as it is computed.
+
+    Parameters:
+    - chunks: Blocking iterator of record lists, advanced on the CPU executor
+    - encode: Serializes one record to a JSON string (without newline)
+    - limiter: Concurrency limit of the endpoint
+
+    An error after the response started is reported as a last {"error": ...} line.
+    """
+    async def lines():
+        try:
+            async for chunk in iterate_in_executor(chunks, limiter):
+                if chunk:
+                    yield "".join(encode(record) + "\n" for record in chunk)
+        except Exception as e:
+            logger.exception("Streaming response failed")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
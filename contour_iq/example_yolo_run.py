@@ -6,28 +6,15 @@ from glob import glob
 from ultralytics import YOLO
 from PIL import Image
 from pipeline.main import run_contour_pipeline
+from pipeline.tasks.segmentation import yolo_segmentation_to_polygons
 
 
-def yolo_segmentation_to_masks(results, image_shape):
-    """
-    Extract and resize YOLOv8 segmentation masks to match the input image shape.
-    """
-    segments = []
-    if results[0].masks is None:
-        return segments
-    
-    for mask in results[0].masks.data:  # Each mask is [h, w] tensor
-        binary_mask = mask.cpu().numpy().astype(np.uint8) * 255
-        resized_mask = cv2.resize(binary_mask, (image_shape[1], image_shape[0]), interpolation=cv2.INTER_NEAREST)
-        segments.append((resized_mask > 127).astype(np.uint8))  # Ensure binary
-    return segments
-
 def main(image_path, model, output_dir=".", debug=False):
     image = cv2.imread(image_path)
 
     # Run the model
     results = model(image)
-    segments = yolo_segmentation_to_masks(results, image.shape)
+    segments = yolo_segmentation_to_polygons(results, image.shape)
     output = run_contour_pipeline(image, segments, render_individual=True)
     os.makedirs(f"{output_dir}", exist_ok=True)
     
@@ -44,6 +31,10 @@ def main(image_path, model, output_dir=".", debug=False):
             pil_image.save(f"{output_dir}/{os.path.basename(image_path).split('.jpg')[0]}/object_{i+1}_features.png", format='JPEG', quality=60, optimize=True)
 
 if __name__ == "__main__":
+    # Folders are processed by the analyze_folder command, with stages running in parallel:
+    #   python manage.py analyze_folder /media/AMK_front /media/debug/AMK_front \
+    #       --model yolo:/media/amk.front.segmentation.v1.pt --debug
+    #
     # model = YOLO('/media/amk.front.segmentation.v1.pt')
 
     # images = glob("/media/AMK_front/*.jpg")
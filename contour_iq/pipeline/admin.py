@@ -1,3 +1,22 @@
 from django.contrib import admin
+from pipeline.models import AnalysisRun, AnalyzedObject, ObjectFeature
 
-# Register your models here.
+
+@admin.register(AnalysisRun)
+class AnalysisRunAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "source", "image_name", "width", "height", "object_count")
+    list_filter = ("source",)
+    search_fields = ("image_name",)
+
+
+@admin.register(AnalyzedObject)
+class AnalyzedObjectAdmin(admin.ModelAdmin):
+    list_display = ("run", "index", "x", "y", "width", "height")
+    raw_id_fields = ("run",)
+
+
+@admin.register(ObjectFeature)
+class ObjectFeatureAdmin(admin.ModelAdmin):
+    list_display = ("run", "object_index", "name", "value")
+    list_filter = ("name",)
+    raw_id_fields = ("run",)
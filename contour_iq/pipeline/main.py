@@ -1,20 +1,93 @@
 
+import os
 import cv2
+import logging
+from time import perf_counter
 from PIL import Image 
-from typing import List, Dict, Union
+from typing import Callable, Iterator, List, Dict, Tuple, Union
 import numpy as np
-from common_utils.time_tracker.core import KeepTrackOfTime
-from pipeline.tasks.preprocessing import preprocess_segmentation
-from pipeline.tasks.contour_extraction import extract_all_contours
-from pipeline.tasks.feature_extraction import extract_shape_features
-from pipeline.tasks.analysis import analyze_contour
+from common_utils.metrics.core import record, timed, timing_scope, STAGE
+from common_utils.lazy_mapping.core import LazyMapping, LazySequence
+from common_utils.contour_set import ContourSet
+from pipeline.tasks.preprocessing import iter_preprocess_segmentation, is_label_map, label_map_to_roi_masks, padded_roi
+from pipeline.tasks.contour_extraction import extract_mask_contours
+from pipeline.tasks.feature_extraction import feature_table_to_records, FEATURE_NAMES
+from pipeline.tasks.feature_pool import get_feature_pool
+from pipeline.tasks.feature_cache import get_feature_cache
+from pipeline.tasks.analysis import analyze_contours_batch, attribute_table_to_records, rule_features, resolve_thresholds, RULES
 from pipeline.tasks.annotation import annotate_image
+from pipeline.tasks.tracking import ObjectTracker, contour_boxes
 
-keep_track_of_time = KeepTrackOfTime()
+logger = logging.getLogger(__name__)
 
-def render_individual_features(image: np.ndarray, contours: List[np.ndarray], feature_list: List[Dict[str, float]]) -> List[np.ndarray]:
+# Segments analyzed per chunk by iter_contour_pipeline
+STREAM_CHUNK_SIZE = int(os.getenv("CONTOUR_IQ_STREAM_CHUNK_SIZE", "256"))
+
+def resolve_outputs(outputs: List[str] = None) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Split requested output names into shape features and attributes, and list the
+    features that have to be computed to produce them.
+
+    Parameters:
+    - outputs: Feature and attribute names, None selects all of them
+
+    Returns:
+    - (requested features, requested attributes, features to compute)
+
+    Raises:
+    - ValueError: If a name is neither a feature nor an attribute
+    """
+    if outputs is None:
+        return list(FEATURE_NAMES), list(RULES), list(FEATURE_NAMES)
+
+    unknown = [name for name in outputs if name not in FEATURE_NAMES and name not in RULES]
+    if unknown:
+        raise ValueError(
+            f"Unknown features {unknown}. Available features: {', '.join(FEATURE_NAMES)}; "
+            f"available attributes: {', '.join(RULES)}"
+        )
+    features = [name for name in FEATURE_NAMES if name in outputs]
+    attributes = [name for name in RULES if name in outputs]
+    required = set(features).union(rule_features(attributes)) if attributes else set(features)
+    return features, attributes, [name for name in FEATURE_NAMES if name in required]
+
+# Frame pixels kept around an object in its debug render, and size of the feature panel beside it
+RENDER_PADDING = 20
+PANEL_WIDTH = 260
+PANEL_LINE_HEIGHT = 18
+
+def render_object(image: np.ndarray, contour: np.ndarray, features: Dict[str, float], padding: int = RENDER_PADDING) -> np.ndarray:
+    """
+    Render one object: its padded crop of the frame with the contour drawn, and its
+    features listed in a panel to the right of the crop.
+
+    Parameters:
+    - image: Original image
+    - contour: Contour of the object, in frame coordinates
+    - features: Features and attributes of the object
+    - padding: Frame pixels kept around the object's bounding box
+
+    Returns:
+    - Image of about the object's size plus PANEL_WIDTH, independent of the frame size
+    """
+    x0, y0, x1, y1 = padded_roi(*cv2.boundingRect(contour), image.shape, padding)
+    crop = image[y0:y1, x0:x1].copy()
+    cv2.drawContours(crop, [contour], -1, (255, 255, 255), 2, offset=(-x0, -y0))
+
+    height = max(crop.shape[0], 8 + len(features) * PANEL_LINE_HEIGHT)
+    canvas = np.zeros((height, crop.shape[1] + PANEL_WIDTH, *image.shape[2:]), dtype=image.dtype)
+    canvas[:crop.shape[0], :crop.shape[1]] = crop
+
+    for i, (k, v) in enumerate(features.items()):
+        text = f"{k}: {v:.3f}" if isinstance(v, float) else f"{k}: {v}"
+        color = (0, 0, 255) if v == True else (0, 255, 0)
+        cv2.putText(canvas, text, (crop.shape[1] + 8, PANEL_LINE_HEIGHT + i * PANEL_LINE_HEIGHT), cv2.FONT_HERSHEY_PLAIN, 1, color, 1)
+
+    return canvas
+
+def render_individual_features(image: np.ndarray, contours: List[np.ndarray], feature_list: List[Dict[str, float]]) -> LazySequence:
     """
-    Create one image per object with all computed features rendered.
+    Create one image per object with all computed features rendered (see render_object).
 
     Parameters:
     - image: Original image
@@ -22,85 +95,428 @@ def render_individual_features(image: np.ndarray, contours: List[np.ndarray], fe
     - feature_list: Corresponding features for each contour
 
     Returns:
-    - List of annotated images (one per object)
+    - Sequence of annotated images (one per object), each rendered when it is read and not
+      kept, so iterating over it holds a single render at a time
+    """
+    return LazySequence(len(contours), lambda i: render_object(image, contours[i], feature_list[i]))
+
+def classify_feature_table(
+        feature_table: Dict[str, np.ndarray],
+        size: int,
+        requested_features: List[str],
+        requested_attributes: List[str],
+        thresholds: Dict[str, float] = None,
+        ) -> Tuple[List[Dict[str, Union[float, bool]]], List[Dict[str, bool]]]:
+    """
+    Evaluate the requested attributes on a feature table and build the per-object records.
+
+    Returns:
+    - (feature + attribute dicts, attribute dicts), `size` entries each
+    """
+    attribute_table = analyze_contours_batch(feature_table, thresholds, attributes=requested_attributes)
+    all_attributes = attribute_table_to_records(attribute_table) if attribute_table else [{} for _ in range(size)]
+    feature_records = feature_table_to_records({name: feature_table[name] for name in requested_features if name in feature_table})
+    if not feature_records:
+        feature_records = [{} for _ in range(size)]
+    all_features = [
+        {**features, **attributes}
+        for features, attributes in zip(feature_records, all_attributes)
+    ]
+    return all_features, all_attributes
+
+def extract_feature_table(
+        contours: List[np.ndarray],
+        mask_shape: tuple,
+        features: List[str],
+        max_workers: int = None,
+        ) -> Dict[str, np.ndarray]:
+    """
+    Feature table of `contours` through the feature cache, misses computed by the feature pool.
+    """
+    return get_feature_cache().extract(
+        contours, mask_shape=mask_shape, features=features, compute=get_feature_pool(max_workers).extract,
+    )
+
+def trace_segments(
+        image: np.ndarray,
+        segments: Union[List[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
+        roi: bool = True,
+        ) -> ContourSet:
+    """
+    Preprocess and trace segments as a stream: each mask is traced as soon as it is produced
+    and released right after, so memory does not grow with the number of segments.
+
+    The time spent producing masks and tracing them is recorded as the 'preprocessing' and
+    'extract_contour' stages.
+    """
+    masks = iter_preprocess_segmentation(image, segments, roi=roi)
+    contours = []
+    preprocessing = tracing = 0.0
+    while True:
+        start = perf_counter()
+        mask = next(masks, None)
+        produced = perf_counter()
+        preprocessing += produced - start
+        if mask is None:
+            break
+        contours.extend(extract_mask_contours(mask))
+        del mask
+        tracing += perf_counter() - produced
+
+    start = perf_counter()
+    flat_contours = ContourSet.from_polygons(contours)
+    record("preprocessing", preprocessing)
+    record("extract_contour", tracing + perf_counter() - start)
+    return flat_contours
+
+def analyze_segments(
+        image: np.ndarray,
+        segments: Union[List[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
+        outputs: Tuple[List[str], List[str], List[str]],
+        roi: bool = True,
+        thresholds: Dict[str, float] = None,
+        max_workers: int = None,
+        extract: Callable[..., Dict[str, np.ndarray]] = None,
+        ) -> Tuple[ContourSet, List[Dict[str, Union[float, bool]]], List[Dict[str, bool]]]:
+    """
+    Preprocess, trace, measure and classify segments.
+
+    Parameters:
+    - outputs: Result of resolve_outputs
+    - extract: Called as extract(contours, mask_shape, features, max_workers) for the feature
+      table, defaults to extract_feature_table
+    - see run_contour_pipeline for the others
+
+    Returns:
+    - (contours, feature + attribute dicts, attribute dicts), one entry per object
     """
-    outputs = []
-    for contour, features in zip(contours, feature_list):
-        temp = image.copy()
-        cv2.drawContours(temp, [contour], -1, (255, 255, 255), 2)
+    requested_features, requested_attributes, required_features = outputs
 
-        y0 = 20
-        for i, (k, v) in enumerate(features.items()):
-            text = f"{k}: {v:.3f}" if isinstance(v, float) else f"{k}: {v}"
-            color = (0, 0, 255) if v == True else (0, 255, 0)
-            cv2.putText(temp, text, (10, y0 + i * 30), cv2.FONT_HERSHEY_PLAIN, 2, color, 2)
+    flat_contours = trace_segments(image, segments, roi=roi)
 
-        outputs.append(temp)
+    with timed("extract_feature"):
+        feature_table = (extract or extract_feature_table)(
+            flat_contours, image.shape[:2], required_features, max_workers
+        )
 
-    return outputs
+    with timed("analysis"):
+        all_features, all_attributes = classify_feature_table(
+            feature_table, len(flat_contours), requested_features, requested_attributes, thresholds
+        )
+
+    return flat_contours, all_features, all_attributes
 
 def run_contour_pipeline(
         image: np.ndarray, 
-        segments: List[Union[np.ndarray, List[tuple]]],
+        segments: Union[List[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
         render_individual:bool=False,
-        ) -> Dict[str, Union[np.ndarray, List[Dict[str, Union[float, bool]]]]]:
+        roi:bool=True,
+        thresholds:Dict[str, float]=None,
+        max_workers:int=None,
+        features:List[str]=None,
+        ) -> LazyMapping:
     """
     Full pipeline to analyze object contours from a segmented image.
 
     Parameters:
     - image: Input image
-    - segments: List of binary masks or polygons representing segmented objects
+    - segments: List of binary masks or polygons representing segmented objects, a ContourSet of
+      polygons, or an integer instance label map of the image's height and width (0 background,
+      one ID per object). Label maps are split in a single pass and every object is then handled
+      inside its bounding box only.
+    - render_individual: If True, also render one image per object
+    - roi: If True, rasterize and trace each segment inside its bounding box only
+    - thresholds: Optional overrides of the attribute rule thresholds (see analysis.DEFAULT_THRESHOLDS)
+    - max_workers: Feature extraction processes, defaults to CONTOUR_IQ_FEATURE_WORKERS (1: in-process)
+    - features: Feature and attribute names to return, None returns all of them. Only the
+      features these depend on (directly or through the attribute rules) are computed.
 
     Returns:
-    - Dictionary with:
-        'annotated_image': Annotated image with overlays
+    - Mapping (a LazyMapping, not a dict) with:
+        'contours': ContourSet with the contour of each object, as (N, 2) point views.
+          `contour.reshape(-1, 1, 2)` is the former (N, 1, 2) OpenCV layout, without a copy.
+        'annotated_image': Annotated image with overlays, rendered on first access
         'results': List of feature + attribute dicts for each object
+        'attributes': List of attribute dicts for each object
+        'object_images': One rendered crop per object (render_individual only), each rendered when read
+        'timings': Durations in seconds of this run, as {"stage": {...}, "feature": {...}}
+    """
+
+    outputs = resolve_outputs(features)
+
+    with timing_scope() as timings, timed("run_pipeline"):
+        flat_contours, all_features, all_attributes = analyze_segments(
+            image, segments, outputs, roi=roi, thresholds=thresholds, max_workers=max_workers
+        )
+
+    logger.debug(
+        "Pipeline timings (ms) for %d objects: %s",
+        len(flat_contours),
+        {name: round(seconds * 1000, 2) for name, seconds in timings[STAGE].items()},
+    )
+
+    return pipeline_output(image, flat_contours, all_features, all_attributes, timings, render_individual)
+
+def pipeline_output(
+        image: np.ndarray,
+        flat_contours: ContourSet,
+        all_features: List[Dict[str, Union[float, bool]]],
+        all_attributes: List[Dict[str, bool]],
+        timings: Dict[str, Dict[str, float]],
+        render_individual: bool = False,
+        **values,
+        ) -> LazyMapping:
+    """
+    Output mapping of run_contour_pipeline, `values` are added as extra keys.
+    """
+    def render_annotated_image():
+        with timing_scope(timings), timed("annotation"):
+            return annotate_image(image, flat_contours, all_attributes)
+
+    def render_object_images():
+        objects = render_individual_features(image, flat_contours, all_features)
+
+        def render(index):
+            with timing_scope(timings), timed("render_individual"):
+                return objects[index]
+
+        return LazySequence(len(objects), render)
+
+    # Rendering is left to the callers that read the images, JSON-only callers never pay for it
+    return LazyMapping(
+        values={
+            "contours": flat_contours,
+            "results": all_features,
+            "attributes": all_attributes,
+            "timings": timings,
+            **values,
+        },
+        factories={
+            "annotated_image": render_annotated_image,
+            "object_images": render_object_images if render_individual else list,
+        },
+    )
+
+
+def iter_contour_pipeline(
+        image: np.ndarray,
+        segments: Union[List[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
+        roi: bool = True,
+        thresholds: Dict[str, float] = None,
+        max_workers: int = None,
+        features: List[str] = None,
+        chunk_size: int = None,
+        ) -> Iterator[List[Dict[str, Union[np.ndarray, Dict]]]]:
+    """
+    Run the pipeline on consecutive chunks of segments and yield each chunk's objects as soon
+    as they are analyzed, so callers can stream results while later chunks are processed.
+
+    Parameters:
+    - chunk_size: Segments per chunk, defaults to CONTOUR_IQ_STREAM_CHUNK_SIZE
+    - see run_contour_pipeline for the others
+
+    Returns:
+    - Iterator over lists of {"contour", "results", "attributes"} dicts, one per object, in
+      segment order. Chunks are only processed while the iterator is consumed.
+
+    Raises:
+    - ValueError: On unknown features or thresholds, right away
     """
+    outputs = resolve_outputs(features)
+    resolve_thresholds(thresholds)
+    chunk_size = chunk_size or STREAM_CHUNK_SIZE
+    if is_label_map(segments, image.shape):
+        # Chunks are taken from the per-label ROI masks, not from rows of the map
+        segments = label_map_to_roi_masks(segments)
 
-    keep_track_of_time.start(task="run_pipeline")
+    def chunks():
+        for start in range(0, len(segments), chunk_size):
+            chunk = segments[start:start + chunk_size]
+            # A scope per chunk: the generator may be resumed from a different context each time
+            with timing_scope(), timed("run_pipeline_chunk"):
+                contours, results, attributes = analyze_segments(
+                    image, chunk, outputs, roi=roi, thresholds=thresholds, max_workers=max_workers
+                )
+            yield [
+                {"contour": contour, "results": result, "attributes": attribute}
+                for contour, result, attribute in zip(contours, results, attributes)
+            ]
 
-    keep_track_of_time.start(task='preprocessing')
-    masks = preprocess_segmentation(image, segments)
-    keep_track_of_time.end(task='preprocessing')
+    return chunks()
+
+def run_contour_pipeline_batch(
+        frames: List[Dict],
+        roi: bool = True,
+        max_workers: int = None,
+        ) -> List[Dict]:
+    """
+    Analyze the segments of many frames together.
+
+    Frames are preprocessed and traced one by one, then the contours of all frames with the same
+    shape go through feature extraction in a single pass (one call to the feature pool), and each
+    frame's slice of the feature table is classified with its own thresholds.
+
+    Parameters:
+    - frames: Dicts with 'image' (or 'image_shape'), 'segments', and optionally 'thresholds'
+      and 'features' (see run_contour_pipeline)
+    - roi, max_workers: see run_contour_pipeline
+
+    Returns:
+    - One dict per frame, in order: {'contours', 'results', 'attributes'}, or {'error': message}
+      when that frame failed. A failing frame does not affect the others.
+    """
+    results = [None] * len(frames)
+    prepared = []
+    blank_images = {}
+
+    with timing_scope(), timed("run_pipeline_batch"):
+        for index, frame in enumerate(frames):
+            try:
+                outputs = resolve_outputs(frame.get("features"))
+                resolve_thresholds(frame.get("thresholds"))
+                image = frame.get("image")
+                if image is None:
+                    # Only the shape of the frame is used, share one blank image per shape
+                    shape = tuple(frame["image_shape"])
+                    if shape not in blank_images:
+                        blank_images[shape] = np.zeros(shape, dtype=np.uint8)
+                    image = blank_images[shape]
+
+                contours = trace_segments(image, frame["segments"], roi=roi)
+                prepared.append((index, image.shape[:2], contours, outputs))
+            except Exception as e:
+                results[index] = {"error": str(e)}
+
+        groups = {}
+        for entry in prepared:
+            groups.setdefault(entry[1], []).append(entry)
+
+        for mask_shape, entries in groups.items():
+            required = set(name for entry in entries for name in entry[3][2])
+            contours = ContourSet.concatenate([entry[2] for entry in entries])
+            try:
+                with timed("extract_feature"):
+                    table = extract_feature_table(
+                        contours, mask_shape, [name for name in FEATURE_NAMES if name in required], max_workers
+                    )
+            except Exception as e:
+                for entry in entries:
+                    results[entry[0]] = {"error": str(e)}
+                continue
+
+            start = 0
+            for index, _, frame_contours, (requested_features, requested_attributes, _) in entries:
+                end = start + len(frame_contours)
+                frame_table = {name: column[start:end] for name, column in table.items()}
+                start = end
+                try:
+                    with timed("analysis"):
+                        frame_features, frame_attributes = classify_feature_table(
+                            frame_table, len(frame_contours), requested_features, requested_attributes,
+                            frames[index].get("thresholds"),
+                        )
+                    results[index] = {
+                        "contours": frame_contours,
+                        "results": frame_features,
+                        "attributes": frame_attributes,
+                    }
+                except Exception as e:
+                    results[index] = {"error": str(e)}
+
+    return results
+
+class ContourSession:
+    """
+    Stateful pipeline for consecutive frames of one camera.
+
+    Contours are matched to the previous frame by bounding box IoU. Matched objects keep their
+    ID; the features of matched objects whose outline did not change (up to a translation) are
+    taken from the previous frame, only new or changed objects are measured. All features are
+    translation invariant except the bounding box, which is updated.
+
+    A session keeps the state of one stream and is not meant to be shared between threads.
+
+    Parameters:
+    - features: Feature and attribute names to return, fixed for the session (see run_contour_pipeline)
+    - min_iou: Smallest bounding box IoU for an object to keep its ID
+    - tolerance: Largest point displacement, in pixels, for an outline to count as unchanged.
+      0 reuses features of identical outlines only, larger values trade accuracy for speed.
+    - roi, max_workers: see run_contour_pipeline
+    """
 
-    keep_track_of_time.start(task='extract_contour')
-    all_contours = extract_all_contours(masks)
-    keep_track_of_time.end(task='extract_contour')
+    def __init__(
+            self,
+            features: List[str] = None,
+            min_iou: float = 0.5,
+            tolerance: int = 0,
+            roi: bool = True,
+            max_workers: int = None,
+            ):
+        self.outputs = resolve_outputs(features)
+        self.roi = roi
+        self.max_workers = max_workers
+        self.tracker = ObjectTracker(min_iou=min_iou, tolerance=tolerance)
+        self._table = None
+        self._mask_shape = None
 
-    all_features = []
-    all_attributes = []
-    flat_contours = []
+    def reset(self):
+        """
+        Forget the previous frame, e.g. after a camera cut. IDs keep increasing.
+        """
+        self.tracker.reset()
+        self._table = None
+        self._mask_shape = None
 
-    keep_track_of_time.start(task='extract_feature')
-    for i, contours in enumerate(all_contours):
-        for contour in contours:
-            keep_track_of_time.start(task='extract_feature_per_contour')
-            features = extract_shape_features(contour, mask_shape=image.shape[:2])
-            attributes = analyze_contour(features)
+    def _extract(self, contours: ContourSet, mask_shape: tuple, features: List[str], max_workers: int = None) -> Dict[str, np.ndarray]:
+        boxes = contour_boxes(contours)
+        with timed("tracking"):
+            ids, matches, unchanged = self.tracker.update(contours, boxes)
+        if self._table is None or mask_shape != self._mask_shape:
+            unchanged[:] = False
 
-            all_features.append({**features, **attributes})
-            all_attributes.append(attributes)
-            flat_contours.append(contour)
+        computed_index = np.flatnonzero(~unchanged)
+        computed = extract_feature_table(contours.take(computed_index), mask_shape, features, max_workers)
 
-            keep_track_of_time.end(task='extract_feature_per_contour')
-            keep_track_of_time.log(task='extract_feature_per_contour', prefix="Per-Contour Feature Extraction")
-    keep_track_of_time.end(task='extract_feature')
+        reused_index = np.flatnonzero(unchanged)
+        previous_index = matches[reused_index]
+        table = {}
+        for name, column in computed.items():
+            dtype = np.result_type(column, self._table[name]) if self._table is not None else column.dtype
+            table[name] = np.empty(len(contours), dtype=dtype)
+            table[name][computed_index] = column
+            if name == "bbox_x":
+                table[name][reused_index] = boxes[reused_index, 0]
+            elif name == "bbox_y":
+                table[name][reused_index] = boxes[reused_index, 1]
+            elif len(reused_index):
+                table[name][reused_index] = self._table[name][previous_index]
 
-    keep_track_of_time.log(task='preprocessing', prefix="Preprocissing Time")
-    keep_track_of_time.log(task='extract_contour', prefix="Extract contour Time")
-    keep_track_of_time.log(task='extract_feature', prefix="Feature Extraction")
+        self._table, self._mask_shape = table, mask_shape
+        self._ids, self._reused = ids.tolist(), unchanged.tolist()
+        return table
 
-    keep_track_of_time.end(task="run_pipeline")
-    keep_track_of_time.log(task="run_pipeline", prefix="Total Execution Time")
-    
-    annotated = annotate_image(image, flat_contours, all_attributes)
-    individual_images = render_individual_features(image, flat_contours, all_features) if render_individual else []
+    def process(
+            self,
+            image: np.ndarray,
+            segments: Union[List[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
+            render_individual: bool = False,
+            thresholds: Dict[str, float] = None,
+            ) -> LazyMapping:
+        """
+        Analyze the next frame of the stream.
 
-    return {
-        "contours": flat_contours,
-        "annotated_image": annotated,
-        "results": all_features,
-        "attributes": all_attributes,
-        "object_images": individual_images
-    }
+        Returns:
+        - Same mapping as run_contour_pipeline, with in addition:
+            'ids': Stable object ID of each object
+            'reused': Whether each object's features were taken from the previous frame
+        """
+        with timing_scope() as timings, timed("run_pipeline"):
+            flat_contours, all_features, all_attributes = analyze_segments(
+                image, segments, self.outputs, roi=self.roi, thresholds=thresholds,
+                max_workers=self.max_workers, extract=self._extract,
+            )
 
+        return pipeline_output(
+            image, flat_contours, all_features, all_attributes, timings, render_individual,
+            ids=self._ids, reused=self._reused,
+        )
@@ -0,0 +1,75 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from pipeline.main import resolve_outputs
+from pipeline.tasks.analysis import resolve_thresholds
+from pipeline.tasks.segmentation import load_segmenter
+from pipeline.tasks.folder_batch import process_folder
+
+
+class Command(BaseCommand):
+    help = (
+        "Segment and analyze every image of a folder. Decoding, segmentation, contour analysis and "
+        "writing run as separate stages; finished images are checkpointed so an interrupted run resumes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("input_dir")
+        parser.add_argument("output_dir")
+        parser.add_argument("--model", help="Segmenter: 'yolo:<weights>', 'threshold[:<level>]' or '<module>:<attribute>' (default: CONTOUR_IQ_SEGMENTER)")
+        parser.add_argument("--pattern", default="*.jpg", help="Glob of the images, relative to input_dir (** matches subfolders)")
+        parser.add_argument("--debug", action="store_true", help="Also write one rendered image per object")
+        parser.add_argument("--thresholds", help='JSON object of rule threshold overrides, e.g. {"round_circularity": 0.8}')
+        parser.add_argument("--features", help="Comma separated features and attributes to compute")
+        parser.add_argument("--decode-workers", type=int, default=2)
+        parser.add_argument("--segment-workers", type=int, default=1)
+        parser.add_argument("--analysis-workers", type=int, default=None)
+        parser.add_argument("--write-workers", type=int, default=2)
+        parser.add_argument("--queue-size", type=int, default=None)
+        parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over")
+        parser.add_argument(
+            "--parquet", action="store_true",
+            help="Also append the features to a Parquet dataset in output_dir/features, partitioned by date and camera (requires pyarrow)",
+        )
+        parser.add_argument("--camera", help="Camera of the images, for --parquet and --persist (default: name of input_dir)")
+        parser.add_argument("--persist", action="store_true", help="Also store the results in the database")
+
+    def handle(self, *args, **options):
+        if options["parquet"]:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise CommandError("--parquet requires pyarrow")
+
+        features = [name for name in options["features"].split(",") if name] if options["features"] else None
+        try:
+            thresholds = json.loads(options["thresholds"]) if options["thresholds"] else None
+            resolve_thresholds(thresholds)
+            resolve_outputs(features)
+            segmenter = load_segmenter(options["model"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        verbosity = options["verbosity"]
+        counts = process_folder(
+            options["input_dir"],
+            options["output_dir"],
+            segmenter,
+            pattern=options["pattern"],
+            debug=options["debug"],
+            thresholds=thresholds,
+            features=features,
+            decode_workers=options["decode_workers"],
+            segment_workers=options["segment_workers"],
+            analysis_workers=options["analysis_workers"],
+            write_workers=options["write_workers"],
+            queue_size=options["queue_size"],
+            resume=not options["restart"],
+            persist=options["persist"],
+            parquet=options["parquet"],
+            camera=options["camera"],
+            progress=(lambda line: self.stdout.write(line)) if verbosity > 1 else None,
+        )
+
+        self.stdout.write(
+            f"{counts['processed']} processed, {counts['skipped']} skipped, {counts['failed']} failed "
+            f"in {counts['seconds']} s"
+        )
@@ -0,0 +1,45 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from pipeline.models import AnalysisRun
+from pipeline.tasks.feature_export import core as feature_export
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the per-object features of the stored runs as a Parquet dataset partitioned by date and "
+        "camera, a single Parquet file or an Arrow IPC stream. Runs are read and written a chunk at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", help="Dataset directory, or file for --format parquet/arrow")
+        parser.add_argument("--format", choices=["dataset", *feature_export.FORMATS], default="dataset")
+        parser.add_argument("--source", help="Only runs of this endpoint or command, e.g. analyze_image")
+        parser.add_argument("--camera", help="Only runs of this camera")
+        parser.add_argument("--since", type=datetime.fromisoformat, help="Only runs created at or after this ISO time")
+        parser.add_argument("--until", type=datetime.fromisoformat, help="Only runs created before this ISO time")
+        parser.add_argument("--row-group-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            feature_export.require_pyarrow()
+        except ImportError as e:
+            raise CommandError(str(e))
+
+        runs = AnalysisRun.objects.all()
+        if options["source"]:
+            runs = runs.filter(source=options["source"])
+        if options["camera"] is not None:
+            runs = runs.filter(camera=options["camera"])
+        if options["since"]:
+            runs = runs.filter(created_at__gte=options["since"])
+        if options["until"]:
+            runs = runs.filter(created_at__lt=options["until"])
+
+        if options["format"] == "dataset":
+            writer = feature_export.FeatureDatasetWriter(options["target"], options["row_group_size"])
+        else:
+            writer = feature_export.FeatureTableWriter(options["target"], options["format"], options["row_group_size"])
+        with writer:
+            for batch in feature_export.stored_feature_batches(runs):
+                writer.write(batch)
+        self.stdout.write(f"Exported {writer.rows} objects to {options['target']}")
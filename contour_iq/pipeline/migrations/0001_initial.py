@@ -0,0 +1,75 @@
+# Generated by Django 4.2 on 2026-10-17 08:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True)),
+                ('source', models.CharField(db_index=True, help_text='Endpoint or command that ran the analysis', max_length=64)),
+                ('image_name', models.CharField(blank=True, max_length=255)),
+                ('camera', models.CharField(blank=True, help_text='Camera or other image source, if known', max_length=64)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('object_count', models.PositiveIntegerField()),
+                ('thresholds', models.JSONField(blank=True, default=dict, help_text='Rule threshold overrides')),
+                ('timings', models.JSONField(blank=True, default=dict, help_text='Stage durations in seconds')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ObjectFeature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_index', models.PositiveIntegerField()),
+                ('name', models.CharField(db_index=True, max_length=64)),
+                ('value', models.FloatField()),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='features', to='pipeline.analysisrun')),
+            ],
+            options={
+                'ordering': ['run', 'object_index', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalyzedObject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(help_text="Position of the object in the run's results")),
+                ('x', models.IntegerField()),
+                ('y', models.IntegerField()),
+                ('width', models.IntegerField()),
+                ('height', models.IntegerField()),
+                ('points', models.BinaryField(help_text='Outline as little-endian int32 x, y pairs')),
+                ('attributes', models.JSONField(blank=True, default=dict)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='analyzed_objects', to='pipeline.analysisrun')),
+            ],
+            options={
+                'ordering': ['run', 'index'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='analysisrun',
+            index=models.Index(fields=['camera', 'created_at'], name='run_camera_time'),
+        ),
+        migrations.AddIndex(
+            model_name='objectfeature',
+            index=models.Index(fields=['run', 'object_index'], name='feature_object'),
+        ),
+        migrations.AddConstraint(
+            model_name='analyzedobject',
+            constraint=models.UniqueConstraint(fields=('run', 'index'), name='unique_object_per_run'),
+        ),
+    ]
@@ -1,3 +1,62 @@
 from django.db import models
 
-# Create your models here.
+
+class AnalysisRun(models.Model):
+    """
+    One analyzed image: where it came from and how it was analyzed.
+    """
+    created_at = models.DateTimeField(db_index=True)
+    source = models.CharField(max_length=64, db_index=True, help_text="Endpoint or command that ran the analysis")
+    image_name = models.CharField(max_length=255, blank=True)
+    camera = models.CharField(max_length=64, blank=True, help_text="Camera or other image source, if known")
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    object_count = models.PositiveIntegerField()
+    thresholds = models.JSONField(default=dict, blank=True, help_text="Rule threshold overrides")
+    timings = models.JSONField(default=dict, blank=True, help_text="Stage durations in seconds")
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["camera", "created_at"], name="run_camera_time")]
+
+    def __str__(self):
+        return f"{self.source} {self.image_name or self.pk} ({self.object_count} objects)"
+
+
+class AnalyzedObject(models.Model):
+    """
+    One object of a run: its outline, bounding box and attributes.
+    """
+    run = models.ForeignKey(AnalysisRun, on_delete=models.CASCADE, related_name="analyzed_objects")
+    index = models.PositiveIntegerField(help_text="Position of the object in the run's results")
+    x = models.IntegerField()
+    y = models.IntegerField()
+    width = models.IntegerField()
+    height = models.IntegerField()
+    points = models.BinaryField(help_text="Outline as little-endian int32 x, y pairs")
+    attributes = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ["run", "index"]
+        constraints = [models.UniqueConstraint(fields=["run", "index"], name="unique_object_per_run")]
+
+    def __str__(self):
+        return f"object {self.index} of run {self.run_id}"
+
+
+class ObjectFeature(models.Model):
+    """
+    One shape feature value of an object. Rows refer to their object by (run, object_index),
+    so they can be bulk loaded without reading back the ids of the objects.
+    """
+    run = models.ForeignKey(AnalysisRun, on_delete=models.CASCADE, related_name="features")
+    object_index = models.PositiveIntegerField()
+    name = models.CharField(max_length=64, db_index=True)
+    value = models.FloatField()
+
+    class Meta:
+        ordering = ["run", "object_index", "name"]
+        indexes = [models.Index(fields=["run", "object_index"], name="feature_object")]
+
+    def __str__(self):
+        return f"{self.name}={self.value} (object {self.object_index} of run {self.run_id})"
@@ -1,2 +1,9 @@
 from . import core
-from .core import analyze_contour
\ No newline at end of file
+from .core import analyze_contour
+from .core import analyze_contours_batch
+from .core import attribute_table_to_records
+from .core import resolve_thresholds
+from .core import DEFAULT_THRESHOLDS
+from .core import resolve_attributes
+from .core import rule_features
+from .core import RULES
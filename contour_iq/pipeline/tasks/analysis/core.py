@@ -1,87 +1,287 @@
-from typing import Dict
+import operator
+import numpy as np
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple, Union
 
+# Named thresholds used by the attribute rules. Each one can be overridden per request.
+DEFAULT_THRESHOLDS = {
+    "manmade_solidity": 0.85,
+    "manmade_eccentricity": 0.8,
+    "manmade_skeleton_length": 300,
+    "manmade_large_solidity": 0.75,
+    "manmade_large_area": 5000,
+    "manmade_large_skeleton_length": 300,
+    "manmade_large_num_corners": 4,
+    "fractured_num_defects": 5,
+    "fractured_num_corners": 10,
+    "fractured_skeleton_length": 200,
+    "fractured_eccentricity": 0.95,
+    "long_eccentricity": 0.8,
+    "long_aspect_ratio": 3,
+    "long_skeleton_length": 300,
+    "long_circularity": 0.65,
+    "round_circularity": 0.65,
+    "round_eccentricity": 0.6,
+    "round_solidity": 0.9,
+    "compact_solidity": 0.95,
+    "compact_extent": 0.8,
+    "long_skeleton_skeleton_length": 300,
+    "long_skeleton_area_per_length": 3,
+    "rigid_solidity": 0.85,
+    "rigid_extent": 0.8,
+    "rigid_num_defects": 6,
+    "rigid_eccentricity": 0.8,
+    "rigid_skeleton_length": 300,
+    "rigid_large_solidity": 0.75,
+    "rigid_large_area": 5000,
+    "rigid_large_skeleton_length": 300,
+    "rigid_large_extent": 0.5,
+    "rigid_large_num_defects": 12,
+}
 
-def analyze_contour(features: Dict[str, float]) -> Dict[str, bool]:
+# Features computed from other features before the rules run: name -> (inputs, function)
+DERIVED_FEATURES = {
+    "area_per_skeleton_length": (
+        ["area", "skeleton_length"],
+        lambda area, skeleton_length: area / np.maximum(skeleton_length, 1),
+    ),
+}
+
+# Attribute rules, evaluated in order. An attribute is set when any of its clauses holds,
+# a clause holds when all of its conditions hold. A condition is (operand, operator, value):
+# the operand is a feature, a derived feature or an attribute defined earlier; a string value
+# names a threshold, any other value is used as is.
+RULES = {
+    "manmade": [
+        [("solidity", ">", "manmade_solidity"), ("num_corners", "in", (3, 4, 6, 8, 10, 12))],
+        [("eccentricity", ">", "manmade_eccentricity"), ("skeleton_length", ">", "manmade_skeleton_length")],
+        [
+            ("solidity", ">", "manmade_large_solidity"),
+            ("area", ">", "manmade_large_area"),
+            ("skeleton_length", ">", "manmade_large_skeleton_length"),
+            ("num_corners", ">=", "manmade_large_num_corners"),
+        ],
+    ],
+    "fractured": [
+        [("num_defects", ">", "fractured_num_defects")],
+        [("num_corners", ">", "fractured_num_corners")],
+        [("skeleton_length", ">", "fractured_skeleton_length")],
+        [("eccentricity", ">", "fractured_eccentricity")],
+    ],
+    "long": [
+        [("eccentricity", ">", "long_eccentricity"), ("aspect_ratio", ">", "long_aspect_ratio"), ("circularity", "<", "long_circularity")],
+        [("eccentricity", ">", "long_eccentricity"), ("skeleton_length", ">", "long_skeleton_length"), ("circularity", "<", "long_circularity")],
+    ],
+    "round": [
+        [("circularity", ">", "round_circularity"), ("eccentricity", "<", "round_eccentricity"), ("solidity", ">", "round_solidity")],
+    ],
+    # Compact convex object (box, brick)
+    "compact": [
+        [("solidity", ">", "compact_solidity"), ("extent", ">", "compact_extent"), ("num_corners", "in", (4, 6))],
+    ],
+    "long_skeleton": [
+        [("skeleton_length", ">", "long_skeleton_skeleton_length"), ("area_per_skeleton_length", "<", "long_skeleton_area_per_length")],
+    ],
+    "rigid": [
+        [("solidity", ">", "rigid_solidity"), ("extent", ">", "rigid_extent"), ("num_defects", "<=", "rigid_num_defects")],
+        [("eccentricity", ">", "rigid_eccentricity"), ("long", "==", True), ("skeleton_length", ">", "rigid_skeleton_length")],
+        [
+            ("solidity", ">", "rigid_large_solidity"),
+            ("area", ">", "rigid_large_area"),
+            ("skeleton_length", ">", "rigid_large_skeleton_length"),
+            ("extent", ">", "rigid_large_extent"),
+            ("num_defects", "<=", "rigid_large_num_defects"),
+        ],
+    ],
+}
+
+# Vectorized and per-object implementation of each operator
+OPERATORS = {
+    ">": (np.greater, operator.gt),
+    ">=": (np.greater_equal, operator.ge),
+    "<": (np.less, operator.lt),
+    "<=": (np.less_equal, operator.le),
+    "==": (np.equal, operator.eq),
+    "in": (np.isin, lambda a, b: a in b),
+}
+
+def resolve_attributes(attributes: Iterable[str] = None) -> List[str]:
     """
-    Analyze extracted shape features to classify the object.
+    Expand requested attributes with the attributes their rules refer to.
+
+    Parameters:
+    - attributes: Attribute names, None selects all of them
 
     Returns:
-    - Dictionary with high-level attributes.
+    - Attributes to evaluate, in RULES order
+
+    Raises:
+    - ValueError: If a name is not a known attribute
     """
-    attributes = {
-        "manmade": False,
-        "fractured": False,
-        "long": False,
-        "round": False,
-        "compact": False,
-        "long_skeleton": False,
-        "rigid": False,
-    }
-
-    # Heuristic for man-made object:
-    if (
-        (
-            features.get("solidity", 0) > 0.85 and
-            features.get("num_corners", 0) in [3, 4, 6, 8, 10, 12]
-        ) or (
-            features.get("eccentricity", 0) > 0.8 and
-            features.get("skeleton_length", 0) > 300
-        ) or (
-            features.get("solidity", 0) > 0.75 and
-            features.get("area", 0) > 5000 and
-            features.get("skeleton_length", 0) > 300 and
-            features.get("num_corners", 0) >= 4
-        )
-    ):
-        attributes["manmade"] = True
-
-    if (
-        features.get("num_defects", 0) > 5 or
-        features.get("num_corners", 0) > 10 or
-        features.get("skeleton_length", 0) > 200 or
-        features.get("eccentricity", 0) > 0.95
-    ):
-        attributes["fractured"] = True
-
-    if (
-        features.get("eccentricity", 0) > 0.8 and
-        (features.get("aspect_ratio", 0) > 3 or features.get("skeleton_length", 0) > 300) and
-        features.get("circularity", 0) < 0.65
-    ):
-        attributes["long"] = True
-
-    if (
-        features.get("circularity", 0) > 0.65 and
-        features.get("eccentricity", 0) < 0.6 and
-        features.get("solidity", 0) > 0.9
-    ):
-        attributes["round"] = True
+    if attributes is None:
+        return list(RULES)
 
-    # Compact convex object (box, brick)
-    if (
-        features.get("solidity", 0) > 0.95 and
-        features.get("extent", 0) > 0.8 and
-        features.get("num_corners", 0) in [4, 6]
-    ):
-        attributes["compact"] = True
-
-    # Long skeleton
-    if (
-        features.get("skeleton_length", 0) > 300 and
-        (features.get("area", 0) / max(features.get("skeleton_length", 1), 1)) < 3
-    ):
-        attributes["long_skeleton"] = True
-
-    attributes["rigid"] = (
-        (features.get("solidity") > 0.85 and features.get("extent") > 0.8 and features.get("num_defects") <= 6) or
-        (features.get("eccentricity", 0) > 0.8 and attributes['long'] and features.get("skeleton_length", 0) > 300) or
+    selected = set()
+    pending = list(attributes)
+    while pending:
+        name = pending.pop()
+        if name not in RULES:
+            raise ValueError(f"Unknown attribute '{name}'. Available attributes: {', '.join(RULES)}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(operand for clause in RULES[name] for operand, _, _ in clause if operand in RULES)
+    return [name for name in RULES if name in selected]
+
+def rule_features(attributes: Iterable[str] = None) -> List[str]:
+    """
+    Shape features the rules of `attributes` (and of the attributes they refer to) read,
+    derived features replaced by their inputs.
+    """
+    required = []
+
+    def require(name: str):
+        if name in DERIVED_FEATURES:
+            for dependency in DERIVED_FEATURES[name][0]:
+                require(dependency)
+        elif name not in RULES and name not in required:
+            required.append(name)
+
+    for attribute in resolve_attributes(attributes):
+        for clause in RULES[attribute]:
+            for operand, _, _ in clause:
+                require(operand)
+    return required
+
+def resolve_thresholds(overrides: Dict[str, float] = None) -> Dict[str, float]:
+    """
+    Merge threshold overrides into the defaults.
+
+    Raises:
+    - ValueError: If an override names an unknown threshold
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    for name, value in (overrides or {}).items():
+        if name not in thresholds:
+            raise ValueError(f"Unknown threshold '{name}'. Available thresholds: {', '.join(DEFAULT_THRESHOLDS)}")
+        thresholds[name] = float(value)
+    return thresholds
+
+@lru_cache(maxsize=64)
+def compile_rules(thresholds: Tuple[Tuple[str, float], ...] = ()) -> List[tuple]:
+    """
+    Bind RULES to threshold values.
+
+    Parameters:
+    - thresholds: Sorted (name, value) overrides of DEFAULT_THRESHOLDS
+
+    Returns:
+    - List of (attribute, clauses), each condition as (operand, operators, value)
+    """
+    values = resolve_thresholds(dict(thresholds))
+    return [
         (
-            features.get("solidity", 0) > 0.75 and
-            features.get("area", 0) > 5000 and
-            features.get("skeleton_length", 0) > 300 and
-            features.get("extent", 0) > 0.5 and
-            features.get("num_defects", 0) <= 12
+            attribute,
+            [
+                [(operand, OPERATORS[op], values[value] if isinstance(value, str) else value) for operand, op, value in clause]
+                for clause in clauses
+            ],
         )
-    )
+        for attribute, clauses in RULES.items()
+    ]
+
+def threshold_key(thresholds: Dict[str, float] = None) -> Tuple[Tuple[str, float], ...]:
+    return tuple(sorted((thresholds or {}).items()))
+
+def analyze_contours_batch(
+    feature_table: Dict[str, np.ndarray],
+    thresholds: Dict[str, float] = None,
+    attributes: List[str] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Classify every object of a feature table in one vectorized pass.
+
+    Parameters:
+    - feature_table: Columns of shape features, e.g. from extract_shape_features_batch
+    - thresholds: Optional overrides of DEFAULT_THRESHOLDS
+    - attributes: Attributes to evaluate, None evaluates all of them
+
+    Returns:
+    - Dictionary with one boolean column per requested attribute.
+    """
+    evaluated = set(resolve_attributes(attributes))
+    rules = [rule for rule in compile_rules(threshold_key(thresholds)) if rule[0] in evaluated]
+    size = len(next(iter(feature_table.values()))) if feature_table else 0
+    columns = {}
+
+    def column(name: str) -> np.ndarray:
+        if name not in columns:
+            if name in DERIVED_FEATURES:
+                inputs, function = DERIVED_FEATURES[name]
+                columns[name] = function(*(column(i) for i in inputs))
+            elif name in feature_table:
+                # Features missing for a contour count as 0, as in analyze_contour
+                columns[name] = np.nan_to_num(np.asarray(feature_table[name], dtype=np.float64), nan=0.0)
+            else:
+                columns[name] = np.zeros(size)
+        return columns[name]
+
+    results = {}
+    for attribute, clauses in rules:
+        result = np.zeros(size, dtype=bool)
+        for clause in clauses:
+            holds = np.ones(size, dtype=bool)
+            for operand, (vectorized, _), value in clause:
+                holds &= vectorized(column(operand), value)
+            result |= holds
+        results[attribute] = columns[attribute] = result
+    if attributes is not None:
+        results = {name: results[name] for name in attributes}
+    return results
+
+def attribute_table_to_records(attribute_table: Dict[str, np.ndarray]) -> List[Dict[str, bool]]:
+    """
+    Convert attribute columns into one dictionary per object.
+    """
+    names = list(attribute_table)
+    return [dict(zip(names, row)) for row in zip(*(attribute_table[name].tolist() for name in names))]
+
+def analyze_contour(
+    features: Dict[str, Union[float, int]],
+    thresholds: Dict[str, float] = None,
+    attributes: List[str] = None,
+) -> Dict[str, bool]:
+    """
+    Analyze extracted shape features to classify the object.
+    Evaluates the same rules as analyze_contours_batch, for a single object.
+
+    Parameters:
+    - features: Shape features of one object
+    - thresholds: Optional overrides of DEFAULT_THRESHOLDS
+    - attributes: Attributes to evaluate, None evaluates all of them
 
-    return attributes
\ No newline at end of file
+    Returns:
+    - Dictionary with high-level attributes.
+    """
+    values = dict(features)
+
+    def value_of(name: str):
+        if name not in values:
+            if name in DERIVED_FEATURES:
+                inputs, function = DERIVED_FEATURES[name]
+                values[name] = function(*(value_of(i) for i in inputs))
+            else:
+                values[name] = 0
+        return values[name]
+
+    evaluated = set(resolve_attributes(attributes))
+    results = {}
+    for attribute, clauses in compile_rules(threshold_key(thresholds)):
+        if attribute not in evaluated:
+            continue
+        results[attribute] = values[attribute] = any(
+            all(scalar(value_of(operand), value) for operand, (_, scalar), value in clause)
+            for clause in clauses
+        )
+    if attributes is not None:
+        results = {name: results[name] for name in attributes}
+    return results
@@ -1,15 +1,16 @@
 import cv2
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Union
+from common_utils.contour_set import ContourSet
 
 
-def annotate_image(image: np.ndarray, contours: List[np.ndarray], attributes_list: List[Dict[str, bool]]) -> np.ndarray:
+def annotate_image(image: np.ndarray, contours: Union[List[np.ndarray], ContourSet], attributes_list: List[Dict[str, bool]]) -> np.ndarray:
     """
     Draw contours and label each object with all classification attributes.
 
     Parameters:
     - image: The original image
-    - contours: List of contours (1 per object)
+    - contours: List of contours (1 per object), or a ContourSet
     - attributes_list: List of dictionaries with shape attributes for each contour
 
     Returns:
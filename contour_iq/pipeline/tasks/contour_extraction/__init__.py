@@ -1,3 +1,5 @@
 from . import core
 from .core import extract_contours
-from .core import extract_all_contours
\ No newline at end of file
+from .core import extract_all_contours
+from .core import extract_contour_set
+from .core import extract_mask_contours
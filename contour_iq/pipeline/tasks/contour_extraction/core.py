@@ -1,30 +1,59 @@
 import os
 import cv2
 import numpy as np
-from typing import List
+from typing import List, Tuple, Union
 from concurrent.futures import ThreadPoolExecutor
+from common_utils.contour_set import ContourSet
+from pipeline.tasks.preprocessing.core import MaskROI
 
-def extract_contours(mask: np.ndarray) -> List[np.ndarray]:
+def extract_contours(mask: np.ndarray, offset: Tuple[int, int] = (0, 0)) -> List[np.ndarray]:
     """
     Extracts external contours from a binary mask.
 
     Parameters:
     - mask (np.ndarray): Binary mask of a single object.
+    - offset: (x, y) added to every contour point, used to map ROI-local masks back to the frame.
 
     Returns:
     - List of contours (each contour is a NumPy array of points).
     """
-    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
     return contours
 
-def extract_all_contours(masks: List[np.ndarray], max_workers:int=None) -> List[List[np.ndarray]]:
+def extract_mask_contours(mask: Union[np.ndarray, MaskROI]) -> List[np.ndarray]:
+    """
+    Contours of one full-frame mask or MaskROI, in full-frame coordinates.
+    """
+    return extract_contours(mask.mask, mask.offset) if isinstance(mask, MaskROI) else extract_contours(mask)
+
+def extract_all_contours(masks: List[Union[np.ndarray, MaskROI]], max_workers:int=None) -> List[List[np.ndarray]]:
     """
     Extracts contours for a list of binary masks using parallel processing.
 
     Parameters:
-    - masks: List of binary masks.
+    - masks: List of binary masks, or MaskROI entries from ROI preprocessing.
+    - max_workers: Number of threads, masks are processed in the calling thread when None or 1.
+
+    Returns:
+    - List of lists of contours (per object), in full-frame coordinates.
+    """
+    if not max_workers or max_workers < 2:
+        return [extract_mask_contours(mask) for mask in masks]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(extract_mask_contours, masks))
+
+def extract_contour_set(masks: List[Union[np.ndarray, MaskROI]], max_workers:int=None) -> ContourSet:
+    """
+    Extracts the contours of all masks into a single ContourSet, in mask order.
+
+    Parameters:
+    - masks, max_workers: see extract_all_contours
 
     Returns:
-    - List of lists of contours (per object).
+    - ContourSet of all contours, in full-frame coordinates. The per-mask arrays returned by
+      OpenCV are released once packed.
     """
-    return [extract_contours(mask) for mask in masks]
\ No newline at end of file
+    return ContourSet.from_polygons([
+        contour for contours in extract_all_contours(masks, max_workers) for contour in contours
+    ])
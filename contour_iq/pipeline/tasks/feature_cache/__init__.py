@@ -0,0 +1,3 @@
+from . import core
+from .core import FeatureCache
+from .core import get_feature_cache
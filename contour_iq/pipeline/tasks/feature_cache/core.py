@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, List, Union
+from common_utils.contour_set import ContourSet
+from common_utils.metrics.core import COUNTERS
+from pipeline.tasks.feature_extraction import extract_shape_features_batch, resolve_features
+
+# Contours kept in memory, 0 disables the in-memory tier
+FEATURE_CACHE_SIZE = int(os.getenv("CONTOUR_IQ_FEATURE_CACHE_SIZE", "20000"))
+
+# SQLite file of the on-disk tier, kept across restarts. Empty disables it.
+FEATURE_CACHE_PATH = os.getenv("CONTOUR_IQ_FEATURE_CACHE_PATH", "")
+
+BBOX_COLUMNS = ["bbox_x", "bbox_y", "bbox_w", "bbox_h"]
+
+# Keys per SELECT of the on-disk tier, below SQLite's default variable limit
+DISK_BATCH_SIZE = 500
+
+def contour_key(contour: np.ndarray, mask_shape: tuple = None) -> bytes:
+    """
+    Content hash of a contour's points, and of the frame shape when the features depend on it
+    (skeleton_length).
+    """
+    digest = hashlib.blake2b(np.ascontiguousarray(contour, dtype=np.int32).tobytes(), digest_size=16)
+    if mask_shape is not None:
+        digest.update(np.asarray(mask_shape[:2], dtype=np.int64).tobytes())
+    return digest.digest()
+
+class FeatureCache:
+    """
+    Content-addressed cache of shape features in front of extract_shape_features_batch.
+
+    Entries hold the features computed so far for one contour and are looked up by
+    contour_key. The in-memory tier is an LRU of at most `max_entries` contours; the optional
+    SQLite tier at `path` is unbounded and shared by the processes using the same file.
+    Features only depend on the contour points (and the frame shape for skeleton_length),
+    so a hit returns exactly what extraction would.
+    """
+
+    def __init__(self, max_entries: int = None, path: str = None):
+        self.max_entries = FEATURE_CACHE_SIZE if max_entries is None else max_entries
+        self.path = FEATURE_CACHE_PATH if path is None else path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"hit": 0, "disk_hit": 0, "miss": 0, "eviction": 0}
+        self._db = None
+        if self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS features (key BLOB PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.commit()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self._db is not None
+
+    def _count(self, result: str, amount: int):
+        if amount:
+            self._counts[result] += amount
+            COUNTERS["feature_cache"].inc(result, amount)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Hits, disk hits, misses and evictions since creation, and the current in-memory size.
+        """
+        with self._lock:
+            return {**self._counts, "size": len(self._entries)}
+
+    def clear(self):
+        """
+        Drop the in-memory entries, the on-disk tier is kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, entries: Dict[bytes, Dict[str, float]]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            for key, entry in entries.items():
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            evicted = max(len(self._entries) - self.max_entries, 0)
+            for _ in range(evicted):
+                self._entries.popitem(last=False)
+            self._count("eviction", evicted)
+
+    def _load(self, keys: List[bytes]) -> Dict[bytes, Dict[str, float]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), DISK_BATCH_SIZE):
+                batch = keys[start:start + DISK_BATCH_SIZE]
+                rows = self._db.execute(
+                    f"SELECT key, value FROM features WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((bytes(key), json.loads(value)) for key, value in rows)
+        return found
+
+    def _store(self, entries: Dict[bytes, Dict[str, float]]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO features (key, value) VALUES (?, ?)",
+                [(key, json.dumps(entry)) for key, entry in entries.items()],
+            )
+            self._db.commit()
+
+    def extract(
+        self,
+        contours: Union[List[np.ndarray], ContourSet],
+        mask_shape: tuple = None,
+        features: List[str] = None,
+        compute: Callable[..., Dict[str, np.ndarray]] = extract_shape_features_batch,
+    ) -> Dict[str, np.ndarray]:
+        """
+        Feature table of `contours`, same columns as extract_shape_features_batch. Only the
+        contours missing from the cache (or missing some of the requested features) are
+        passed to `compute`.
+
+        Parameters:
+        - contours: List of contours, or a ContourSet (misses are then passed as a ContourSet too)
+        - mask_shape: Frame shape, required for skeleton_length
+        - features: Features to compute, None computes all of them
+        - compute: Called as compute(contours, mask_shape=..., features=...) for the misses,
+          e.g. FeatureProcessPool.extract
+        """
+        if not self.enabled or len(contours) == 0:
+            return compute(contours, mask_shape=mask_shape, features=features)
+
+        names = resolve_features(features)
+        if mask_shape is None and "skeleton_length" in names:
+            names.remove("skeleton_length")
+        columns = names + BBOX_COLUMNS
+        key_shape = mask_shape if "skeleton_length" in names else None
+        keys = [contour_key(contour, key_shape) for contour in contours]
+
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = entry
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        loaded = self._load(missing) if self._db is not None and missing else {}
+
+        # First contour of each key that still lacks some of the requested features
+        pending = {}
+        for index, key in enumerate(keys):
+            entry = found.get(key) or loaded.get(key)
+            if key not in pending and (entry is None or any(name not in entry for name in columns)):
+                pending[key] = index
+
+        hits = sum(key in found and key not in pending for key in keys)
+        disk_hits = sum(key in loaded and key not in pending for key in keys)
+        with self._lock:
+            self._count("hit", hits)
+            self._count("disk_hit", disk_hits)
+            self._count("miss", len(keys) - hits - disk_hits)
+
+        computed = {}
+        if pending:
+            if isinstance(contours, ContourSet):
+                misses = contours.take(list(pending.values()))
+            else:
+                misses = [contours[index] for index in pending.values()]
+            table = compute(misses, mask_shape=mask_shape, features=features)
+            rows = zip(*(table[name].tolist() for name in columns))
+            for key, row in zip(pending, rows):
+                computed[key] = {**(found.get(key) or loaded.get(key) or {}), **dict(zip(columns, row))}
+            if self._db is not None:
+                self._store(computed)
+
+        self._remember({**loaded, **computed})
+        entries = {**found, **loaded, **computed}
+        return {name: np.array([entries[key][name] for key in keys]) for name in columns}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_feature_cache() -> FeatureCache:
+    """
+    Process-wide FeatureCache, configured by CONTOUR_IQ_FEATURE_CACHE_SIZE and CONTOUR_IQ_FEATURE_CACHE_PATH.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FeatureCache()
+        return _cache
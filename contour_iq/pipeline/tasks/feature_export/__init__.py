@@ -0,0 +1,7 @@
+from . import core
+from .core import FeatureTableWriter
+from .core import FeatureDatasetWriter
+from .core import feature_batch
+from .core import stored_feature_batches
+from .core import iter_feature_table
+from .core import dataset_partitioning
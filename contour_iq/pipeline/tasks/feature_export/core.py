@@ -0,0 +1,378 @@
+import os
+import io
+import functools
+import numpy as np
+from urllib.parse import quote
+from datetime import date, datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+from common_utils.contour_set import ContourSet
+from pipeline.tasks.feature_extraction import FEATURE_NAMES
+from pipeline.tasks.analysis import RULES
+
+try:
+    import pyarrow as pa
+    from pyarrow import parquet
+except ImportError:
+    pa = parquet = None
+
+# Rows per Parquet row group (or Arrow record batch)
+ROW_GROUP_SIZE = int(os.getenv("CONTOUR_IQ_EXPORT_ROW_GROUP_SIZE", "100000"))
+
+# Stored runs read from the database per query
+EXPORT_CHUNK_RUNS = int(os.getenv("CONTOUR_IQ_EXPORT_CHUNK_RUNS", "200"))
+
+FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+PARTITIONS = ("date", "camera")
+
+# Directory name of rows without a camera, read back as null
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The feature export requires pyarrow")
+
+@functools.lru_cache(maxsize=None)
+def feature_schema() -> "pa.Schema":
+    """
+    Columns of the feature table: image and object identification, bounding box, every shape
+    feature (float64, null when not computed) and every attribute (bool).
+    """
+    require_pyarrow()
+    return pa.schema(
+        [
+            ("image_id", pa.string()),
+            ("run", pa.int64()),
+            ("camera", pa.string()),
+            ("date", pa.date32()),
+            ("captured_at", pa.timestamp("us", tz="UTC")),
+            ("object", pa.int32()),
+            ("x", pa.int32()),
+            ("y", pa.int32()),
+            ("width", pa.int32()),
+            ("height", pa.int32()),
+        ]
+        + [(name, pa.float64()) for name in FEATURE_NAMES]
+        + [(name, pa.bool_()) for name in RULES]
+    )
+
+@functools.lru_cache(maxsize=None)
+def _value_schema() -> "pa.Schema":
+    """
+    Feature and attribute columns of feature_schema().
+    """
+    names = set(FEATURE_NAMES) | set(RULES)
+    return pa.schema([field for field in feature_schema() if field.name in names])
+
+def dataset_partitioning() -> "pyarrow.dataset.Partitioning":
+    """
+    Partitioning of a directory written by FeatureDatasetWriter, to read it back with the date
+    and camera columns, e.g. parquet.read_table(root, partitioning=dataset_partitioning()).
+    """
+    require_pyarrow()
+    from pyarrow import dataset
+
+    return dataset.partitioning(pa.schema([("date", pa.date32()), ("camera", pa.string())]), flavor="hive")
+
+def _constant_column(value, count: int, type) -> "pa.Array":
+    return pa.repeat(pa.scalar(value, type=type), count)
+
+def feature_batch(
+    output,
+    image_id: str,
+    camera: str = "",
+    captured_at: datetime = None,
+    run: int = None,
+) -> "pa.RecordBatch":
+    """
+    Feature table rows of one run_contour_pipeline (or run_contour_pipeline_batch) output.
+
+    Parameters:
+    - output: Pipeline output with contours and results (features and attributes)
+    - image_id: Name or id of the analyzed image
+    - camera: Camera or other source of the image, null in the table when empty
+    - captured_at: Time the image was taken, defaults to now. Its UTC date is the date column.
+    - run: Id of the stored AnalysisRun, if any
+    """
+    require_pyarrow()
+    contours = output["contours"]
+    contours = contours if isinstance(contours, ContourSet) else ContourSet.from_polygons(contours)
+    results = output["results"]
+    count = len(results)
+    boxes = contours.bboxes[:count].astype(np.int32)
+    captured_at = (captured_at or datetime.now(timezone.utc)).astimezone(timezone.utc)
+
+    columns = [
+        _constant_column(image_id, count, pa.string()),
+        _constant_column(run, count, pa.int64()),
+        _constant_column(camera or None, count, pa.string()),
+        _constant_column(captured_at.date(), count, pa.date32()),
+        _constant_column(captured_at, count, pa.timestamp("us", tz="UTC")),
+        pa.array(np.arange(count, dtype=np.int32)),
+        *(pa.array(boxes[:, i]) for i in range(4)),
+    ]
+    # Results hold the features and the attributes, converted by Arrow in one pass
+    values = pa.RecordBatch.from_pylist(list(results), schema=_value_schema())
+    return pa.RecordBatch.from_arrays(columns + values.columns, schema=feature_schema())
+
+def stored_feature_batches(runs=None, chunk_runs: int = None) -> Iterator["pa.RecordBatch"]:
+    """
+    Feature table of runs stored by pipeline.tasks.persistence, read `chunk_runs` runs at a
+    time so the export never holds more than one chunk in memory. Every chunk is a complete
+    query (keyset pagination, no cursor is left open), so the iterator can be advanced from
+    any thread.
+
+    Parameters:
+    - runs: AnalysisRun queryset to export, defaults to all runs
+    - chunk_runs: Defaults to CONTOUR_IQ_EXPORT_CHUNK_RUNS
+
+    Returns:
+    - Iterator over record batches, ordered by camera and time. Every batch holds a single
+      (date, camera) partition.
+    """
+    require_pyarrow()
+    from django.db.models import Q
+    from pipeline.models import AnalysisRun, AnalyzedObject, ObjectFeature
+
+    chunk_runs = chunk_runs or EXPORT_CHUNK_RUNS
+    runs = AnalysisRun.objects.all() if runs is None else runs
+    runs = runs.order_by("camera", "created_at", "pk").values_list("pk", "image_name", "camera", "created_at")
+
+    def batch(chunk: list) -> "pa.RecordBatch":
+        run_rows = {pk: (image_name or str(pk), camera or None, created_at) for pk, image_name, camera, created_at in chunk}
+        objects = list(
+            AnalyzedObject.objects.filter(run_id__in=run_rows)
+            .order_by("run_id", "index")
+            .values_list("run_id", "index", "x", "y", "width", "height", "attributes")
+        )
+        row_of = {(run_id, index): row for row, (run_id, index, *_) in enumerate(objects)}
+        features = {name: np.full(len(objects), np.nan) for name in FEATURE_NAMES}
+        feature_rows = ObjectFeature.objects.filter(run_id__in=run_rows).values_list("run_id", "object_index", "name", "value")
+        for run_id, index, name, value in feature_rows.iterator():
+            if name in features:
+                features[name][row_of[run_id, index]] = value
+
+        identity = [run_rows[row[0]] for row in objects]
+        boxes = np.array([row[2:6] for row in objects], dtype=np.int32).reshape(-1, 4)
+        columns = [
+            pa.array([image_id for image_id, _, _ in identity], type=pa.string()),
+            pa.array([row[0] for row in objects], type=pa.int64()),
+            pa.array([camera for _, camera, _ in identity], type=pa.string()),
+            pa.array([created_at.astimezone(timezone.utc).date() for _, _, created_at in identity], type=pa.date32()),
+            pa.array([created_at for _, _, created_at in identity], type=pa.timestamp("us", tz="UTC")),
+            pa.array([row[1] for row in objects], type=pa.int32()),
+            *(pa.array(boxes[:, i]) for i in range(4)),
+        ]
+        columns += [pa.array(features[name], mask=np.isnan(features[name])) for name in FEATURE_NAMES]
+        columns += [pa.array([row[6].get(name) for row in objects], type=pa.bool_()) for name in RULES]
+        return pa.RecordBatch.from_arrays(columns, schema=feature_schema())
+
+    last = None
+    while True:
+        page = runs
+        if last:
+            pk, camera, created_at = last
+            page = page.filter(
+                Q(camera__gt=camera) | Q(camera=camera, created_at__gt=created_at) | Q(camera=camera, created_at=created_at, pk__gt=pk)
+            )
+        rows = list(page[:chunk_runs])
+        if not rows:
+            return
+        chunk, partition = [], None
+        for row in rows:
+            row_partition = (row[2], row[3].astimezone(timezone.utc).date())
+            if chunk and row_partition != partition:
+                yield batch(chunk)
+                chunk = []
+            chunk.append(row)
+            partition = row_partition
+        yield batch(chunk)
+        last = (rows[-1][0], rows[-1][2], rows[-1][3])
+
+def batch_partition(batch: "pa.RecordBatch") -> tuple:
+    """
+    (date, camera) of the first row of a batch.
+    """
+    return batch.column("date")[0].as_py(), batch.column("camera")[0].as_py()
+
+class FeatureTableWriter:
+    """
+    Append-only writer of the feature table to one Parquet file or Arrow IPC stream.
+
+    Batches are buffered and written out as one row group (one record batch for Arrow) once
+    `row_group_size` rows are waiting, or when a batch of another (date, camera) partition
+    arrives: a row group never mixes partitions, so readers skip row groups by their date and
+    camera statistics. Memory is bounded by one row group.
+
+    Parameters:
+    - where: Path or writable binary file object
+    - format: "parquet" or "arrow"
+    - row_group_size: Defaults to CONTOUR_IQ_EXPORT_ROW_GROUP_SIZE
+    - schema: Defaults to feature_schema()
+    """
+
+    def __init__(self, where, format: str = "parquet", row_group_size: int = None, schema: "pa.Schema" = None):
+        require_pyarrow()
+        if format not in FORMATS:
+            raise ValueError(f"Unknown format '{format}', expected one of {', '.join(FORMATS)}")
+        self.format = format
+        self.row_group_size = row_group_size or ROW_GROUP_SIZE
+        self.schema = schema or feature_schema()
+        if format == "parquet":
+            self._writer = parquet.ParquetWriter(where, self.schema)
+        else:
+            self._writer = pa.ipc.new_stream(where, self.schema)
+        self._pending: List["pa.RecordBatch"] = []
+        self._pending_rows = 0
+        self._partition = None
+        # Rows written so far, including the buffered ones
+        self.rows = 0
+
+    def write(self, batch: "pa.RecordBatch"):
+        """
+        Append a batch of rows. Batches holding several partitions (see batch_partition) are
+        written as they come, without splitting their row groups.
+        """
+        if not batch.num_rows:
+            return
+        if "date" in batch.schema.names:
+            partition = batch_partition(batch)
+            if partition != self._partition:
+                self.flush()
+                self._partition = partition
+        self._pending.append(batch)
+        self._pending_rows += batch.num_rows
+        self.rows += batch.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self.flush()
+
+    @property
+    def pending_rows(self) -> int:
+        """
+        Rows buffered for the next row group.
+        """
+        return self._pending_rows
+
+    def flush(self):
+        """
+        Write the buffered rows as one row group.
+        """
+        if not self._pending:
+            return
+        table = pa.Table.from_batches(self._pending, schema=self.schema).combine_chunks()
+        if self.format == "parquet":
+            self._writer.write_table(table, row_group_size=table.num_rows)
+        else:
+            self._writer.write_table(table)
+        self._pending, self._pending_rows = [], 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FeatureDatasetWriter:
+    """
+    Append-only writer of the feature table to a Parquet dataset directory, partitioned as
+    date=YYYY-MM-DD/camera=<camera>/ (hive layout, the date and camera columns live in the
+    directory names). Every writer adds its own part files and never rewrites existing ones,
+    so runs over the same directory accumulate. Read it back with dataset_partitioning().
+
+    At most `row_group_size` rows are buffered over all partitions: when more are waiting,
+    the partition with the most rows is written out, so memory stays bounded however many
+    cameras and days are open at once (interleaved partitions get smaller row groups).
+
+    Parameters:
+    - root: Dataset directory, created if needed
+    - row_group_size: Defaults to CONTOUR_IQ_EXPORT_ROW_GROUP_SIZE
+    """
+
+    def __init__(self, root: str, row_group_size: int = None):
+        require_pyarrow()
+        self.root = root
+        self.row_group_size = row_group_size or ROW_GROUP_SIZE
+        schema = feature_schema()
+        self.schema = pa.schema([field for field in schema if field.name not in PARTITIONS])
+        self.part = f"part-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{os.getpid()}.parquet"
+        self._writers: Dict[tuple, FeatureTableWriter] = {}
+        self.rows = 0
+
+    def partition_dir(self, day: date, camera: Optional[str]) -> str:
+        return os.path.join(
+            self.root, f"date={day.isoformat()}", f"camera={quote(camera, safe='') if camera else DEFAULT_PARTITION}"
+        )
+
+    def write(self, batch: "pa.RecordBatch"):
+        """
+        Append a batch of rows of a single (date, camera) partition, e.g. from feature_batch.
+        """
+        if not batch.num_rows:
+            return
+        partition = batch_partition(batch)
+        writer = self._writers.get(partition)
+        if writer is None:
+            directory = self.partition_dir(*partition)
+            os.makedirs(directory, exist_ok=True)
+            writer = FeatureTableWriter(os.path.join(directory, self.part), "parquet", self.row_group_size, self.schema)
+            self._writers[partition] = writer
+        writer.write(batch.drop_columns(list(PARTITIONS)))
+        self.rows += batch.num_rows
+        while sum(writer.pending_rows for writer in self._writers.values()) > self.row_group_size:
+            max(self._writers.values(), key=lambda writer: writer.pending_rows).flush()
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file object collecting what a writer produces, until drained.
+    """
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+def iter_feature_table(batches: Iterable["pa.RecordBatch"], format: str = "parquet", row_group_size: int = None) -> Iterator[bytes]:
+    """
+    Encode record batches as one Parquet file or Arrow IPC stream, yielding the bytes as soon as
+    each row group is written, e.g. for a streaming HTTP response.
+    """
+    sink = _ChunkSink()
+    writer = FeatureTableWriter(sink, format, row_group_size)
+    for batch in batches:
+        writer.write(batch)
+        if sink.chunks:
+            yield sink.drain()
+    writer.close()
+    yield sink.drain()
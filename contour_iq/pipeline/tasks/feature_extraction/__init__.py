@@ -1,2 +1,6 @@
 from . import core
-from .core import extract_shape_features
\ No newline at end of file
+from .core import extract_shape_features
+from .core import extract_shape_features_batch
+from .core import feature_table_to_records
+from .core import resolve_features
+from .core import FEATURE_NAMES
@@ -1,132 +1,516 @@
 import cv2
 import numpy as np
-from typing import Dict
-from skimage.morphology import skeletonize
+from typing import Dict, Iterable, List, Union
 from scipy.fft import fft
+from common_utils.contour_set import ContourSet
 from common_utils.features import (
     contour_area,
     contour_perimeter,
     contour_circularity,
     contour_aspect_ratio,
     contour_extent,
+    contour_skeleton_length,
 )
 
-from common_utils.time_tracker.core import KeepTrackOfTime
-keep_track_of_time = KeepTrackOfTime()
+from common_utils.metrics.core import timed, FEATURE
 
-def extract_shape_features(contour: np.ndarray, mask_shape: tuple = None) -> Dict[str, float]:
+# Feature columns in the order extract_shape_features fills its dictionary.
+FEATURE_NAMES = [
+    "area", "perimeter", "circularity", "aspect_ratio", "extent", "solidity",
+    *[f"hu_moment_{i+1}" for i in range(7)],
+    "num_defects", "eccentricity", "num_corners", "fourier_1_mag", "skeleton_length",
+]
+INTEGER_FEATURES = {"num_defects", "num_corners", "skeleton_length"}
+
+# Features computed from other features. Features not listed only need the contour.
+FEATURE_DEPENDENCIES = {
+    "circularity": ["area", "perimeter"],
+    "extent": ["area"],
+    "solidity": ["area"],
+    "num_corners": ["perimeter"],
+}
+
+def resolve_features(features: Iterable[str] = None) -> List[str]:
+    """
+    Expand requested features with the features they are computed from.
+
+    Parameters:
+    - features: Feature names, None selects all of them
+
+    Returns:
+    - Features to compute, in FEATURE_NAMES order
+
+    Raises:
+    - ValueError: If a name is not a known feature
+    """
+    if features is None:
+        return list(FEATURE_NAMES)
+
+    selected = set()
+    pending = list(features)
+    while pending:
+        name = pending.pop()
+        if name not in FEATURE_NAMES:
+            raise ValueError(f"Unknown feature '{name}'. Available features: {', '.join(FEATURE_NAMES)}")
+        if name not in selected:
+            selected.add(name)
+            pending.extend(FEATURE_DEPENDENCIES.get(name, []))
+    return [name for name in FEATURE_NAMES if name in selected]
+
+def extract_shape_features(contour: np.ndarray, mask_shape: tuple = None, features: List[str] = None) -> Dict[str, float]:
     """
     Extract basic shape descriptors from a single contour.
 
     Parameters:
     - contour: NumPy array representing the contour.
+    - mask_shape: Frame shape, required for skeleton_length
+    - features: Features to compute (and the features they depend on), None computes all of them
 
     Returns:
     - Dictionary of shape features.
     """
+    selected = set(resolve_features(features))
     features = {}
 
     # Area and perimeter
-    keep_track_of_time.start(task="area")
-    area = contour_area(contour)
-    keep_track_of_time.end(task="area")
-    keep_track_of_time.log(task="area", prefix="AREA")
+    if "area" in selected:
+        with timed("area", FEATURE):
+            area = contour_area(contour)
+        features["area"] = area
 
-    keep_track_of_time.start(task="perimeter")
-    perimeter = contour_perimeter(contour)
-    keep_track_of_time.end(task="perimeter")
-    keep_track_of_time.log(task="perimeter", prefix="Perimeter")
+    if "perimeter" in selected:
+        with timed("perimeter", FEATURE):
+            perimeter = contour_perimeter(contour)
+        features["perimeter"] = perimeter
 
     x, y, w, h = cv2.boundingRect(contour)
     
     # Shape descriptors
-    features["area"] = area
-    features["perimeter"] = perimeter
-    
-    keep_track_of_time.start(task="circularity")
-    features["circularity"] = contour_circularity(contour, perimeter, area)
-    keep_track_of_time.end(task="circularity")
-    keep_track_of_time.log(task="circularity", prefix="Circularity")
+    if "circularity" in selected:
+        with timed("circularity", FEATURE):
+            features["circularity"] = contour_circularity(contour, perimeter, area)
 
-    keep_track_of_time.start(task="aspect_ration")
-    features["aspect_ratio"] = contour_aspect_ratio(w=w, h=h)
-    keep_track_of_time.end(task="aspect_ration")
-    keep_track_of_time.log(task="aspect_ration", prefix="Aspect Ration")
+    if "aspect_ratio" in selected:
+        with timed("aspect_ratio", FEATURE):
+            features["aspect_ratio"] = contour_aspect_ratio(w=w, h=h)
 
-    keep_track_of_time.start(task="extent")
-    features["extent"] = contour_extent(contour_area=area, w=w, h=h)
-    keep_track_of_time.end(task="extent")
-    keep_track_of_time.log(task="extent", prefix="Extent")
+    if "extent" in selected:
+        with timed("extent", FEATURE):
+            features["extent"] = contour_extent(contour_area=area, w=w, h=h)
 
     # Solidity (area / convex hull area)
-    keep_track_of_time.start('solidity')
-    hull = cv2.convexHull(contour)
-    hull_area = cv2.contourArea(hull)
-    features["solidity"] = area / hull_area if hull_area > 0 else 0
-    keep_track_of_time.end(task="solidity")
-    keep_track_of_time.log(task="solidity", prefix="Solidity")
+    if "solidity" in selected:
+        with timed("solidity", FEATURE):
+            hull = cv2.convexHull(contour)
+            hull_area = cv2.contourArea(hull)
+            features["solidity"] = area / hull_area if hull_area > 0 else 0
 
     # Hu Moments (7 invariant moments)
-    keep_track_of_time.start('hu_moment')
-    moments = cv2.moments(contour)
-    hu_moments = cv2.HuMoments(moments).flatten()
-    for i, val in enumerate(hu_moments):
-        features[f"hu_moment_{i+1}"] = float(val)
-    keep_track_of_time.end(task="hu_moment")
-    keep_track_of_time.log(task="hu_moment", prefix="HU Moment")
+    hu_names = [f"hu_moment_{i+1}" for i in range(7)]
+    if selected.intersection(hu_names):
+        with timed("hu_moments", FEATURE):
+            moments = cv2.moments(contour)
+            hu_moments = cv2.HuMoments(moments).flatten()
+            for name, val in zip(hu_names, hu_moments):
+                if name in selected:
+                    features[name] = float(val)
 
     # Convexity Defects
-    keep_track_of_time.start('defect')
-    if len(contour) >= 4:
-        hull_indices = cv2.convexHull(contour, returnPoints=False)
-        if hull_indices is not None and len(hull_indices) > 3:
-            defects = cv2.convexityDefects(contour, hull_indices)
-            features["num_defects"] = 0 if defects is None else defects.shape[0]
-    keep_track_of_time.end(task="defect")
-    keep_track_of_time.log(task="defect", prefix="Defect")
+    if "num_defects" in selected:
+        with timed("num_defects", FEATURE):
+            if len(contour) >= 4:
+                hull_indices = cv2.convexHull(contour, returnPoints=False)
+                if hull_indices is not None and len(hull_indices) > 3:
+                    try:
+                        defects = cv2.convexityDefects(contour, hull_indices)
+                        features["num_defects"] = 0 if defects is None else defects.shape[0]
+                    except cv2.error:
+                        # Self-touching contours give non-monotonous hull indices
+                        pass
 
     # Eccentricity (requires at least 5 points to fit an ellipse)
-    keep_track_of_time.start('eccentricity')
-    if len(contour) >= 5:
-        try:
-            _, (MA, ma), _ = cv2.fitEllipse(contour)
-            a = max(MA, ma) / 2
-            b = min(MA, ma) / 2
-            features["eccentricity"] = np.sqrt(1 - (b**2 / a**2)) if MA > 0 else 0
-        except:
-            features["eccentricity"] = 0
-    keep_track_of_time.end(task="eccentricity")
-    keep_track_of_time.log(task="eccentricity", prefix="Eccentricity")
+    if "eccentricity" in selected:
+        with timed("eccentricity", FEATURE):
+            if len(contour) >= 5:
+                try:
+                    _, (MA, ma), _ = cv2.fitEllipse(contour)
+                    a = max(MA, ma) / 2
+                    b = min(MA, ma) / 2
+                    features["eccentricity"] = np.sqrt(1 - (b**2 / a**2)) if MA > 0 else 0
+                except:
+                    features["eccentricity"] = 0
 
     # Corner count via polygon approximation
-    keep_track_of_time.start('num_corners')
-    epsilon = 0.01 * perimeter
-    approx = cv2.approxPolyDP(contour, epsilon, True)
-    features["num_corners"] = len(approx)
-    keep_track_of_time.end(task="num_corners")
-    keep_track_of_time.log(task="num_corners", prefix="Num corners")
+    if "num_corners" in selected:
+        with timed("num_corners", FEATURE):
+            epsilon = 0.01 * perimeter
+            approx = cv2.approxPolyDP(contour, epsilon, True)
+            features["num_corners"] = len(approx)
 
     # Fourier Descriptor (first harmonic magnitude)
-    keep_track_of_time.start('fourier_mag')
-    contour_complex = contour[:, 0, 0] + 1j * contour[:, 0, 1]
-    fd = fft(contour_complex)
-    if len(fd) > 1:
-        features["fourier_1_mag"] = np.abs(fd[1])
-    keep_track_of_time.end(task="fourier_mag")
-    keep_track_of_time.log(task="fourier_mag", prefix="Fourier Mag")
+    if "fourier_1_mag" in selected:
+        with timed("fourier_1_mag", FEATURE):
+            pts = contour.reshape(-1, 2)
+            contour_complex = pts[:, 0] + 1j * pts[:, 1]
+            fd = fft(contour_complex)
+            if len(fd) > 1:
+                features["fourier_1_mag"] = np.abs(fd[1])
 
     # Skeleton Features (if mask shape provided)
-    keep_track_of_time.start('skeleton_length')   
-    if mask_shape is not None:
-        mask = np.zeros(mask_shape, dtype=np.uint8)
-        cv2.drawContours(mask, [contour], -1, 1, thickness=cv2.FILLED)
-        scale = 0.15
-        small_mask = cv2.resize(mask, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
-        small_skeleton = skeletonize(small_mask).astype(np.uint8)
-        skeleton_length = int(np.count_nonzero(small_skeleton) / scale)
-        features["skeleton_length"] = skeleton_length
-    keep_track_of_time.end(task="skeleton_length")
-    keep_track_of_time.log(task="skeleton_length", prefix="Skeleton Length")
-
-
-    return features
\ No newline at end of file
+    if "skeleton_length" in selected and mask_shape is not None:
+        with timed("skeleton_length", FEATURE):
+            features["skeleton_length"] = contour_skeleton_length(contour, mask_shape)
+
+
+    return features
+
+def concatenate_contours(contours: Union[List[np.ndarray], ContourSet]):
+    """
+    Pack contours into one (N, 2) float64 point buffer. A ContourSet is already packed,
+    only its points are converted.
+
+    Returns:
+    - points: All contour points, contour after contour
+    - starts: Index of each contour's first point
+    - counts: Number of points of each contour
+    - nxt: Index of the following point on the same (closed) contour, for every point
+    """
+    if isinstance(contours, ContourSet):
+        counts = contours.counts
+        starts = contours.offsets[:-1].copy()
+        points = contours.points.astype(np.float64)
+    else:
+        counts = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+        starts = np.zeros(len(contours), dtype=np.int64)
+        np.cumsum(counts[:-1], out=starts[1:])
+        points = np.concatenate([c.reshape(-1, 2) for c in contours]).astype(np.float64)
+
+    nxt = np.arange(1, len(points) + 1)
+    nxt[starts + counts - 1] = starts
+    return points, starts, counts, nxt
+
+def polygon_moments(x0, y0, x1, y1, starts) -> Dict[str, np.ndarray]:
+    """
+    Spatial moments up to order 3 of closed polygons (same formulas as cv2.moments on a contour).
+    The edges of contour i are (x0, y0) -> (x1, y1) over the segment starting at starts[i].
+    """
+    dxy = x0 * y1 - x1 * y0
+    xs = x0 + x1
+    ys = y0 + y1
+    terms = {
+        "m00": dxy,
+        "m10": dxy * xs,
+        "m01": dxy * ys,
+        "m20": dxy * (x0 * xs + x1 * x1),
+        "m11": dxy * (x0 * (ys + y0) + x1 * (ys + y1)),
+        "m02": dxy * (y0 * ys + y1 * y1),
+        "m30": dxy * xs * (x0 * x0 + x1 * x1),
+        "m21": dxy * (x0 * x0 * (3 * y0 + y1) + 2 * x1 * x0 * ys + x1 * x1 * (y0 + 3 * y1)),
+        "m12": dxy * (y0 * y0 * (3 * x0 + x1) + 2 * y1 * y0 * xs + y1 * y1 * (x0 + 3 * x1)),
+        "m03": dxy * ys * (y0 * y0 + y1 * y1),
+    }
+    sums = {name: np.add.reduceat(values, starts) for name, values in terms.items()}
+
+    a00 = sums["m00"]
+    valid = np.abs(a00) > np.finfo(np.float32).eps
+    sign = np.where(a00 > 0, 1.0, -1.0) * valid
+    divisors = {"m00": 2, "m10": 6, "m01": 6, "m20": 12, "m11": 24, "m02": 12, "m30": 20, "m21": 60, "m12": 60, "m03": 20}
+    return {name: sums[name] * sign / divisors[name] for name in terms}
+
+def hu_moments(m: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Hu invariant moments from spatial moments, one row of 7 values per contour (as cv2.HuMoments).
+    """
+    m00 = m["m00"]
+    valid = np.abs(m00) > np.finfo(np.float64).eps
+    inv_m00 = np.divide(1.0, m00, out=np.zeros_like(m00), where=valid)
+    cx, cy = m["m10"] * inv_m00, m["m01"] * inv_m00
+
+    mu20 = m["m20"] - m["m10"] * cx
+    mu11 = m["m11"] - m["m10"] * cy
+    mu02 = m["m02"] - m["m01"] * cy
+    mu30 = m["m30"] - cx * (3 * mu20 + cx * m["m10"])
+    mu21 = m["m21"] - cx * (2 * mu11 + cx * m["m01"]) - cy * mu20
+    mu12 = m["m12"] - cy * (2 * mu11 + cy * m["m10"]) - cx * mu02
+    mu03 = m["m03"] - cy * (3 * mu02 + cy * m["m01"])
+
+    inv_sqrt_m00 = np.sqrt(np.abs(inv_m00))
+    s2 = inv_m00 * inv_m00
+    s3 = s2 * inv_sqrt_m00
+    n20, n11, n02 = mu20 * s2, mu11 * s2, mu02 * s2
+    n30, n21, n12, n03 = mu30 * s3, mu21 * s3, mu12 * s3, mu03 * s3
+
+    t0, t1 = n30 + n12, n21 + n03
+    q0, q1 = t0 * t0, t1 * t1
+    n4 = 4 * n11
+    s = n20 + n02
+    d = n20 - n02
+    hu = np.empty((len(m00), 7))
+    hu[:, 0] = s
+    hu[:, 1] = d * d + n4 * n11
+    hu[:, 3] = q0 + q1
+    hu[:, 5] = d * (q0 - q1) + n4 * t0 * t1
+
+    t0 *= q0 - 3 * q1
+    t1 *= 3 * q0 - q1
+    q0 = n30 - 3 * n12
+    q1 = 3 * n21 - n03
+    hu[:, 2] = q0 * q0 + q1 * q1
+    hu[:, 4] = q0 * t0 + q1 * t1
+    hu[:, 6] = q1 * t0 - q0 * t1
+    return hu
+
+def fit_ellipse_eccentricity(points: np.ndarray, starts: np.ndarray, counts: np.ndarray, max_condition: float = 1e3):
+    """
+    Eccentricity of the ellipses cv2.fitEllipse fits to each contour, solved for all contours at once.
+
+    Follows OpenCV's algebraic fit (centering, scaling, conic fit, center solve, refit of the
+    quadratic terms) with batched normal equations instead of one SVD per contour.
+
+    Returns:
+    - eccentricity: One value per contour, NaN where it was not computed
+    - fallback: Contours to fit with cv2.fitEllipse instead; 5-point contours (OpenCV uses the
+      direct method for them) and ill-conditioned systems, where normal equations lose precision
+    """
+    eccentricity = np.full(len(counts), np.nan)
+    fallback = counts == 5
+    fit = counts > 5
+    if not fit.any():
+        return eccentricity, fallback
+
+    # Points are float32 in OpenCV, so are the mean and the centered coordinates
+    mean = (np.add.reduceat(points, starts).astype(np.float32) / counts[:, None].astype(np.float32))
+    centered = (points.astype(np.float32) - np.repeat(mean, counts, axis=0)).astype(np.float64)
+    spread = np.add.reduceat(np.abs(centered).sum(axis=1), starts)
+    scale = 100.0 / np.maximum(spread, np.finfo(np.float32).eps)
+    px, py = (centered * np.repeat(scale, counts)[:, None]).T
+
+    with np.errstate(all="ignore"):
+        # Conic fit: -A x^2 - B y^2 - C xy + D x + E y = 10000, normal equations built
+        # from per-contour monomial sums
+        x2, xy, y2 = px * px, px * py, py * py
+        monomials = [x2 * x2, x2 * xy, x2 * y2, xy * y2, y2 * y2, x2 * px, x2 * py, y2 * px, y2 * py, x2, xy, y2, px, py]
+        (sx4, sx3y, sx2y2, sxy3, sy4, sx3, sx2y, sxy2, sy3, sx2, sxy, sy2, sx, sy) = (np.add.reduceat(m, starts)[fit] for m in monomials)
+        normal = np.stack([
+            sx4, sx2y2, sx3y, -sx3, -sx2y,
+            sx2y2, sy4, sxy3, -sxy2, -sy3,
+            sx3y, sxy3, sx2y2, -sx2y, -sxy2,
+            -sx3, -sxy2, -sx2y, sx2, sxy,
+            -sx2y, -sy3, -sxy2, sxy, sy2,
+        ], axis=1).reshape(-1, 5, 5)
+        rhs = 10000.0 * np.stack([-sx2, -sy2, -sxy, sx, sy], axis=1)
+
+        singular = np.sqrt(np.abs(np.linalg.eigvalsh(normal)))
+        conditioned = singular[:, 0] * max_condition > singular[:, -1]
+        conic = np.linalg.solve(normal + ~conditioned[:, None, None] * np.eye(5), rhs[..., None])[..., 0]
+
+        # Center from the gradient of the conic
+        a, b, c, d, e = conic.T
+        det = 4 * a * b - c * c
+        cx = (2 * b * d - c * e) / det
+        cy = (2 * a * e - c * d) / det
+
+        # Refit the quadratic terms around that center: A x^2 + B y^2 + C xy = 1
+        center = np.zeros((len(counts), 2))
+        center[fit] = np.stack([cx, cy], axis=1)
+        fx = px - np.repeat(center[:, 0], counts)
+        fy = py - np.repeat(center[:, 1], counts)
+        x2, xy, y2 = fx * fx, fx * fy, fy * fy
+        monomials = [x2 * x2, x2 * xy, x2 * y2, xy * y2, y2 * y2, x2, y2, xy]
+        sx4, sx3y, sx2y2, sxy3, sy4, sx2, sy2, sxy = (np.add.reduceat(m, starts)[fit] for m in monomials)
+        normal = np.stack([
+            sx4, sx2y2, sx3y,
+            sx2y2, sy4, sxy3,
+            sx3y, sxy3, sx2y2,
+        ], axis=1).reshape(-1, 3, 3)
+        rhs = np.stack([sx2, sy2, sxy], axis=1)
+        finite = np.isfinite(normal).all(axis=(1, 2))
+        conditioned &= finite
+        normal[~finite] = np.eye(3)
+        rhs[~finite] = 0
+        singular = np.sqrt(np.abs(np.linalg.eigvalsh(normal)))
+        conditioned &= singular[:, 0] * max_condition > singular[:, -1]
+        conditioned &= np.abs(det) > 1e-12 * np.maximum(np.abs(a * b), 1e-300)
+        g0, g1, g2 = np.linalg.solve(normal + ~conditioned[:, None, None] * np.eye(3), rhs[..., None])[..., 0].T
+
+        angle = -0.5 * np.arctan2(g2, g1 - g0)
+        rotated = np.abs(g2) > 1e-8
+        t = np.where(rotated, g2 / np.where(rotated, np.sin(-2.0 * angle), 1.0), g1 - g0)
+        r1 = np.abs(g0 + g1 - t)
+        r2 = np.abs(g0 + g1 + t)
+        r1 = np.where(r1 > 1e-8, np.sqrt(2.0 / r1), r1)
+        r2 = np.where(r2 > 1e-8, np.sqrt(2.0 / r2), r2)
+
+        # Box sizes are float32 in the returned RotatedRect
+        fit_scale = scale[fit]
+        width = (r1 * 2 / fit_scale).astype(np.float32).astype(np.float64)
+        height = (r2 * 2 / fit_scale).astype(np.float32).astype(np.float64)
+        major = np.maximum(width, height) / 2
+        minor = np.minimum(width, height) / 2
+        values = np.where(np.minimum(width, height) > 0, np.sqrt(1 - (minor**2 / major**2)), 0)
+
+    eccentricity[fit] = np.where(conditioned, values, np.nan)
+    fallback[fit] = ~conditioned | ~np.isfinite(values)
+    return eccentricity, fallback
+
+def extract_shape_features_batch(
+    contours: Union[List[np.ndarray], ContourSet],
+    mask_shape: tuple = None,
+    features: List[str] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Extract the shape descriptors of extract_shape_features for many contours at once.
+
+    Area, perimeter, bounding box, circularity, aspect ratio, extent, Hu moments and the
+    Fourier descriptor are computed in vectorized passes over a single concatenated point
+    buffer. Solidity, convexity defects, eccentricity, corner count and skeleton length
+    fall back to per-contour OpenCV calls.
+
+    Parameters:
+    - contours: List of contours (each an (N, 1, 2) point array), or a ContourSet
+    - mask_shape: Frame shape, required for skeleton_length
+    - features: Features to compute (and the features they depend on), None computes all of them
+
+    Returns:
+    - Dictionary of columns, one value per contour. Values that extract_shape_features
+      would leave out (e.g. eccentricity of a contour with fewer than 5 points) are NaN.
+      Also contains the bounding box as bbox_x, bbox_y, bbox_w and bbox_h.
+    """
+    selected = set(resolve_features(features))
+    if mask_shape is None:
+        selected.discard("skeleton_length")
+    hu_names = [f"hu_moment_{i+1}" for i in range(7)]
+
+    n = len(contours)
+    if n == 0:
+        names = [name for name in FEATURE_NAMES if name in selected]
+        return {name: np.zeros(0) for name in names + ["bbox_x", "bbox_y", "bbox_w", "bbox_h"]}
+
+    points, starts, counts, nxt = concatenate_contours(contours)
+    x0, y0 = points[:, 0], points[:, 1]
+    x1, y1 = x0[nxt], y0[nxt]
+
+    if "area" in selected or selected.intersection(hu_names):
+        with timed("batch_moments", FEATURE):
+            moments = polygon_moments(x0, y0, x1, y1, starts)
+            area = np.abs(moments["m00"])
+    if "perimeter" in selected:
+        with timed("batch_perimeter", FEATURE):
+            # cv2.arcLength rounds every segment length to float32 before summing
+            segment_length = np.sqrt(((x1 - x0) ** 2 + (y1 - y0) ** 2).astype(np.float32))
+            perimeter = np.add.reduceat(segment_length.astype(np.float64), starts)
+
+    bbox_x = np.minimum.reduceat(x0, starts)
+    bbox_y = np.minimum.reduceat(y0, starts)
+    w = np.maximum.reduceat(x0, starts) - bbox_x + 1
+    h = np.maximum.reduceat(y0, starts) - bbox_y + 1
+
+    features = {}
+    if "area" in selected:
+        features["area"] = area
+    if "perimeter" in selected:
+        features["perimeter"] = perimeter
+    if "circularity" in selected:
+        features["circularity"] = np.divide(4 * np.pi * area, perimeter ** 2, out=np.zeros(n), where=perimeter > 0)
+    if "aspect_ratio" in selected:
+        features["aspect_ratio"] = w / h
+    if "extent" in selected:
+        features["extent"] = area / (w * h)
+
+    if "eccentricity" in selected:
+        with timed("batch_eccentricity", FEATURE):
+            eccentricity, ellipse_fallback = fit_ellipse_eccentricity(points, starts, counts)
+    else:
+        ellipse_fallback = np.zeros(n, dtype=bool)
+
+    # Per-contour fallbacks
+    need_hull = "solidity" in selected or "num_defects" in selected
+    if need_hull or ellipse_fallback.any() or "num_corners" in selected:
+        with timed("batch_per_contour", FEATURE):
+            hull_points = []
+            num_defects = np.full(n, np.nan)
+            num_corners = np.zeros(n)
+            for i, contour in enumerate(contours):
+                if need_hull:
+                    hull_indices = cv2.convexHull(contour, returnPoints=False)
+                    hull_points.append(hull_indices.ravel() + starts[i])
+
+                if "num_defects" in selected and counts[i] >= 4 and len(hull_indices) > 3:
+                    try:
+                        defects = cv2.convexityDefects(contour, hull_indices)
+                        num_defects[i] = 0 if defects is None else defects.shape[0]
+                    except cv2.error:
+                        pass
+
+                if ellipse_fallback[i]:
+                    try:
+                        _, (MA, ma), _ = cv2.fitEllipse(contour)
+                        a = max(MA, ma) / 2
+                        b = min(MA, ma) / 2
+                        eccentricity[i] = np.sqrt(1 - (b**2 / a**2)) if MA > 0 else 0
+                    except:
+                        eccentricity[i] = 0
+
+                if "num_corners" in selected:
+                    num_corners[i] = len(cv2.approxPolyDP(contour, 0.01 * perimeter[i], True))
+
+    if "solidity" in selected:
+        with timed("batch_solidity", FEATURE):
+            # Solidity from the hull polygons, gathered into one buffer
+            hull_counts = np.fromiter((len(h) for h in hull_points), dtype=np.int64, count=n)
+            hull_starts = np.zeros(n, dtype=np.int64)
+            np.cumsum(hull_counts[:-1], out=hull_starts[1:])
+            hull_index = np.concatenate(hull_points)
+            hull_next = np.arange(1, len(hull_index) + 1)
+            hull_next[hull_starts + hull_counts - 1] = hull_starts
+            hx, hy = x0[hull_index], y0[hull_index]
+            hull_area = np.abs(np.add.reduceat(hx * hy[hull_next] - hx[hull_next] * hy, hull_starts)) / 2
+            features["solidity"] = np.divide(area, hull_area, out=np.zeros(n), where=hull_area > 0)
+    if selected.intersection(hu_names):
+        with timed("batch_hu_moments", FEATURE):
+            hu = hu_moments(moments)
+        for name, column in zip(hu_names, hu.T):
+            if name in selected:
+                features[name] = column
+    if "num_defects" in selected:
+        features["num_defects"] = num_defects
+    if "eccentricity" in selected:
+        features["eccentricity"] = eccentricity
+    if "num_corners" in selected:
+        features["num_corners"] = num_corners
+
+    if "fourier_1_mag" in selected:
+        with timed("batch_fourier_1_mag", FEATURE):
+            # First Fourier harmonic: sum over k of z_k * exp(-2j * pi * k / N), per contour
+            local_index = np.arange(len(points)) - np.repeat(starts, counts)
+            phase = -2 * np.pi * local_index / np.repeat(counts, counts)
+            cos, sin = np.cos(phase), np.sin(phase)
+            real = np.add.reduceat(x0 * cos - y0 * sin, starts)
+            imag = np.add.reduceat(x0 * sin + y0 * cos, starts)
+            features["fourier_1_mag"] = np.where(counts > 1, np.hypot(real, imag), np.nan)
+
+    if "skeleton_length" in selected:
+        with timed("batch_skeleton_length", FEATURE):
+            features["skeleton_length"] = np.array(
+                [contour_skeleton_length(contour, mask_shape) for contour in contours], dtype=np.float64
+            )
+
+    features.update(bbox_x=bbox_x, bbox_y=bbox_y, bbox_w=w, bbox_h=h)
+    return features
+
+def feature_table_to_records(table: Dict[str, np.ndarray]) -> List[Dict[str, float]]:
+    """
+    Convert a columnar feature table into one dictionary per contour, shaped like the
+    output of extract_shape_features (missing values are left out).
+    """
+    names = [name for name in FEATURE_NAMES if name in table]
+    columns = [table[name].tolist() for name in names]
+    records = []
+    for row in zip(*columns):
+        record = {}
+        for name, value in zip(names, row):
+            if value != value:
+                continue
+            record[name] = int(value) if name in INTEGER_FEATURES else value
+        records.append(record)
+    return records
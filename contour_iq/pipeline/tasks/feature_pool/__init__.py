@@ -0,0 +1,3 @@
+from . import core
+from .core import FeatureProcessPool
+from .core import get_feature_pool
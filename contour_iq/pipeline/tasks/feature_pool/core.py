@@ -0,0 +1,140 @@
+import os
+import threading
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+from common_utils.contour_set import ContourSet
+from pipeline.tasks.feature_extraction import extract_shape_features_batch
+
+# Number of feature worker processes used by run_contour_pipeline when none is given.
+# 1 keeps feature extraction in the calling process.
+FEATURE_WORKERS = int(os.getenv("CONTOUR_IQ_FEATURE_WORKERS", "1"))
+
+# Frames with fewer contours are processed in the calling process, the transfer costs more than it saves.
+MIN_CONTOURS_PER_SHARD = int(os.getenv("CONTOUR_IQ_MIN_CONTOURS_PER_SHARD", "32"))
+
+# Shards per worker, more shards balance uneven contour costs better.
+SHARDS_PER_WORKER = 4
+
+def extract_shard(
+    shm_name: str,
+    n_points: int,
+    offsets: np.ndarray,
+    mask_shape: tuple,
+    features: List[str] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    Worker task: compute the feature table of the contours stored at `offsets` in a shared point buffer.
+
+    Parameters:
+    - shm_name: Name of the shared memory block holding all points as int32 (x, y) pairs
+    - n_points: Number of points in the block
+    - offsets: Point offsets of this shard's contours, one more than the number of contours
+    - mask_shape: Frame shape, forwarded to extract_shape_features_batch
+    - features: Features to compute, forwarded to extract_shape_features_batch
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        points = np.ndarray((n_points, 1, 2), dtype=np.int32, buffer=shm.buf)
+        contours = [points[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        table = extract_shape_features_batch(contours, mask_shape=mask_shape, features=features)
+        del contours, points
+        return table
+    finally:
+        shm.close()
+
+def split_shards(counts: np.ndarray, n_shards: int) -> List[Tuple[int, int]]:
+    """
+    Split contours into contiguous shards of about equal total point count.
+
+    Returns:
+    - List of (first, last + 1) contour index ranges, in order
+    """
+    cumulative = np.cumsum(counts)
+    targets = cumulative[-1] * np.arange(1, n_shards) / n_shards
+    bounds = np.unique(np.concatenate([[0], np.searchsorted(cumulative, targets, side="right"), [len(counts)]]))
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+class FeatureProcessPool:
+    """
+    Persistent process pool that shards extract_shape_features_batch across cores.
+
+    Contour points are copied once into a shared memory block, workers read them in place.
+    Only the offsets of each shard and the resulting feature columns are pickled.
+    """
+
+    def __init__(self, max_workers: int = None, start_method: str = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        if start_method is None:
+            start_method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=mp.get_context(self.start_method),
+                )
+            return self._executor
+
+    def extract(self, contours: Union[List[np.ndarray], ContourSet], mask_shape: tuple = None, features: List[str] = None) -> Dict[str, np.ndarray]:
+        """
+        Compute the feature table of `contours`, same result and order as extract_shape_features_batch.
+        The points of a ContourSet are copied to shared memory in a single block copy.
+        """
+        n_shards = min(self.max_workers * SHARDS_PER_WORKER, len(contours) // MIN_CONTOURS_PER_SHARD)
+        if self.max_workers < 2 or n_shards < 2:
+            return extract_shape_features_batch(contours, mask_shape=mask_shape, features=features)
+
+        if isinstance(contours, ContourSet):
+            counts, offsets = contours.counts, contours.offsets
+        else:
+            counts = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+            offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+        n_points = int(offsets[-1])
+
+        shm = shared_memory.SharedMemory(create=True, size=max(n_points * 2 * 4, 1))
+        try:
+            points = np.ndarray((n_points, 1, 2), dtype=np.int32, buffer=shm.buf)
+            if isinstance(contours, ContourSet):
+                np.copyto(points.reshape(-1, 2), contours.points, casting="unsafe")
+            else:
+                np.concatenate([c.reshape(-1, 1, 2) for c in contours], out=points, casting="unsafe")
+            del points
+
+            futures = [
+                self.executor.submit(extract_shard, shm.name, n_points, offsets[first:last + 1], mask_shape, features)
+                for first, last in split_shards(counts, n_shards)
+            ]
+            tables = [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_feature_pool(max_workers: int = None) -> FeatureProcessPool:
+    """
+    Shared FeatureProcessPool per worker count, so worker processes are started only once.
+    """
+    max_workers = max_workers or FEATURE_WORKERS
+    with _pools_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = FeatureProcessPool(max_workers)
+        return _pools[max_workers]
@@ -0,0 +1,3 @@
+from . import core
+from .core import process_folder
+from .core import run_stages
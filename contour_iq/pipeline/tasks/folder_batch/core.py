@@ -0,0 +1,276 @@
+import os
+import cv2
+import csv
+import glob
+import queue
+import shutil
+import logging
+import threading
+from time import perf_counter
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from pipeline.main import run_contour_pipeline
+from pipeline.tasks.feature_extraction import FEATURE_NAMES
+from pipeline.tasks.analysis import RULES
+from pipeline.tasks.persistence import get_result_writer
+from pipeline.tasks.persistence.core import run_record
+from pipeline.tasks.feature_export import FeatureDatasetWriter, feature_batch
+
+logger = logging.getLogger(__name__)
+
+# Jobs waiting between two stages
+QUEUE_SIZE = int(os.getenv("CONTOUR_IQ_BATCH_QUEUE_SIZE", "8"))
+
+CHECKPOINT_FILE = ".contour_iq_checkpoint"
+FEATURES_FILE = "features.csv"
+FEATURES_DATASET = "features"
+FEATURE_COLUMNS = ["image", "object", *FEATURE_NAMES, *RULES]
+
+# Same quality as the former PIL export
+JPEG_QUALITY = 60
+
+_DONE = object()
+
+def run_stages(items: Iterable, stages: List[Tuple[str, Callable, int]], queue_size: int = None) -> Iterator:
+    """
+    Run items through consecutive stages, each with its own worker threads, connected by
+    bounded queues so a slow stage holds back the ones before it instead of piling up work.
+
+    Parameters:
+    - items: Inputs of the first stage
+    - stages: (name, function, workers) tuples, each function maps one item to the input of the next stage
+    - queue_size: Items waiting between two stages, defaults to CONTOUR_IQ_BATCH_QUEUE_SIZE
+
+    Returns:
+    - Iterator over the results of the last stage, in completion order. Exceptions raised by a
+      stage are returned in place of the item's result.
+    """
+    queue_size = queue_size or QUEUE_SIZE
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def feed():
+        for item in items:
+            queues[0].put(item)
+        for _ in range(stages[0][2]):
+            queues[0].put(_DONE)
+
+    def work(index: int, func: Callable, finished: list, lock: threading.Lock):
+        source, target = queues[index], queues[index + 1]
+        while True:
+            item = source.get()
+            if item is _DONE:
+                break
+            if not isinstance(item, Exception):
+                try:
+                    item = func(item)
+                except Exception as e:
+                    item = e
+            target.put(item)
+
+        # The last worker of a stage tells every worker of the next stage to stop
+        with lock:
+            finished[0] += 1
+            last = finished[0] == stages[index][2]
+        if last:
+            for _ in range(stages[index + 1][2] if index + 1 < len(stages) else 1):
+                target.put(_DONE)
+
+    threads = [threading.Thread(target=feed, name="batch-feed", daemon=True)]
+    for index, (name, func, workers) in enumerate(stages):
+        finished, lock = [0], threading.Lock()
+        threads.extend(
+            threading.Thread(target=work, args=(index, func, finished, lock), name=f"batch-{name}-{i}", daemon=True)
+            for i in range(workers)
+        )
+    for thread in threads:
+        thread.start()
+
+    while True:
+        item = queues[-1].get()
+        if item is _DONE:
+            break
+        yield item
+
+class StageError(Exception):
+    """
+    Failure of one image, carries the image path and the original error.
+    """
+
+    def __init__(self, path: str, error: Exception):
+        super().__init__(f"{path}: {error}")
+        self.path = path
+        self.error = error
+
+def read_checkpoint(output_dir: str) -> set:
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+def process_folder(
+    input_dir: str,
+    output_dir: str,
+    segmenter: Callable,
+    pattern: str = "*.jpg",
+    debug: bool = False,
+    thresholds: Dict[str, float] = None,
+    features: List[str] = None,
+    decode_workers: int = 2,
+    segment_workers: int = 1,
+    analysis_workers: int = None,
+    write_workers: int = 2,
+    queue_size: int = None,
+    resume: bool = True,
+    progress: Callable[[str], None] = None,
+    persist: bool = False,
+    parquet: bool = False,
+    camera: str = None,
+) -> Dict[str, int]:
+    """
+    Analyze every image of a folder: decode, segment, run the contour pipeline and write the
+    annotated image, each stage on its own threads.
+
+    Results go to `output_dir`: one annotated JPEG per image, per-object renders in a folder per
+    image when `debug` is set, and one row per object in features.csv. Finished images are
+    listed in a checkpoint file; with `resume`, they are skipped on the next run. Images are
+    named by their path relative to input_dir everywhere, so images of the same name in
+    different subfolders are kept apart.
+
+    Parameters:
+    - segmenter: Called with the BGR image, returns segments (see pipeline.tasks.segmentation)
+    - pattern: Glob of the images to process, relative to input_dir (`**` matches subfolders)
+    - thresholds, features: see run_contour_pipeline
+    - *_workers: Threads per stage. The segmenter gets one thread unless told otherwise, most
+      models are not thread-safe. analysis_workers defaults to the number of CPUs.
+    - resume: If False, the checkpoint and features.csv are started over
+    - progress: Called with one line per finished image
+    - persist: Also store the results in the database (see pipeline.tasks.persistence), the
+      function returns once they are written or spilled to disk
+    - parquet: Also append the rows to the Parquet dataset `features/` of output_dir,
+      partitioned by date (file modification time) and camera (requires pyarrow, see
+      pipeline.tasks.feature_export)
+    - camera: Camera of the images, for the database and the Parquet dataset. Defaults to the
+      name of input_dir.
+
+    Returns:
+    - Counts of processed, skipped and failed images
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE)
+    features_path = os.path.join(output_dir, FEATURES_FILE)
+    dataset_path = os.path.join(output_dir, FEATURES_DATASET)
+    if not resume:
+        for path in (checkpoint_path, features_path):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(dataset_path, ignore_errors=True)
+    camera = camera if camera is not None else os.path.basename(os.path.normpath(input_dir))
+
+    done = read_checkpoint(output_dir)
+    paths = sorted(glob.glob(os.path.join(input_dir, pattern), recursive=True))
+
+    def image_name(path: str) -> str:
+        return os.path.relpath(path, input_dir).replace(os.sep, "/")
+
+    pending = [path for path in paths if image_name(path) not in done]
+
+    def decode(path):
+        image = cv2.imread(path)
+        if image is None:
+            raise StageError(path, RuntimeError("cannot decode image"))
+        return {"path": path, "image": image}
+
+    def segment(job):
+        try:
+            job["segments"] = segmenter(job["image"])
+        except Exception as e:
+            raise StageError(job["path"], e)
+        return job
+
+    result_writer = get_result_writer() if persist else None
+
+    def analyze(job):
+        try:
+            image = job.pop("image")
+            job["output"] = run_contour_pipeline(
+                image, job.pop("segments"), render_individual=debug, thresholds=thresholds, features=features
+            )
+            if result_writer:
+                result_writer.submit(run_record(
+                    job["output"], "analyze_folder", image.shape, image_name(job["path"]), thresholds, camera
+                ))
+        except Exception as e:
+            raise StageError(job["path"], e)
+        return job
+
+    def write(job):
+        path, output = job.pop("path"), job.pop("output")
+        name = image_name(path)
+        target = os.path.join(output_dir, *name.split("/"))
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            ok, encoded = cv2.imencode(".jpg", output["annotated_image"], [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                raise StageError(path, RuntimeError("cannot encode the annotated image"))
+            encoded.tofile(target)
+            if debug:
+                object_dir = os.path.splitext(target)[0]
+                os.makedirs(object_dir, exist_ok=True)
+                for i, object_image in enumerate(output["object_images"]):
+                    ok, encoded = cv2.imencode(".jpg", object_image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                    if not ok:
+                        raise StageError(path, RuntimeError(f"cannot encode the render of object {i + 1}"))
+                    encoded.tofile(os.path.join(object_dir, f"object_{i+1}_features.jpg"))
+        except StageError:
+            raise
+        except Exception as e:
+            raise StageError(path, e)
+        rows = [{"image": name, "object": i, **result} for i, result in enumerate(output["results"])]
+        batch = None
+        if parquet:
+            captured_at = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+            batch = feature_batch(output, name, camera, captured_at)
+        return name, rows, batch
+
+    stages = [
+        ("decode", decode, decode_workers),
+        ("segment", segment, segment_workers),
+        ("analyze", analyze, analysis_workers or os.cpu_count() or 1),
+        ("write", write, write_workers),
+    ]
+
+    counts = {"processed": 0, "skipped": len(paths) - len(pending), "failed": 0}
+    start = perf_counter()
+    new_file = not os.path.exists(features_path)
+    # Rows and checkpoint entries are written from this thread only, in that order, so an
+    # image listed in the checkpoint always has its rows in features.csv. The Parquet dataset
+    # gets new part files on every run, which are complete once the writer is closed.
+    dataset = FeatureDatasetWriter(dataset_path) if parquet else None
+    with open(features_path, "a", newline="") as features_file, open(checkpoint_path, "a") as checkpoint, dataset or nullcontext():
+        writer = csv.DictWriter(features_file, fieldnames=FEATURE_COLUMNS, extrasaction="ignore")
+        if new_file:
+            writer.writeheader()
+        for result in run_stages(pending, stages, queue_size):
+            if isinstance(result, Exception):
+                counts["failed"] += 1
+                logger.error("Batch: %s", result)
+                if progress:
+                    progress(f"failed {result}")
+                continue
+            name, rows, batch = result
+            writer.writerows(rows)
+            features_file.flush()
+            if dataset:
+                dataset.write(batch)
+            checkpoint.write(name + "\n")
+            checkpoint.flush()
+            counts["processed"] += 1
+            if progress:
+                progress(f"{counts['processed']}/{len(pending)} {name}: {len(rows)} objects")
+
+    if result_writer and not result_writer.flush():
+        logger.error("Batch: the database is failing, results left in %s", result_writer.spill_dir)
+    counts["seconds"] = round(perf_counter() - start, 3)
+    return counts
@@ -0,0 +1,4 @@
+from . import core
+from .core import ResultWriter
+from .core import get_result_writer
+from .core import persist_run
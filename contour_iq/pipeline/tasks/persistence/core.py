@@ -0,0 +1,461 @@
+import io
+import os
+import stat
+import base64
+import csv
+import glob
+import json
+import queue
+import logging
+import tempfile
+import threading
+import numpy as np
+from time import perf_counter, sleep
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Union
+from common_utils.contour_set import ContourSet
+from common_utils.metrics.core import COUNTERS, timed
+
+logger = logging.getLogger(__name__)
+
+# Set CONTOUR_IQ_PERSIST=1 to store every analysis in the database (see ResultWriter)
+PERSIST = os.getenv("CONTOUR_IQ_PERSIST", "0") != "0"
+
+# Runs waiting in memory for the writer, further runs are spilled to disk
+BUFFER_SIZE = int(os.getenv("CONTOUR_IQ_PERSIST_BUFFER", "256"))
+
+# Objects written per transaction
+BATCH_OBJECTS = int(os.getenv("CONTOUR_IQ_PERSIST_BATCH", "5000"))
+
+# Longest time a run waits for others to share its transaction
+FLUSH_INTERVAL = float(os.getenv("CONTOUR_IQ_PERSIST_INTERVAL", "0.5"))
+
+# One directory per user: the spill directory must belong to the user running the writer (see check_spill_dir)
+SPILL_DIR = os.getenv(
+    "CONTOUR_IQ_PERSIST_SPILL_DIR", os.path.join(tempfile.gettempdir(), f"contour_iq_spill_{getattr(os, 'getuid', lambda: '')()}")
+)
+
+class RunRecord(NamedTuple):
+    """
+    Everything stored about one analysis run, as produced by the pipeline.
+    """
+    created_at: datetime
+    source: str
+    image_name: str
+    width: int
+    height: int
+    contours: Union[ContourSet, List[np.ndarray]]
+    results: List[Dict[str, Union[float, bool]]]
+    attributes: List[Dict[str, bool]]
+    thresholds: Dict[str, float]
+    timings: Dict[str, Dict[str, float]]
+    camera: str = ""
+
+def run_record(
+    output, source: str, image_shape: tuple, image_name: str = "", thresholds: Dict[str, float] = None, camera: str = ""
+) -> RunRecord:
+    """
+    RunRecord of a run_contour_pipeline (or run_contour_pipeline_batch) output. Only
+    references are taken, nothing is copied.
+    """
+    return RunRecord(
+        datetime.now(timezone.utc), source, image_name, int(image_shape[1]), int(image_shape[0]),
+        output["contours"], output["results"], output["attributes"], dict(thresholds or {}), output.get("timings", {}),
+        camera or "",
+    )
+
+def record_to_json(record: RunRecord) -> str:
+    """
+    One JSON line holding a RunRecord, contours as base64 int32 buffers (see ContourSet.to_buffers).
+    Spill files are JSON so that loading them can never run code.
+    """
+    contours = record.contours if isinstance(record.contours, ContourSet) else ContourSet.from_polygons(record.contours)
+    points, offsets = contours.to_buffers()
+    return json.dumps(
+        {
+            **record._asdict(),
+            "created_at": record.created_at.isoformat(),
+            "contours": {"points": base64.b64encode(points).decode(), "offsets": base64.b64encode(offsets).decode()},
+        },
+        # NumPy scalars left in results and attributes
+        default=lambda value: value.item(),
+    )
+
+def record_from_json(line: str) -> RunRecord:
+    """
+    RunRecord of a record_to_json line.
+
+    Raises:
+    - ValueError, KeyError, TypeError: On a malformed line
+    """
+    values = json.loads(line)
+    contours = values["contours"]
+    values["contours"] = ContourSet.from_buffers(base64.b64decode(contours["points"]), base64.b64decode(contours["offsets"]))
+    values["created_at"] = datetime.fromisoformat(values["created_at"])
+    return RunRecord(**values)
+
+def check_spill_dir(path: str):
+    """
+    Create the spill directory readable by its owner only, and refuse a directory that another
+    user owns or may write to: its files are loaded into the database as this user's results.
+
+    Raises:
+    - PermissionError: If the directory is not private to the current user
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"spill directory {path} belongs to another user")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"spill directory {path} is writable by other users")
+
+def object_rows(record: RunRecord, run_id: int) -> tuple:
+    """
+    Column values of the objects and features of a run.
+
+    Returns:
+    - (object rows, feature rows): (run, index, x, y, width, height, points, attributes) and
+      (run, object_index, name, value) tuples
+    """
+    contours = record.contours if isinstance(record.contours, ContourSet) else ContourSet.from_polygons(record.contours)
+    boxes = contours.bboxes.tolist()
+    points = contours.points.astype("<i4", copy=False)
+
+    objects, features = [], []
+    for index, (result, attributes) in enumerate(zip(record.results, record.attributes)):
+        start, end = contours.offsets[index], contours.offsets[index + 1]
+        objects.append((run_id, index, *boxes[index], points[start:end].tobytes(), attributes))
+        features.extend(
+            (run_id, index, name, float(value))
+            for name, value in result.items()
+            if not isinstance(value, bool) and value is not None
+        )
+    return objects, features
+
+def copy_rows(cursor, model, columns: List[str], rows: list):
+    """
+    Load rows with COPY FROM STDIN (PostgreSQL, psycopg2 or psycopg 3).
+    """
+    quote = cursor.db.ops.quote_name
+    table = quote(model._meta.db_table)
+    names = ", ".join(quote(model._meta.get_field(column).column) for column in columns)
+    statement = f"COPY {table} ({names}) FROM STDIN WITH (FORMAT csv)"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(
+            "\\x" + value.hex() if isinstance(value, bytes) else json.dumps(value) if isinstance(value, dict) else value
+            for value in row
+        )
+    buffer.seek(0)
+
+    raw = cursor.cursor
+    if hasattr(raw, "copy_expert"):
+        raw.copy_expert(statement, buffer)
+    else:
+        with raw.copy(statement) as copy:
+            copy.write(buffer.getvalue())
+
+def create_rows(cursor, model, columns: List[str], rows: list):
+    """
+    Load rows with bulk_create, in batches of at most CONTOUR_IQ_PERSIST_BATCH objects (fewer
+    where the backend limits query parameters).
+    """
+    fields = [model._meta.get_field(column).attname for column in columns]
+    model.objects.bulk_create((model(**dict(zip(fields, row))) for row in rows), batch_size=BATCH_OBJECTS)
+
+def write_runs(records: List[RunRecord]):
+    """
+    Store runs in one transaction: runs with bulk_create (their ids are needed), objects and
+    features with COPY on PostgreSQL and bulk_create elsewhere.
+    """
+    from django.db import close_old_connections, connection, transaction
+    from pipeline.models import AnalysisRun, AnalyzedObject, ObjectFeature
+
+    # Drop a connection broken by an earlier failure instead of failing on it again
+    close_old_connections()
+    with transaction.atomic():
+        runs = AnalysisRun.objects.bulk_create([
+            AnalysisRun(
+                created_at=record.created_at, source=record.source, image_name=record.image_name, camera=record.camera,
+                width=record.width, height=record.height, object_count=len(record.results),
+                thresholds=record.thresholds, timings=record.timings,
+            )
+            for record in records
+        ])
+
+        objects, features = [], []
+        for record, run in zip(records, runs):
+            run_objects, run_features = object_rows(record, run.pk)
+            objects.extend(run_objects)
+            features.extend(run_features)
+
+        object_columns = ["run", "index", "x", "y", "width", "height", "points", "attributes"]
+        feature_columns = ["run", "object_index", "name", "value"]
+        load = copy_rows if connection.vendor == "postgresql" else create_rows
+        with connection.cursor() as cursor:
+            load(cursor, AnalyzedObject, object_columns, objects)
+            load(cursor, ObjectFeature, feature_columns, features)
+
+class ResultWriter:
+    """
+    Write-behind persistence of analysis runs: submit() only queues the run, a background
+    thread stores queued runs in batches (see write_runs), so requests never wait for the
+    database.
+
+    At most `buffer_size` runs wait in memory. When the buffer is full, or a batch cannot be
+    written, runs are saved to `spill_dir` instead, and written once the database keeps up
+    again. Spill files are JSON lines (see record_to_json), in a directory that must belong to
+    the current user and no one else may write to (see check_spill_dir). Nothing is dropped
+    unless the spill directory cannot be written either. Several
+    processes may share the spill directory: a writer claims a file (renames it) before loading
+    it, so every spilled run is written once, and files claimed by a process that died are
+    released when the next writer starts.
+
+    Parameters:
+    - buffer_size: Defaults to CONTOUR_IQ_PERSIST_BUFFER
+    - batch_objects: Objects per transaction, defaults to CONTOUR_IQ_PERSIST_BATCH
+    - flush_interval: Seconds a run waits for others to join its batch, defaults to CONTOUR_IQ_PERSIST_INTERVAL
+    - spill_dir: Defaults to CONTOUR_IQ_PERSIST_SPILL_DIR
+    - write: Called with a list of RunRecords, defaults to write_runs
+    """
+
+    # Pause after a failed write before the next attempt
+    RETRY_SECONDS = 5.0
+
+    def __init__(self, buffer_size: int = None, batch_objects: int = None, flush_interval: float = None, spill_dir: str = None, write=None):
+        self.buffer_size = buffer_size or BUFFER_SIZE
+        self.batch_objects = batch_objects or BATCH_OBJECTS
+        self.flush_interval = FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.spill_dir = spill_dir or SPILL_DIR
+        self.write = write or write_runs
+        self._queue = queue.Queue(maxsize=self.buffer_size)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._spilled = 0
+        self._retry_at = 0.0
+        self._spill_dir_error = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self.buffer_size)
+                self._release_orphans()
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name="result-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, record: RunRecord):
+        """
+        Queue a run for writing, never blocks on the database.
+        """
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._spill([record])
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until every run queued so far is handled, and every spilled run is written unless
+        the database is failing.
+
+        Returns:
+        - True if everything is written, False if runs are left on disk (database failing) or
+          the timeout expired first
+        """
+        self._ensure_thread()
+        deadline = None if timeout is None else perf_counter() + timeout
+        while True:
+            failing = perf_counter() < self._retry_at
+            if not self._queue.unfinished_tasks and (failing or not (self.spilled_files() or self._claimed_files())):
+                return not failing
+            if deadline is not None and perf_counter() > deadline:
+                return False
+            sleep(0.01)
+
+    def spilled_files(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.spill_dir, "*.jsonl")))
+
+    def _claimed_files(self) -> List[str]:
+        return glob.glob(os.path.join(self.spill_dir, f"*.jsonl.{os.getpid()}.claimed"))
+
+    def _spill(self, records: List[RunRecord]):
+        with self._spill_lock:
+            self._spilled += 1
+            name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{os.getpid()}-{self._spilled}.jsonl"
+        try:
+            check_spill_dir(self.spill_dir)
+            path = os.path.join(self.spill_dir, name)
+            with open(path + ".tmp", "w") as f:
+                f.writelines(record_to_json(record) + "\n" for record in records)
+            os.replace(path + ".tmp", path)
+            COUNTERS["persistence"].inc("spilled", len(records))
+        except Exception as e:
+            COUNTERS["persistence"].inc("dropped", len(records))
+            logger.error("Persistence: cannot spill %d runs to %s: %s", len(records), self.spill_dir, e)
+
+    def _store(self, records: List[RunRecord]) -> bool:
+        # After a failure, runs go straight to disk for a while instead of waiting on the database
+        if perf_counter() < self._retry_at:
+            return False
+        try:
+            with timed("persist"):
+                self.write(records)
+        except Exception as e:
+            logger.error("Persistence: writing %d runs failed: %s", len(records), e)
+            self._retry_at = perf_counter() + self.RETRY_SECONDS
+            return False
+        COUNTERS["persistence"].inc("written", len(records))
+        return True
+
+    def _spill_dir_ok(self) -> bool:
+        try:
+            check_spill_dir(self.spill_dir)
+        except OSError as e:
+            # Logged once, replay attempts come every flush interval
+            if str(e) != self._spill_dir_error:
+                logger.error("Persistence: %s, spilled runs are ignored", e)
+            self._spill_dir_error = str(e)
+            return False
+        self._spill_dir_error = None
+        return True
+
+    def _claim(self, path: str) -> str:
+        """
+        Take a spill file for this process by renaming it, so writers of other processes sharing
+        the spill directory (e.g. gunicorn workers) never load it too.
+
+        Returns:
+        - Path of the claimed file, None if another writer took it first
+        """
+        claimed = f"{path}.{os.getpid()}.claimed"
+        try:
+            os.replace(path, claimed)
+        except FileNotFoundError:
+            return None
+        return claimed
+
+    def _release_orphans(self):
+        """
+        Return spill files claimed by processes that died before writing them.
+        """
+        if not os.path.isdir(self.spill_dir) or not self._spill_dir_ok():
+            return
+        for claimed in glob.glob(os.path.join(self.spill_dir, "*.jsonl.*.claimed")):
+            path, pid = claimed[: -len(".claimed")].rsplit(".", 1)
+            try:
+                os.kill(int(pid), 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except (ValueError, OSError):
+                continue
+            try:
+                os.replace(claimed, path)
+            except OSError:
+                pass
+
+    def _replay(self, source: queue.Queue):
+        """
+        Write spilled runs, oldest first, while no fresh run is waiting.
+        """
+        paths = self.spilled_files()
+        if not paths or not self._spill_dir_ok():
+            return
+        for path in paths:
+            if not source.empty():
+                return
+            claimed = self._claim(path)
+            if claimed is None:
+                continue
+            try:
+                with open(claimed) as f:
+                    records = [record_from_json(line) for line in f if line.strip()]
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.error("Persistence: unreadable spill file %s: %s", path, e)
+                try:
+                    os.replace(claimed, path + ".bad")
+                except OSError:
+                    pass
+                continue
+            stored = self._store(records)
+            try:
+                if stored:
+                    os.remove(claimed)
+                else:
+                    # Back to the spilled runs while the database is failing
+                    os.replace(claimed, path)
+            except OSError as e:
+                logger.error("Persistence: cannot remove or release spill file %s: %s", claimed, e)
+            if not stored:
+                return
+
+    def _run(self, source: queue.Queue):
+        while True:
+            try:
+                self._run_once(source)
+            except Exception:
+                # The thread must survive anything: later runs would queue forever without it
+                logger.exception("Persistence: result writer failed")
+
+    def _run_once(self, source: queue.Queue):
+        try:
+            batch = [source.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            self._replay(source)
+            return
+
+        try:
+            objects = len(batch[0].results)
+            deadline = perf_counter() + self.flush_interval
+            while objects < self.batch_objects:
+                try:
+                    record = source.get(timeout=max(deadline - perf_counter(), 0))
+                except queue.Empty:
+                    break
+                batch.append(record)
+                objects += len(record.results)
+
+            if not self._store(batch):
+                self._spill(batch)
+        finally:
+            for _ in batch:
+                source.task_done()
+        self._replay(source)
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def setup_django():
+    """
+    Set up Django when the process has not done it (e.g. the API server), so the models can be used.
+    """
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        os.environ.setdefault("DJANGO_SETTINGS_MODULE", "contour_iq.settings")
+        django.setup()
+
+def get_result_writer() -> ResultWriter:
+    """
+    Process-wide result writer, created on first use.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            setup_django()
+            _writer = ResultWriter()
+        return _writer
+
+def persist_run(
+    output, source: str, image_shape: tuple, image_name: str = "", thresholds: Dict[str, float] = None, camera: str = ""
+):
+    """
+    Queue a run_contour_pipeline output for storage when CONTOUR_IQ_PERSIST is set.
+    """
+    if PERSIST:
+        get_result_writer().submit(run_record(output, source, image_shape, image_name, thresholds, camera))
@@ -1,3 +1,9 @@
 from . import core
+from .core import MaskROI
 from .core import polygon_to_mask
+from .core import polygon_to_roi_mask
 from .core import preprocess_segmentation
+from .core import is_label_map
+from .core import label_map_to_roi_masks
+from .core import iter_preprocess_segmentation
+from .core import padded_roi
@@ -2,9 +2,52 @@
 
 import os
 import cv2
+import logging
+import threading
 import numpy as np
-from typing import List, Union
+from collections import deque
+from contextlib import nullcontext
+from scipy import ndimage
+from typing import Iterable, Iterator, List, NamedTuple, Tuple, Union
 from concurrent.futures import ThreadPoolExecutor
+from common_utils.contour_set import ContourSet
+
+logger = logging.getLogger(__name__)
+
+# Padding (in pixels) kept around each object's bounding box in ROI mode.
+# Two pixels keep the 3x3 closing and the contour tracer away from the crop border,
+# so ROI-local results are identical to the full-frame ones.
+ROI_PADDING = 2
+
+# Threads of the preprocessing pool shared by all pipeline runs of a process
+PREPROCESS_WORKERS = int(os.getenv("CONTOUR_IQ_PREPROCESS_WORKERS", str(os.cpu_count() or 4)))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_preprocess_executor() -> ThreadPoolExecutor:
+    """
+    Process-wide preprocessing pool, created on first use (again in a forked child). Concurrent
+    runs, e.g. the analysis workers of a folder batch, share its threads instead of starting
+    one pool each.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="contour-iq-preprocess")
+            _executor_pid = os.getpid()
+        return _executor
+
+class MaskROI(NamedTuple):
+    """
+    Binary mask cropped to an object's padded bounding box.
+
+    - mask: ROI-local binary mask
+    - offset: (x, y) position of the mask's top-left pixel in the full frame
+    """
+    mask: np.ndarray
+    offset: Tuple[int, int]
 
 def polygon_to_mask(polygon: List[tuple], image_shape: tuple) -> np.ndarray:
     mask = np.zeros(image_shape[:2], dtype=np.uint8)
@@ -12,6 +55,99 @@ def polygon_to_mask(polygon: List[tuple], image_shape: tuple) -> np.ndarray:
     cv2.fillPoly(mask, [pts], color=1)
     return mask
 
+def padded_roi(x: int, y: int, w: int, h: int, image_shape: tuple, padding: int = ROI_PADDING) -> Tuple[int, int, int, int]:
+    """
+    Grow a bounding box by `padding` pixels and clip it to the frame.
+
+    Returns:
+    - (x0, y0, x1, y1) slice bounds in full-frame coordinates
+    """
+    height, width = image_shape[:2]
+    x0 = min(max(x - padding, 0), width)
+    y0 = min(max(y - padding, 0), height)
+    x1 = max(min(x + w + padding, width), x0)
+    y1 = max(min(y + h + padding, height), y0)
+    return x0, y0, x1, y1
+
+def polygon_to_roi_mask(polygon: List[tuple], image_shape: tuple, padding: int = ROI_PADDING) -> MaskROI:
+    """
+    Rasterize a polygon inside its padded bounding box only.
+
+    Parameters:
+    - polygon: List of (x, y) points in full-frame coordinates
+    - image_shape: Shape of the full frame
+    - padding: Pixels of background kept around the bounding box
+
+    Returns:
+    - MaskROI with the local mask and its offset in the frame
+    """
+    pts = np.asarray(polygon, dtype=np.int32).reshape(-1, 2)
+    x0, y0, x1, y1 = padded_roi(*cv2.boundingRect(pts), image_shape, padding)
+    mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+    if mask.size:
+        cv2.fillPoly(mask, [pts], color=1, offset=(-x0, -y0))
+    return MaskROI(mask, (x0, y0))
+
+def mask_to_roi_mask(mask: np.ndarray, padding: int = ROI_PADDING) -> MaskROI:
+    """
+    Crop a full-frame binary mask to the padded bounding box of its foreground.
+    The returned mask is a view, no pixels are copied.
+    """
+    x0, y0, x1, y1 = padded_roi(*cv2.boundingRect(mask), mask.shape, padding)
+    return MaskROI(mask[y0:y1, x0:x1], (x0, y0))
+
+def is_label_map(segments, image_shape: tuple) -> bool:
+    """
+    Whether `segments` is an instance label map of the image: a single 2D integer array of the
+    image's height and width (0 is background, every other value one object) instead of a list
+    of masks or polygons.
+    """
+    return (
+        isinstance(segments, np.ndarray)
+        and segments.ndim == 2
+        and np.issubdtype(segments.dtype, np.integer)
+        and segments.shape == tuple(image_shape[:2])
+    )
+
+def iter_label_map_roi_masks(label_map: np.ndarray, padding: int = ROI_PADDING) -> Iterator[MaskROI]:
+    """
+    Split an instance label map into one ROI mask per label, in increasing label order.
+
+    The bounding boxes of all labels are found in a single pass over the map
+    (scipy.ndimage.find_objects); each mask is then built inside its padded box only,
+    when the iterator reaches it.
+
+    Parameters:
+    - label_map: (H, W) array of non-negative integer instance IDs, 0 is background
+    - padding: Pixels of background kept around each bounding box
+
+    Returns:
+    - Iterator over MaskROI entries, one per label present in the map
+    """
+    for label, found in enumerate(ndimage.find_objects(label_map), start=1):
+        if found is None:
+            continue
+        rows, cols = found
+        x0, y0, x1, y1 = padded_roi(
+            cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start, label_map.shape, padding
+        )
+        yield MaskROI((label_map[y0:y1, x0:x1] == label).view(np.uint8), (x0, y0))
+
+def label_map_to_roi_masks(label_map: np.ndarray, padding: int = ROI_PADDING) -> List[MaskROI]:
+    """
+    List of the ROI masks of iter_label_map_roi_masks.
+    """
+    return list(iter_label_map_roi_masks(label_map, padding))
+
+def roi_mask_to_mask(mask: MaskROI, image_shape: tuple) -> np.ndarray:
+    """
+    Paste a ROI mask into an empty full-frame mask.
+    """
+    full = np.zeros(image_shape[:2], dtype=np.uint8)
+    x, y = mask.offset
+    full[y:y + mask.mask.shape[0], x:x + mask.mask.shape[1]] = mask.mask
+    return full
+
 # def preprocess_segmentation(image: np.ndarray, segments: List[Union[np.ndarray, List[tuple]]]) -> List[np.ndarray]:
 #     """
 #     Normalize input segments to a list of cleaned binary masks.
@@ -34,39 +170,113 @@ def clean_mask(mask: np.ndarray, apply_morphology: bool = True) -> np.ndarray:
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
     return cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
 
-def process_segment(seg: Union[np.ndarray, List[tuple]], image_shape: tuple, apply_morphology: bool = True) -> np.ndarray:
-    if isinstance(seg, list):
-        mask = polygon_to_mask(seg, image_shape)
+def process_segment(
+    seg: Union[np.ndarray, List[tuple]],
+    image_shape: tuple,
+    apply_morphology: bool = True,
+    roi: bool = False,
+    padding: int = ROI_PADDING,
+    polygon: bool = None,
+) -> Union[np.ndarray, MaskROI]:
+    # MaskROI entries come from label maps and are already cropped
+    if isinstance(seg, MaskROI):
+        if roi:
+            return MaskROI(clean_mask(seg.mask, apply_morphology=apply_morphology), seg.offset)
+        return clean_mask(roi_mask_to_mask(seg, image_shape), apply_morphology=apply_morphology)
+
+    # Lists are polygons, arrays are masks unless told otherwise (ContourSet entries are point arrays)
+    if polygon is None:
+        polygon = isinstance(seg, list)
+
+    if not roi:
+        if polygon:
+            mask = polygon_to_mask(seg, image_shape)
+        else:
+            mask = seg
+        return clean_mask(mask, apply_morphology=apply_morphology)
+
+    if polygon:
+        mask, offset = polygon_to_roi_mask(seg, image_shape, padding)
     else:
-        mask = seg
-    return clean_mask(mask, apply_morphology=apply_morphology)
+        mask, offset = mask_to_roi_mask(seg, padding)
+    return MaskROI(clean_mask(mask, apply_morphology=apply_morphology), offset)
+
+def iter_preprocess_segmentation(
+    image: np.ndarray,
+    segments: Union[Iterable[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
+    apply_morphology: bool = False,
+    max_workers:int = None,
+    roi: bool = False,
+    padding: int = ROI_PADDING,
+    window: int = None,
+) -> Iterator[Union[np.ndarray, MaskROI]]:
+    """
+    Same masks as preprocess_segmentation, produced one at a time in segment order.
+
+    At most `window` segments are being processed or waiting to be consumed at any time, so
+    the masks a caller has not released yet stay bounded whatever the number of segments.
+
+    Parameters:
+    - window: Segments in flight, defaults to twice the number of threads
+    - see preprocess_segmentation for the others
+    """
+    shared = max_workers is None
+    if shared:
+        max_workers = PREPROCESS_WORKERS
+
+    if is_label_map(segments, image.shape):
+        logger.debug("Preprocessing: %d threads for a label map", max_workers)
+        segments = iter_label_map_roi_masks(segments, padding)
+    elif hasattr(segments, "__len__"):
+        logger.debug("Preprocessing: %d threads for %d segments", max_workers, len(segments))
+    else:
+        logger.debug("Preprocessing: %d threads for a stream of segments", max_workers)
+
+    polygon = True if isinstance(segments, ContourSet) else None
+
+    def process(segment):
+        return process_segment(segment, image.shape, apply_morphology, roi, padding, polygon)
+
+    if max_workers < 2:
+        for segment in segments:
+            yield process(segment)
+        return
+
+    window = window or 2 * max_workers
+    with nullcontext(get_preprocess_executor()) if shared else ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for segment in segments:
+            pending.append(executor.submit(process, segment))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 def preprocess_segmentation(
     image: np.ndarray,
-    segments: List[Union[np.ndarray, List[tuple]]],
+    segments: Union[List[Union[np.ndarray, List[tuple]]], ContourSet, np.ndarray],
     apply_morphology: bool = False,
     max_workers:int = None,
-) -> List[np.ndarray]:
+    roi: bool = False,
+    padding: int = ROI_PADDING,
+) -> List[Union[np.ndarray, MaskROI]]:
     """
     Normalize input segments to a list of cleaned binary masks.
     Utilizes parallel processing for performance.
 
     Parameters:
     - image: Input image used to determine shape
-    - segments: List of binary masks or polygons
+    - segments: List of binary masks or polygons, a ContourSet of polygons, or an (H, W)
+      instance label map (see iter_label_map_roi_masks)
     - apply_morphology: If True, apply morphological cleaning
+    - max_workers: Threads of a pool of this call's own, None shares the process-wide pool of
+      CONTOUR_IQ_PREPROCESS_WORKERS threads (default: number of CPUs, see get_preprocess_executor)
+    - roi: If True, rasterize and clean each segment only inside its padded bounding box
+      and return MaskROI entries instead of full-frame masks
+    - padding: Pixels kept around each bounding box in ROI mode
 
     Returns:
-    - List of processed binary masks
+    - List of processed binary masks (MaskROI entries in ROI mode). All masks are held at
+      once, iter_preprocess_segmentation streams them instead.
     """
-    if max_workers is None:
-        max_workers = os.cpu_count() or 4 
-
-    print(f"[Preprocessing] Using {max_workers} threads for {len(segments)} segments.")
-
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = executor.map(
-            lambda s: process_segment(s, image.shape, apply_morphology), segments
-        )
-    return list(results)
\ No newline at end of file
+    return list(iter_preprocess_segmentation(image, segments, apply_morphology, max_workers, roi, padding))
@@ -0,0 +1,12 @@
+from . import core
+from .core import load_segmenter
+from .core import yolo_segmentation_to_masks
+from .core import ThresholdSegmenter
+from .core import YoloSegmenter
+from .core import get_segmenter
+from .core import StubSegmenter
+from .core import segment_batch
+from .core import get_segmentation_batcher
+from .core import resize_mask_stack
+from .core import mask_stack_to_polygons
+from .core import yolo_segmentation_to_polygons
@@ -0,0 +1,255 @@
+import os
+import cv2
+import importlib
+import time
+import threading
+import numpy as np
+from typing import Callable, List, Union
+from common_utils.contour_set import ContourSet
+from common_utils.metrics.core import timed
+from common_utils.micro_batch.core import MicroBatcher
+
+# Segmenter used when none is given, see load_segmenter
+DEFAULT_SEGMENTER = os.getenv("CONTOUR_IQ_SEGMENTER", "yolo:/media/amk.front.segmentation.v1.pt")
+
+# A segmenter takes a BGR image and returns what run_contour_pipeline accepts as segments:
+# a list of binary masks or polygons, a ContourSet of polygons, or an instance label map.
+# Segmenters that run several images at once more efficiently also have a
+# segment_batch(images) method (see segment_batch).
+Segmenter = Callable[[np.ndarray], Union[List[np.ndarray], ContourSet, np.ndarray]]
+
+# What YoloSegmenter returns: 'polygons', traced at the model's mask resolution and scaled to
+# the frame (see yolo_segmentation_to_polygons), or 'masks', one full-frame mask per object
+YOLO_OUTPUT = os.getenv("CONTOUR_IQ_YOLO_OUTPUT", "polygons")
+
+def resize_mask_stack(masks: np.ndarray, image_shape: tuple) -> np.ndarray:
+    """
+    Resize a stack of model masks to the frame. The stack is thresholded once at the model's
+    resolution, then each mask is resized (nearest neighbor) straight into one preallocated
+    block: no per-mask scaling, re-thresholding or conversion at full resolution.
+
+    Parameters:
+    - masks: (N, h, w) mask stack, values above 0.5 are foreground
+    - image_shape: Shape of the frame
+
+    Returns:
+    - (N, H, W) uint8 binary masks
+    """
+    height, width = image_shape[:2]
+    binary = (np.asarray(masks) > 0.5).view(np.uint8)
+    resized = np.empty((len(binary), height, width), dtype=np.uint8)
+    for mask, target in zip(binary, resized):
+        cv2.resize(mask, (width, height), dst=target, interpolation=cv2.INTER_NEAREST)
+    return resized
+
+def outline_offsets(contour: np.ndarray) -> np.ndarray:
+    """
+    Miter offsets of a traced outline: where each point moves when both of its edges are
+    pushed one unit outward, e.g. (-1, -1) at the top-left corner of a box. Offsets are capped
+    at the corner length (sqrt 2) on sharp turns and are zero where the outline folds back.
+    """
+    edges = np.roll(contour, -1, axis=0) - contour
+    winding = np.sign(cv2.contourArea(contour, oriented=True))
+    normals = np.stack([edges[:, 1], -edges[:, 0]], axis=1) * winding
+    normals = normals / np.maximum(np.linalg.norm(normals, axis=1, keepdims=True), 1e-9)
+    previous = np.roll(normals, 1, axis=0)
+
+    offsets = (normals + previous) / np.maximum(1 + (normals * previous).sum(axis=1), 1e-9)[:, None]
+    length = np.linalg.norm(offsets, axis=1, keepdims=True)
+    return offsets * np.minimum(1, np.sqrt(2) / np.maximum(length, 1e-9))
+
+def mask_stack_to_polygons(masks: np.ndarray, image_shape: tuple) -> ContourSet:
+    """
+    Trace a stack of model masks at their own resolution and scale the outlines to the frame,
+    so no full-frame mask is ever built. Every external outline of a mask is one polygon.
+
+    A model pixel covers a block of frame pixels. The outlines run through the centers of the
+    blocks, so they are pushed outward by half a block (see outline_offsets) to cover the same
+    area as the resized masks (see resize_mask_stack), instead of shrinking by half a block.
+
+    Parameters:
+    - masks: (N, h, w) mask stack, values above 0.5 are foreground
+    - image_shape: Shape of the frame
+
+    Returns:
+    - ContourSet of polygons in frame coordinates, for run_contour_pipeline's ROI path
+    """
+    masks = np.asarray(masks)
+    height, width = image_shape[:2]
+    scale = np.array([width / masks.shape[2], height / masks.shape[1]])
+
+    polygons = []
+    for mask in (masks > 0.5).view(np.uint8):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        for contour in contours:
+            contour = contour.reshape(-1, 2)
+            if len(contour) < 3:
+                continue
+            center = (contour + 0.5) * scale - 0.5
+            polygons.append(np.rint(center + outline_offsets(contour) * (scale / 2 - 0.5)))
+
+    return ContourSet.from_polygons(polygons).clip(image_shape)
+
+def yolo_segmentation_to_masks(results, image_shape):
+    """
+    Extract and resize YOLOv8 segmentation masks to match the input image shape.
+    The mask stack is copied to the CPU in one transfer and resized with resize_mask_stack.
+    """
+    if results[0].masks is None:
+        return []
+    return list(resize_mask_stack(results[0].masks.data.cpu().numpy(), image_shape))
+
+def yolo_segmentation_to_polygons(results, image_shape) -> ContourSet:
+    """
+    Polygons of YOLOv8 segmentation results, in frame coordinates. They are the outlines
+    ultralytics traces on its low-resolution masks (`masks.xy`), no full-frame mask is built.
+    """
+    if results[0].masks is None:
+        return ContourSet.from_polygons([])
+    polygons = ContourSet.from_polygons([np.rint(xy) for xy in results[0].masks.xy if len(xy) >= 3])
+    return polygons.clip(image_shape)
+
+class YoloSegmenter:
+    """
+    Ultralytics YOLO segmentation model. ultralytics is imported when the model is created.
+
+    Parameters:
+    - weights: Path of the model weights
+    - output: 'polygons' or 'masks', defaults to CONTOUR_IQ_YOLO_OUTPUT
+    """
+
+    def __init__(self, weights: str, output: str = None):
+        output = output or YOLO_OUTPUT
+        if output not in ("polygons", "masks"):
+            raise ValueError(f"Unknown YOLO output '{output}', expected 'polygons' or 'masks'")
+        from ultralytics import YOLO
+        self.weights = weights
+        self.model = YOLO(weights)
+        self.convert = yolo_segmentation_to_polygons if output == "polygons" else yolo_segmentation_to_masks
+
+    def __call__(self, image: np.ndarray) -> Union[ContourSet, List[np.ndarray]]:
+        return self.convert(self.model(image), image.shape)
+
+    def segment_batch(self, images: List[np.ndarray]) -> List[Union[ContourSet, List[np.ndarray]]]:
+        results = self.model(images)
+        return [self.convert([result], image.shape) for result, image in zip(results, images)]
+
+class ThresholdSegmenter:
+    """
+    Model-free segmenter: every connected region brighter than `threshold` is one object.
+    Deterministic and dependency-free, used in tests and to exercise the pipeline without a model.
+    """
+
+    def __init__(self, threshold: int = 127, min_area: int = 1):
+        self.threshold = int(threshold)
+        self.min_area = int(min_area)
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        count, labels, stats, _ = cv2.connectedComponentsWithStats((gray > self.threshold).astype(np.uint8))
+        small = np.flatnonzero(stats[:, cv2.CC_STAT_AREA] < self.min_area)
+        if len(small):
+            labels[np.isin(labels, small[small > 0])] = 0
+        return labels
+
+class StubSegmenter(ThresholdSegmenter):
+    """
+    Stand-in for a batched GPU model in tests and benchmarks: ThresholdSegmenter results, with
+    the latency of a model that pays a fixed cost per call plus a cost per image. Calls run one
+    at a time, as on a single device, and the cost is slept so it does not use the CPU.
+
+    Parameters:
+    - call_seconds: Cost of one call, whatever the number of images
+    - image_seconds: Additional cost per image
+    """
+
+    def __init__(self, call_seconds: float = 0.05, image_seconds: float = 0.005, threshold: int = 127):
+        super().__init__(threshold)
+        self.call_seconds = call_seconds
+        self.image_seconds = image_seconds
+        self.batch_sizes = []
+        self._device = threading.Lock()
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        return self.segment_batch([image])[0]
+
+    def segment_batch(self, images: List[np.ndarray]) -> List[np.ndarray]:
+        with self._device:
+            self.batch_sizes.append(len(images))
+            time.sleep(self.call_seconds + self.image_seconds * len(images))
+        return [ThresholdSegmenter.__call__(self, image) for image in images]
+
+def segment_batch(segmenter: Segmenter, images: List[np.ndarray]) -> list:
+    """
+    Segment several images, in one model call when the segmenter has a segment_batch method,
+    one call per image otherwise.
+    """
+    with timed("segmentation"):
+        if hasattr(segmenter, "segment_batch"):
+            return segmenter.segment_batch(images)
+        return [segmenter(image) for image in images]
+
+def load_segmenter(spec: str = None) -> Segmenter:
+    """
+    Create a segmenter from a specification string.
+
+    Parameters:
+    - spec: One of
+        'yolo:<weights path>': YoloSegmenter
+        'threshold' or 'threshold:<level>': ThresholdSegmenter
+        'stub' or 'stub:<ms per call>': StubSegmenter
+        '<module>:<attribute>': Any callable, called without arguments when it is a class
+      Defaults to CONTOUR_IQ_SEGMENTER.
+
+    Raises:
+    - ValueError: If the specification cannot be resolved
+    """
+    spec = spec or DEFAULT_SEGMENTER
+    kind, _, argument = spec.partition(":")
+    if kind == "yolo":
+        if not argument:
+            raise ValueError("yolo segmenter needs a weights path, e.g. 'yolo:/media/model.pt'")
+        return YoloSegmenter(argument)
+    if kind == "threshold":
+        return ThresholdSegmenter(int(argument)) if argument else ThresholdSegmenter()
+    if kind == "stub":
+        return StubSegmenter(float(argument) / 1000) if argument else StubSegmenter()
+    if not argument:
+        raise ValueError(f"Unknown segmenter '{spec}', expected 'yolo:<weights>', 'threshold[:<level>]', 'stub[:<ms>]' or '<module>:<attribute>'")
+
+    try:
+        segmenter = getattr(importlib.import_module(kind), argument)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot load segmenter '{spec}': {e}")
+    return segmenter() if isinstance(segmenter, type) else segmenter
+
+_segmenter = None
+_segmenter_lock = threading.Lock()
+
+def get_segmenter() -> Segmenter:
+    """
+    Process-wide default segmenter (CONTOUR_IQ_SEGMENTER), loaded on first use so that
+    importing the API does not import ultralytics or torch.
+
+    Called before the server forks its workers (e.g. gunicorn --preload), the weights are
+    loaded once and shared copy-on-write by all workers.
+    """
+    global _segmenter
+    with _segmenter_lock:
+        if _segmenter is None:
+            _segmenter = load_segmenter()
+        return _segmenter
+
+_batcher = None
+
+def get_segmentation_batcher() -> MicroBatcher:
+    """
+    Process-wide micro-batcher in front of the default segmenter: concurrent requests calling it
+    are segmented together, up to CONTOUR_IQ_INFERENCE_BATCH_SIZE images or after
+    CONTOUR_IQ_INFERENCE_MAX_WAIT_MS. Call it with one image, returns that image's segments.
+    """
+    global _batcher
+    with _segmenter_lock:
+        if _batcher is None:
+            _batcher = MicroBatcher(lambda images: segment_batch(get_segmenter(), images), name="segmentation-batch")
+        return _batcher
@@ -0,0 +1,4 @@
+from . import core
+from .core import ObjectTracker
+from .core import contour_boxes
+from .core import match_boxes
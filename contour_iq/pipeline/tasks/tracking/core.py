@@ -0,0 +1,156 @@
+import numpy as np
+from typing import Dict, List, Set, Tuple, Union
+from common_utils.contour_set import ContourSet
+
+def contour_boxes(contours: Union[List[np.ndarray], ContourSet]) -> np.ndarray:
+    """
+    Bounding boxes of contours, as an (n, 4) int64 array of x, y, w, h (same as cv2.boundingRect).
+    """
+    if isinstance(contours, ContourSet):
+        return contours.bboxes
+    boxes = np.zeros((len(contours), 4), dtype=np.int64)
+    for i, contour in enumerate(contours):
+        points = contour.reshape(-1, 2)
+        low, high = points.min(axis=0), points.max(axis=0)
+        boxes[i] = low[0], low[1], high[0] - low[0] + 1, high[1] - low[1] + 1
+    return boxes
+
+class GridIndex:
+    """
+    Uniform grid over bounding boxes: each box is registered in every cell it touches, so the
+    boxes that may overlap a query box are found without comparing against all of them.
+
+    Boxes spanning more than `max_cells` cells along either axis are kept in a separate list
+    returned by every query instead, so a few frame-sized boxes cannot fill the grid.
+    """
+
+    def __init__(self, boxes: np.ndarray, cell_size: int, max_cells: int = 4):
+        self.cell_size = max(int(cell_size), 1)
+        self.max_cells = max_cells
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        self.large: List[int] = []
+        for index, box in enumerate(boxes):
+            columns, rows = self._span(box)
+            if len(columns) > max_cells or len(rows) > max_cells:
+                self.large.append(index)
+                continue
+            for cx in columns:
+                for cy in rows:
+                    self.cells.setdefault((cx, cy), []).append(index)
+
+    def _span(self, box: np.ndarray) -> Tuple[range, range]:
+        x, y, w, h = (int(v) for v in box)
+        size = self.cell_size
+        return range(x // size, (x + w - 1) // size + 1), range(y // size, (y + h - 1) // size + 1)
+
+    def candidates(self, box: np.ndarray) -> Set[int]:
+        found = set(self.large)
+        columns, rows = self._span(box)
+        if len(columns) * len(rows) > len(self.cells):
+            # A large query box: scan the occupied cells rather than every cell it covers
+            cells = [cell for cell in self.cells if cell[0] in columns and cell[1] in rows]
+        else:
+            cells = [(cx, cy) for cx in columns for cy in rows]
+        for cell in cells:
+            found.update(self.cells.get(cell, ()))
+        return found
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """
+    Intersection over union of one x, y, w, h box with each of `boxes`.
+    """
+    x0 = np.maximum(box[0], boxes[:, 0])
+    y0 = np.maximum(box[1], boxes[:, 1])
+    x1 = np.minimum(box[0] + box[2], boxes[:, 0] + boxes[:, 2])
+    y1 = np.minimum(box[1] + box[3], boxes[:, 1] + boxes[:, 3])
+    intersection = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    union = box[2] * box[3] + boxes[:, 2] * boxes[:, 3] - intersection
+    return intersection / np.maximum(union, 1)
+
+def match_boxes(previous: np.ndarray, current: np.ndarray, min_iou: float = 0.5) -> np.ndarray:
+    """
+    Match current boxes to previous ones, one to one, greedily by decreasing IoU.
+
+    Parameters:
+    - previous, current: (n, 4) x, y, w, h boxes
+    - min_iou: Smallest IoU of a match
+
+    Returns:
+    - Index of the matched previous box for each current box, -1 when unmatched
+    """
+    matches = np.full(len(current), -1, dtype=np.int64)
+    if len(previous) == 0 or len(current) == 0:
+        return matches
+
+    # Cells about the size of a typical object keep the candidate lists short
+    index = GridIndex(previous, np.median(previous[:, 2:].max(axis=1)))
+    pairs = []
+    for i, box in enumerate(current):
+        candidates = np.fromiter(index.candidates(box), dtype=np.int64)
+        if len(candidates) == 0:
+            continue
+        iou = box_iou(box, previous[candidates])
+        for j, value in zip(candidates[iou >= min_iou], iou[iou >= min_iou]):
+            pairs.append((value, i, j))
+
+    taken = set()
+    for _, i, j in sorted(pairs, key=lambda pair: -pair[0]):
+        if matches[i] == -1 and j not in taken:
+            matches[i] = j
+            taken.add(j)
+    return matches
+
+class ObjectTracker:
+    """
+    Carries object IDs from frame to frame and tells which objects kept the same outline.
+
+    Matched objects keep their ID. An object is unchanged when its contour, moved to its
+    bounding box origin, equals the matched previous one within `tolerance` pixels.
+    """
+
+    def __init__(self, min_iou: float = 0.5, tolerance: int = 0):
+        self.min_iou = min_iou
+        self.tolerance = tolerance
+        self.next_id = 0
+        self._boxes = np.zeros((0, 4), dtype=np.int64)
+        self._shapes: List[np.ndarray] = []
+        self._ids = np.zeros(0, dtype=np.int64)
+
+    def reset(self):
+        self.__init__(self.min_iou, self.tolerance)
+
+    def _same_shape(self, shape: np.ndarray, previous: np.ndarray) -> bool:
+        if shape.shape != previous.shape:
+            return False
+        if self.tolerance == 0:
+            return np.array_equal(shape, previous)
+        return int(np.abs(shape - previous).max(initial=0)) <= self.tolerance
+
+    def update(self, contours: Union[List[np.ndarray], ContourSet], boxes: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Match the contours of a new frame against the previous frame and remember them.
+
+        Returns:
+        - (object ID per contour, matched previous index or -1, unchanged flag per contour)
+        """
+        if boxes is None:
+            boxes = contour_boxes(contours)
+        if isinstance(contours, ContourSet):
+            # Moved to the box origins in one pass, shapes are views of the result
+            shapes = list(ContourSet(contours.points - np.repeat(boxes[:, :2], contours.counts, axis=0), contours.offsets))
+        else:
+            shapes = [contour.reshape(-1, 2) - box[:2] for contour, box in zip(contours, boxes)]
+        matches = match_boxes(self._boxes, boxes, self.min_iou)
+
+        ids = np.empty(len(contours), dtype=np.int64)
+        unchanged = np.zeros(len(contours), dtype=bool)
+        for i, match in enumerate(matches):
+            if match >= 0:
+                ids[i] = self._ids[match]
+                unchanged[i] = self._same_shape(shapes[i], self._shapes[match])
+            else:
+                ids[i] = self.next_id
+                self.next_id += 1
+
+        self._boxes, self._shapes, self._ids = boxes, shapes, ids
+        return ids, matches, unchanged
@@ -0,0 +1,4 @@
+from . import core
+from .core import warm_up
+from .core import WARMUP
+from .core import PRELOAD_SEGMENTER
@@ -0,0 +1,64 @@
+import os
+import cv2
+import numpy as np
+from time import perf_counter
+from common_utils.metrics.core import HISTOGRAMS
+from pipeline.main import analyze_segments, render_object, resolve_outputs
+from pipeline.tasks.annotation import annotate_image
+from pipeline.tasks.feature_extraction import extract_shape_features_batch
+from pipeline.tasks.segmentation import get_segmenter
+
+# Run the warm-up when the API app is created
+WARMUP = os.getenv("CONTOUR_IQ_WARMUP", "1") != "0"
+
+# Load the default segmenter when the API app is created instead of on the first
+# /analyze_image request (see get_segmenter)
+PRELOAD_SEGMENTER = os.getenv("CONTOUR_IQ_PRELOAD_SEGMENTER", "0") != "0"
+
+def warmup_segments(image_shape: tuple = (256, 256)) -> list:
+    """
+    A few polygons covering the shapes the rules tell apart: round, elongated, concave.
+    """
+    height, width = image_shape[:2]
+    return [
+        cv2.ellipse2Poly((width // 4, height // 4), (30, 30), 0, 0, 360, 10).tolist(),
+        cv2.ellipse2Poly((3 * width // 4, height // 4), (50, 8), 30, 0, 360, 10).tolist(),
+        [[20, 150], [120, 150], [120, 240], [90, 240], [90, 180], [50, 180], [50, 240], [20, 240]],
+        [[150, 150], [240, 160], [200, 240]],
+    ]
+
+def warm_up(segmenter: bool = False) -> float:
+    """
+    Run every stage of the pipeline once on a small synthetic image, so the first request does
+    not pay for lazy imports, OpenCV and scikit-image initialization or first-call overheads.
+
+    The feature cache and process pool are bypassed and the stage histograms are reset
+    afterwards: warm-up runs before any request and leaves no trace in the metrics.
+
+    Parameters:
+    - segmenter: If True, also load the default segmenter and run it once
+
+    Returns:
+    - Seconds spent
+    """
+    start = perf_counter()
+    image = np.zeros((256, 256, 3), dtype=np.uint8)
+    segments = warmup_segments(image.shape)
+    for i, polygon in enumerate(segments):
+        cv2.fillPoly(image, [np.asarray(polygon, dtype=np.int32)], (60 * (i + 1),) * 3)
+
+    extract = lambda contours, mask_shape, features, max_workers: extract_shape_features_batch(
+        contours, mask_shape=mask_shape, features=features
+    )
+    contours, results, attributes = analyze_segments(
+        image, segments, resolve_outputs(), roi=True, max_workers=1, extract=extract
+    )
+    annotate_image(image, contours, attributes)
+    render_object(image, contours[0], results[0])
+
+    if segmenter:
+        get_segmenter()(image)
+
+    for histogram in HISTOGRAMS.values():
+        histogram.clear()
+    return perf_counter() - start
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+import os
+import cv2
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from unittest import mock
+from django.test import SimpleTestCase, TransactionTestCase
 
-# Create your tests here.
+from pipeline.tasks.preprocessing import preprocess_segmentation, iter_preprocess_segmentation, is_label_map, padded_roi
+from pipeline.tasks.contour_extraction import extract_all_contours
+from pipeline.tasks.feature_extraction import extract_shape_features, extract_shape_features_batch, feature_table_to_records
+from pipeline.tasks.analysis import analyze_contour, analyze_contours_batch, attribute_table_to_records
+from pipeline.tasks.feature_pool import FeatureProcessPool
+from pipeline.tasks.feature_cache import FeatureCache
+from pipeline.main import ContourSession, iter_contour_pipeline, resolve_outputs, run_contour_pipeline, run_contour_pipeline_batch, RENDER_PADDING, PANEL_WIDTH
+from pipeline.tasks.tracking import match_boxes
+from pipeline.tasks import feature_export
+from common_utils.contour_set import ContourSet
+from pipeline.tasks.annotation import annotate_image
+from common_utils.metrics.core import HISTOGRAMS, STAGE, render_metrics
+
+
+def random_polygons(image_shape, count, seed=0):
+    """Random star-shaped polygons, some of them crossing the frame border."""
+    rng = np.random.default_rng(seed)
+    height, width = image_shape[:2]
+    polygons = []
+    for _ in range(count):
+        cx, cy = rng.uniform(-20, width + 20), rng.uniform(-20, height + 20)
+        n = int(rng.integers(3, 24))
+        angles = np.sort(rng.uniform(0, 2 * np.pi, n))
+        radii = rng.uniform(5, 120, n)
+        pts = np.stack([cx + radii * np.cos(angles), cy + radii * np.sin(angles)], axis=1)
+        polygons.append([tuple(p) for p in pts.astype(int).tolist()])
+    return polygons
+
+
+class RoiPreprocessingTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def assert_same_contours(self, segments, apply_morphology):
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        full = extract_all_contours(preprocess_segmentation(image, segments, apply_morphology=apply_morphology))
+        local = extract_all_contours(preprocess_segmentation(image, segments, apply_morphology=apply_morphology, roi=True))
+
+        self.assertEqual(len(full), len(local))
+        for full_contours, local_contours in zip(full, local):
+            self.assertEqual(len(full_contours), len(local_contours))
+            for a, b in zip(full_contours, local_contours):
+                np.testing.assert_array_equal(a, b)
+                self.assertEqual(
+                    extract_shape_features(a, mask_shape=self.image_shape[:2]),
+                    extract_shape_features(b, mask_shape=self.image_shape[:2]),
+                )
+
+    def test_polygons_match_full_frame(self):
+        polygons = random_polygons(self.image_shape, 40)
+        self.assert_same_contours(polygons, apply_morphology=False)
+        self.assert_same_contours(polygons, apply_morphology=True)
+
+    def test_masks_match_full_frame(self):
+        masks = []
+        for polygon in random_polygons(self.image_shape, 20, seed=1):
+            mask = np.zeros(self.image_shape[:2], dtype=np.uint8)
+            cv2.fillPoly(mask, [np.array(polygon, dtype=np.int32)], color=1)
+            masks.append(mask)
+        masks.append(np.zeros(self.image_shape[:2], dtype=np.uint8))
+        self.assert_same_contours(masks, apply_morphology=False)
+        self.assert_same_contours(masks, apply_morphology=True)
+
+
+def legacy_skeleton_length(contour, mask_shape):
+    """skeleton_length as computed before the crop-based version: full frame at a fixed 0.15 scale."""
+    from skimage.morphology import skeletonize
+
+    mask = np.zeros(mask_shape, dtype=np.uint8)
+    cv2.drawContours(mask, [contour], -1, 1, thickness=cv2.FILLED)
+    scale = 0.15
+    small_mask = cv2.resize(mask, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    return int(np.count_nonzero(skeletonize(small_mask)) / scale)
+
+
+def elongated_contours(mask_shape, count, seed=0):
+    """Rotated bars and thick polylines, the shapes the skeleton_length rules target."""
+    rng = np.random.default_rng(seed)
+    contours = []
+    for i in range(count):
+        mask = np.zeros(mask_shape, dtype=np.uint8)
+        cx, cy = float(rng.integers(400, mask_shape[1] - 400)), float(rng.integers(400, mask_shape[0] - 400))
+        if i % 2:
+            size = (float(rng.integers(200, 1200)), float(rng.integers(15, 60)))
+            box = cv2.boxPoints(((cx, cy), size, float(rng.uniform(0, 180))))
+            cv2.fillPoly(mask, [box.astype(np.int32)], 1)
+        else:
+            pts = np.cumsum(rng.normal(0, 120, (5, 2)), axis=0) + (cx, cy)
+            cv2.polylines(mask, [pts.astype(np.int32)], False, 1, int(rng.integers(12, 40)))
+        found, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours.append(max(found, key=cv2.contourArea))
+    return contours
+
+
+class SkeletonLengthRegressionTest(SimpleTestCase):
+    mask_shape = (2048, 2448)
+    # Crop-based lengths of elongated objects stay within 20% of the legacy values,
+    # and within 5% on median.
+    tolerance = 0.20
+    median_tolerance = 0.05
+
+    def test_crop_based_skeleton_matches_legacy(self):
+        relative_errors = []
+        for contour in elongated_contours(self.mask_shape, 30):
+            legacy = legacy_skeleton_length(contour, self.mask_shape)
+            current = extract_shape_features(contour, mask_shape=self.mask_shape)["skeleton_length"]
+            if legacy < 300:
+                continue
+            relative_errors.append(abs(current - legacy) / legacy)
+
+        self.assertGreater(len(relative_errors), 10)
+        self.assertLessEqual(max(relative_errors), self.tolerance)
+        self.assertLessEqual(float(np.median(relative_errors)), self.median_tolerance)
+
+    def test_fractured_threshold_matches_legacy(self):
+        from pipeline.tasks.analysis import DEFAULT_THRESHOLDS
+
+        threshold = DEFAULT_THRESHOLDS["fractured_skeleton_length"]
+        relative_errors = []
+        # Bars just below and above the threshold, inside the frame and cut by its left or top border.
+        # 45 degrees is left out: the legacy 0.15 nearest-neighbour downscale breaks thin diagonal bars apart.
+        for length in range(170, 250, 10):
+            for angle in (0, 15, 30, 75, 90):
+                for width in (20, 40):
+                    for border in (False, True):
+                        center = (1200.0, 1000.0)
+                        if border:
+                            center = (length / 2 - 20, 1000.0) if angle < 45 else (1200.0, length / 2 - 20)
+                        mask = np.zeros(self.mask_shape, dtype=np.uint8)
+                        cv2.fillPoly(mask, [cv2.boxPoints((center, (length, width), angle)).astype(np.int32)], 1)
+                        found, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                        contour = max(found, key=cv2.contourArea)
+                        if border:
+                            self.assertEqual(min(contour.reshape(-1, 2).min(axis=0)), 0)
+
+                        legacy = legacy_skeleton_length(contour, self.mask_shape)
+                        current = extract_shape_features(contour, mask_shape=self.mask_shape)["skeleton_length"]
+                        relative_errors.append(abs(current - legacy) / legacy)
+                        # Objects clearly on one side of the threshold stay there
+                        if abs(legacy - threshold) > 0.1 * threshold:
+                            self.assertEqual(current > threshold, legacy > threshold, (length, angle, width, border, legacy, current))
+
+        self.assertLessEqual(float(np.median(relative_errors)), self.median_tolerance)
+
+
+class BatchFeatureExtractionTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def test_batch_matches_per_contour_features(self):
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        masks = preprocess_segmentation(image, random_polygons(self.image_shape, 200, seed=2), roi=True)
+        contours = [c for found in extract_all_contours(masks) for c in found]
+        # Degenerate contours: single point, segment, triangle. Collinear contours are left out,
+        # cv2.fitEllipse perturbs them randomly.
+        contours += [
+            np.array([[[5, 5]]], dtype=np.int32),
+            np.array([[[5, 5]], [[9, 5]]], dtype=np.int32),
+            np.array([[[5, 5]], [[9, 5]], [[9, 9]]], dtype=np.int32),
+        ]
+
+        expected = [extract_shape_features(c, mask_shape=self.image_shape[:2]) for c in contours]
+        table = extract_shape_features_batch(contours, mask_shape=self.image_shape[:2])
+        self.assertEqual(len(table["area"]), len(contours))
+
+        for contour, reference, record in zip(contours, expected, feature_table_to_records(table)):
+            self.assertEqual(list(reference), list(record))
+            if len(contour) == 5:
+                # Both paths call cv2.fitEllipse here, which is not deterministic for 5 points
+                reference.pop("eccentricity")
+            for name, value in reference.items():
+                self.assertAlmostEqual(value, record[name], delta=1e-6 * max(1.0, abs(value)), msg=name)
+
+    def test_empty_batch(self):
+        table = extract_shape_features_batch([], mask_shape=self.image_shape[:2])
+        self.assertEqual(feature_table_to_records(table), [])
+
+
+def legacy_analyze_contour(f):
+    """The hard-coded heuristics the declarative rule set replaced (missing features count as 0)."""
+    g = lambda name, default=0: f.get(name, default)
+    long = g("eccentricity") > 0.8 and (g("aspect_ratio") > 3 or g("skeleton_length") > 300) and g("circularity") < 0.65
+    return {
+        "manmade": (
+            (g("solidity") > 0.85 and g("num_corners") in [3, 4, 6, 8, 10, 12])
+            or (g("eccentricity") > 0.8 and g("skeleton_length") > 300)
+            or (g("solidity") > 0.75 and g("area") > 5000 and g("skeleton_length") > 300 and g("num_corners") >= 4)
+        ),
+        "fractured": g("num_defects") > 5 or g("num_corners") > 10 or g("skeleton_length") > 200 or g("eccentricity") > 0.95,
+        "long": long,
+        "round": g("circularity") > 0.65 and g("eccentricity") < 0.6 and g("solidity") > 0.9,
+        "compact": g("solidity") > 0.95 and g("extent") > 0.8 and g("num_corners") in [4, 6],
+        "long_skeleton": g("skeleton_length") > 300 and g("area") / max(g("skeleton_length", 1), 1) < 3,
+        "rigid": (
+            (g("solidity") > 0.85 and g("extent") > 0.8 and g("num_defects") <= 6)
+            or (g("eccentricity") > 0.8 and long and g("skeleton_length") > 300)
+            or (g("solidity") > 0.75 and g("area") > 5000 and g("skeleton_length") > 300 and g("extent") > 0.5 and g("num_defects") <= 12)
+        ),
+    }
+
+
+class RuleEngineTest(SimpleTestCase):
+    def random_features(self, count, seed=0):
+        rng = np.random.default_rng(seed)
+        records = []
+        for _ in range(count):
+            features = {
+                "area": float(rng.uniform(0, 20000)),
+                "aspect_ratio": float(rng.uniform(0, 6)),
+                "extent": float(rng.uniform(0.3, 1)),
+                "solidity": float(rng.uniform(0.6, 1)),
+                "circularity": float(rng.uniform(0, 1)),
+                "eccentricity": float(rng.uniform(0, 1)),
+                "num_corners": int(rng.integers(2, 14)),
+                "num_defects": int(rng.integers(0, 15)),
+                "skeleton_length": int(rng.integers(0, 4000)),
+            }
+            # Drop some features, as extract_shape_features does for small contours
+            for name in ("eccentricity", "num_defects", "skeleton_length"):
+                if rng.random() < 0.1:
+                    features.pop(name)
+            records.append(features)
+        return records
+
+    def test_rules_match_legacy_heuristics(self):
+        records = self.random_features(2000)
+        for features in records:
+            self.assertEqual(analyze_contour(features), legacy_analyze_contour(features))
+
+        names = {name for features in records for name in features}
+        table = {name: np.array([f.get(name, np.nan) for f in records]) for name in names}
+        self.assertEqual(
+            attribute_table_to_records(analyze_contours_batch(table)),
+            [legacy_analyze_contour(features) for features in records],
+        )
+
+    def test_threshold_overrides(self):
+        features = {"circularity": 0.7, "eccentricity": 0.5, "solidity": 0.95}
+        self.assertTrue(analyze_contour(features)["round"])
+        self.assertFalse(analyze_contour(features, thresholds={"round_circularity": 0.75})["round"])
+        with self.assertRaises(ValueError):
+            analyze_contour(features, thresholds={"not_a_threshold": 1})
+
+
+class FeatureProcessPoolTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def test_pool_matches_in_process_order(self):
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        masks = preprocess_segmentation(image, random_polygons(self.image_shape, 300, seed=3), roi=True)
+        contours = [c for found in extract_all_contours(masks) for c in found]
+
+        pool = FeatureProcessPool(max_workers=2)
+        try:
+            parallel = pool.extract(contours, mask_shape=self.image_shape[:2])
+        finally:
+            pool.shutdown()
+        expected = extract_shape_features_batch(contours, mask_shape=self.image_shape[:2])
+
+        self.assertEqual(list(parallel), list(expected))
+        for name in expected:
+            np.testing.assert_allclose(parallel[name], expected[name], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+class FeatureSelectionTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def contours(self):
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        masks = preprocess_segmentation(image, random_polygons(self.image_shape, 60, seed=4), roi=True)
+        return [c for found in extract_all_contours(masks) for c in found]
+
+    def test_selected_features_match_full_extraction(self):
+        contours = self.contours()
+        full = extract_shape_features_batch(contours, mask_shape=self.image_shape[:2])
+        selected = extract_shape_features_batch(contours, mask_shape=self.image_shape[:2], features=["circularity", "hu_moment_2"])
+
+        self.assertEqual(
+            set(selected) - {"bbox_x", "bbox_y", "bbox_w", "bbox_h"},
+            {"area", "perimeter", "circularity", "hu_moment_2"},
+        )
+        for name in selected:
+            np.testing.assert_array_equal(selected[name], full[name], err_msg=name)
+
+        for contour in contours[:10]:
+            reference = extract_shape_features(contour, mask_shape=self.image_shape[:2])
+            record = extract_shape_features(contour, mask_shape=self.image_shape[:2], features=["solidity", "num_corners"])
+            self.assertEqual(record, {name: reference[name] for name in ("area", "perimeter", "solidity", "num_corners")})
+
+    def test_skeleton_skipped_when_not_required(self):
+        features, attributes, required = resolve_outputs(["area", "round"])
+        self.assertEqual((features, attributes), (["area"], ["round"]))
+        self.assertNotIn("skeleton_length", required)
+        self.assertIn("skeleton_length", resolve_outputs(["rigid"])[2])
+
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        polygons = random_polygons(self.image_shape, 20, seed=5)
+        reference = run_contour_pipeline(image, polygons)
+        with mock.patch(
+            "pipeline.tasks.feature_extraction.core.contour_skeleton_length",
+            side_effect=AssertionError("skeleton_length computed"),
+        ):
+            output = run_contour_pipeline(image, polygons, features=["area", "round"])
+
+        self.assertEqual(
+            output["results"],
+            [{"area": r["area"], "round": r["round"]} for r in reference["results"]],
+        )
+        self.assertEqual(output["attributes"], [{"round": r["round"]} for r in reference["attributes"]])
+
+    def test_unknown_output(self):
+        with self.assertRaises(ValueError):
+            resolve_outputs(["area", "not_a_feature"])
+
+
+class LazyRenderingTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def test_images_rendered_on_first_access(self):
+        image = np.random.default_rng(6).integers(0, 255, self.image_shape, dtype=np.uint8)
+        polygons = random_polygons(self.image_shape, 20, seed=6)
+
+        with mock.patch("pipeline.main.annotate_image", wraps=annotate_image) as annotate, \
+                mock.patch("pipeline.main.render_individual_features", return_value=[]) as render:
+            output = run_contour_pipeline(image, polygons, render_individual=True)
+            self.assertEqual(len(output["results"]), len(output["contours"]))
+            annotate.assert_not_called()
+            render.assert_not_called()
+
+            annotated = output["annotated_image"]
+            self.assertIs(output["annotated_image"], annotated)
+            annotate.assert_called_once()
+            render.assert_not_called()
+
+        np.testing.assert_array_equal(annotated, annotate_image(image, output["contours"], output["attributes"]))
+        self.assertEqual(
+            set(output),
+            {"contours", "annotated_image", "results", "attributes", "object_images", "timings"},
+        )
+        self.assertEqual(run_contour_pipeline(image, polygons)["object_images"], [])
+
+    def test_output_accepts_assignments(self):
+        polygons = random_polygons(self.image_shape, 5, seed=8)
+        with mock.patch("pipeline.main.annotate_image") as annotate:
+            output = run_contour_pipeline(np.zeros(self.image_shape, dtype=np.uint8), polygons)
+            output["annotated_image"] = None
+            output["camera"] = "north"
+            del output["timings"]
+            self.assertIsNone(output["annotated_image"])
+            annotate.assert_not_called()
+        self.assertEqual(list(output), ["contours", "results", "attributes", "annotated_image", "object_images", "camera"])
+        self.assertEqual(output["contours"][0].reshape(-1, 1, 2).shape[1:], (1, 2))
+
+    def test_object_images_are_padded_crops(self):
+        image = np.random.default_rng(7).integers(0, 255, self.image_shape, dtype=np.uint8)
+        polygons = random_polygons(self.image_shape, 10, seed=7)
+        output = run_contour_pipeline(image, polygons, render_individual=True)
+
+        objects = output["object_images"]
+        self.assertEqual(len(objects), len(output["contours"]))
+        for contour, features, rendered in zip(output["contours"], output["results"], objects):
+            x0, y0, x1, y1 = padded_roi(*cv2.boundingRect(contour), image.shape, RENDER_PADDING)
+            self.assertEqual(rendered.shape[1], x1 - x0 + PANEL_WIDTH)
+            self.assertLess(rendered.size, image.size + rendered.shape[0] * PANEL_WIDTH * 3)
+
+            # The crop holds the same pixels as a full-frame render at the object's position
+            full = image.copy()
+            cv2.drawContours(full, [contour], -1, (255, 255, 255), 2)
+            np.testing.assert_array_equal(rendered[:y1 - y0, :x1 - x0], full[y0:y1, x0:x1])
+
+        # Nothing is kept between reads
+        self.assertIsNot(objects[0], objects[0])
+        np.testing.assert_array_equal(objects[-1], objects[len(objects) - 1])
+
+
+class StageTimingTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def test_concurrent_runs_keep_their_own_timings(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        jobs = [random_polygons(self.image_shape, count, seed=7) for count in (5, 80, 5, 80)]
+        HISTOGRAMS[STAGE].clear()
+        # Cache hits would skip the feature timers
+        with ThreadPoolExecutor(max_workers=4) as executor, \
+                mock.patch("pipeline.main.get_feature_cache", return_value=FeatureCache(max_entries=0, path="")):
+            outputs = list(executor.map(lambda polygons: run_contour_pipeline(image, polygons), jobs))
+
+        for output in outputs:
+            stages = output["timings"]["stage"]
+            self.assertEqual(set(stages), {"run_pipeline", "preprocessing", "extract_contour", "extract_feature", "analysis"})
+            self.assertLessEqual(sum(v for k, v in stages.items() if k != "run_pipeline"), stages["run_pipeline"])
+            self.assertIn("batch_moments", output["timings"]["feature"])
+
+        outputs[0]["annotated_image"]
+        self.assertIn("annotation", outputs[0]["timings"]["stage"])
+
+        text = render_metrics()
+        self.assertIn('contour_iq_stage_seconds_count{stage="run_pipeline"} 4', text)
+        self.assertIn('contour_iq_stage_seconds_bucket{stage="analysis",le="+Inf"} 4', text)
+        self.assertIn("# TYPE contour_iq_feature_seconds histogram", text)
+
+
+class BenchmarkSmokeTest(SimpleTestCase):
+    def test_stage_benchmark_runs(self):
+        from benchmarks.synthetic import synthetic_polygons
+        from benchmarks.pipeline_stages import run_benchmarks
+        from benchmarks.compare import compare
+
+        self.assertEqual(synthetic_polygons((480, 640), 5, seed=1), synthetic_polygons((480, 640), 5, seed=1))
+
+        results = run_benchmarks([(120, 160)], [5], ["blob", "fragment"], ["polygons", "masks"], repeat=1, max_mask_bytes=120 * 160 * 4)
+        self.assertEqual(len(results["workloads"]), 4)
+        self.assertIn("skipped", results["workloads"][1])
+        stages = results["workloads"][0]["stages"]
+        self.assertIn("run_contour_pipeline", stages)
+        self.assertEqual(set(stages["annotate_image"]), {"min", "median"})
+        self.assertTrue(all(row["ratio"] == 1 for row in compare(results, results, min_seconds=0)))
+
+
+class ChunkedPipelineTest(SimpleTestCase):
+    image_shape = (480, 640, 3)
+
+    def test_chunks_match_single_run(self):
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        polygons = random_polygons(self.image_shape, 50, seed=8)
+        expected = run_contour_pipeline(image, polygons)
+
+        for segments in (polygons, ContourSet.from_polygons(polygons)):
+            chunks = list(iter_contour_pipeline(image, segments, chunk_size=16))
+            self.assertGreater(len(chunks), 1)
+            objects = [obj for chunk in chunks for obj in chunk]
+            self.assertEqual([obj["results"] for obj in objects], expected["results"])
+            self.assertEqual([obj["attributes"] for obj in objects], expected["attributes"])
+            for obj, contour in zip(objects, expected["contours"]):
+                np.testing.assert_array_equal(obj["contour"], contour)
+
+    def test_invalid_options_fail_before_streaming(self):
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        with self.assertRaises(ValueError):
+            iter_contour_pipeline(image, [], features=["not_a_feature"])
+        with self.assertRaises(ValueError):
+            iter_contour_pipeline(image, [], thresholds={"not_a_threshold": 1})
+
+
+class BatchPipelineTest(SimpleTestCase):
+    def test_batch_matches_single_runs(self):
+        frames = [
+            {"image_shape": (480, 640, 3), "segments": random_polygons((480, 640), 30, seed=9)},
+            {"image_shape": (480, 640, 3), "segments": random_polygons((480, 640), 10, seed=10), "thresholds": {"round_circularity": 0.75}},
+            {"image_shape": (240, 320, 3), "segments": random_polygons((240, 320), 10, seed=11), "features": ["area", "round"]},
+            {"image_shape": (480, 640, 3), "segments": [], "features": ["not_a_feature"]},
+            {"image_shape": (480, 640, 3), "segments": []},
+        ]
+        outputs = run_contour_pipeline_batch(frames)
+
+        self.assertEqual(len(outputs), len(frames))
+        self.assertIn("not_a_feature", outputs[3]["error"])
+        self.assertEqual(outputs[4]["results"], [])
+        for frame, output in zip(frames[:3], outputs):
+            expected = run_contour_pipeline(
+                np.zeros(frame["image_shape"], dtype=np.uint8), frame["segments"],
+                thresholds=frame.get("thresholds"), features=frame.get("features"),
+            )
+            self.assertEqual(output["results"], expected["results"])
+            self.assertEqual(output["attributes"], expected["attributes"])
+
+
+class FeatureCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.mask_shape = (480, 640)
+        masks = preprocess_segmentation(np.zeros((*self.mask_shape, 3), dtype=np.uint8), random_polygons(self.mask_shape, 40, seed=12))
+        self.contours = [contour for found in extract_all_contours(masks) for contour in found]
+
+    def assertTablesEqual(self, table, expected):
+        self.assertEqual(set(table), set(expected))
+        for name in expected:
+            np.testing.assert_allclose(table[name], expected[name], equal_nan=True, err_msg=name)
+
+    def test_hits_return_computed_features(self):
+        cache = FeatureCache(max_entries=1000, path="")
+        expected = extract_shape_features_batch(self.contours, mask_shape=self.mask_shape)
+        self.assertTablesEqual(cache.extract(self.contours, mask_shape=self.mask_shape), expected)
+
+        compute = mock.Mock(side_effect=extract_shape_features_batch)
+        self.assertTablesEqual(cache.extract(self.contours, mask_shape=self.mask_shape, compute=compute), expected)
+        compute.assert_not_called()
+        stats = cache.stats()
+        self.assertEqual((stats["hit"], stats["miss"]), (len(self.contours), len(self.contours)))
+
+    def test_missing_features_are_computed_for_cached_contours(self):
+        cache = FeatureCache(max_entries=1000, path="")
+        cache.extract(self.contours, features=["area"])
+        table = cache.extract(self.contours, mask_shape=self.mask_shape, features=["circularity", "skeleton_length"])
+        expected = extract_shape_features_batch(self.contours, mask_shape=self.mask_shape, features=["circularity", "skeleton_length"])
+        self.assertTablesEqual(table, expected)
+
+    def test_lru_eviction(self):
+        cache = FeatureCache(max_entries=10, path="")
+        cache.extract(self.contours[:10], features=["area"])
+        cache.extract(self.contours[:1], features=["area"])
+        cache.extract(self.contours[10:15], features=["area"])
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["eviction"]), (10, 5))
+
+        compute = mock.Mock(side_effect=extract_shape_features_batch)
+        cache.extract(self.contours[:1], features=["area"], compute=compute)
+        compute.assert_not_called()
+
+    def test_disk_tier_survives_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "features.sqlite")
+            expected = FeatureCache(max_entries=0, path=path).extract(self.contours, mask_shape=self.mask_shape)
+
+            cache = FeatureCache(max_entries=1000, path=path)
+            compute = mock.Mock(side_effect=extract_shape_features_batch)
+            self.assertTablesEqual(cache.extract(self.contours, mask_shape=self.mask_shape, compute=compute), expected)
+            compute.assert_not_called()
+            self.assertEqual(cache.stats()["disk_hit"], len(self.contours))
+
+    def test_reclassification_reuses_features(self):
+        image = np.zeros((*self.mask_shape, 3), dtype=np.uint8)
+        polygons = random_polygons(self.mask_shape, 20, seed=13)
+        cache = FeatureCache(max_entries=1000, path="")
+        with mock.patch("pipeline.main.get_feature_cache", return_value=cache):
+            first = run_contour_pipeline(image, polygons)
+            second = run_contour_pipeline(image, polygons, thresholds={"round_circularity": 0.9})
+
+        self.assertEqual(cache.stats()["hit"], len(first["contours"]))
+        self.assertNotIn("batch_moments", second["timings"]["feature"])
+        expected = run_contour_pipeline(image, polygons, thresholds={"round_circularity": 0.9})
+        self.assertEqual(second["results"], expected["results"])
+
+
+class ContourSessionTest(SimpleTestCase):
+    def setUp(self):
+        self.image = np.zeros((480, 640, 3), dtype=np.uint8)
+        # Objects inside the frame, so moving them does not clip their outline
+        self.polygons = [
+            polygon for polygon in random_polygons((480, 640), 40, seed=14)
+            if all(5 <= x < 630 and 5 <= y < 470 for x, y in polygon)
+        ]
+
+    def moved(self, dx, dy):
+        return [[(x + dx, y + dy) for x, y in polygon] for polygon in self.polygons]
+
+    def test_match_boxes_one_to_one(self):
+        previous = np.array([[0, 0, 10, 10], [100, 100, 20, 20], [300, 0, 5, 5]])
+        current = np.array([[101, 102, 20, 20], [1, 0, 10, 10], [1, 1, 10, 10], [400, 400, 5, 5]])
+        self.assertEqual(match_boxes(previous, current, min_iou=0.5).tolist(), [1, 0, -1, -1])
+
+    def test_large_boxes_stay_out_of_the_grid(self):
+        from pipeline.tasks.tracking.core import GridIndex
+
+        boxes = np.array([[0, 0, 10, 10], [50, 50, 10, 10], [0, 0, 10000, 10000], [5, 5, 30, 30]])
+        index = GridIndex(boxes, 10)
+        self.assertEqual(index.large, [2])
+        self.assertEqual(sum(len(entries) for entries in index.cells.values()), 1 + 1 + 4 * 4)
+        self.assertEqual(index.candidates(np.array([52, 52, 3, 3])), {1, 2})
+        self.assertEqual(index.candidates(np.array([0, 0, 5000, 5000])), {0, 1, 2, 3})
+
+        # Frame-sized objects are still matched
+        current = boxes + np.array([2, 1, 0, 0])
+        self.assertEqual(match_boxes(boxes, current).tolist(), [0, 1, 2, 3])
+
+    def test_translated_objects_reuse_features(self):
+        session = ContourSession()
+        first = session.process(self.image, self.moved(0, 0))
+        second = session.process(self.image, self.moved(3, 2))
+
+        self.assertEqual(second["ids"], first["ids"])
+        self.assertTrue(all(second["reused"]))
+        expected = run_contour_pipeline(self.image, self.moved(3, 2))
+        self.assertEqual(second["attributes"], expected["attributes"])
+        for result, reference in zip(second["results"], expected["results"]):
+            self.assertEqual(result.keys(), reference.keys())
+            for name, value in reference.items():
+                self.assertAlmostEqual(result[name], value, places=6, msg=name)
+
+    def test_new_and_changed_objects_are_measured(self):
+        session = ContourSession(features=["area", "round"])
+        first = session.process(self.image, self.polygons)
+        changed = [list(polygon) for polygon in self.polygons]
+        changed[0] = [(x * 2 - changed[0][0][0], y) for x, y in changed[0]]
+        second = session.process(self.image, changed + [[(600, 400), (630, 400), (630, 430)]])
+
+        expected = run_contour_pipeline(self.image, changed + [[(600, 400), (630, 400), (630, 430)]], features=["area", "round"])
+        self.assertEqual(second["results"], expected["results"])
+        self.assertFalse(second["reused"][-1])
+        self.assertNotIn(second["ids"][-1], first["ids"])
+        self.assertEqual(sum(second["reused"]), len(first["ids"]) - 1)
+
+
+class ContourSetStagesTest(SimpleTestCase):
+    def setUp(self):
+        masks = preprocess_segmentation(np.zeros((480, 640, 3), dtype=np.uint8), random_polygons((480, 640), 40, seed=15))
+        self.contours = [contour for found in extract_all_contours(masks) for contour in found]
+        self.contour_set = ContourSet.from_polygons(self.contours)
+
+    def test_bboxes_take_and_transforms(self):
+        self.assertEqual(self.contour_set.bboxes.tolist(), [list(cv2.boundingRect(c)) for c in self.contours])
+
+        taken = self.contour_set.take([3, 0, 3])
+        for contour, index in zip(taken, [3, 0, 3]):
+            np.testing.assert_array_equal(contour, self.contours[index].reshape(-1, 2))
+
+        moved = self.contour_set.translate(7, -2)
+        np.testing.assert_array_equal(moved.bboxes[:, :2], self.contour_set.bboxes[:, :2] + [7, -2])
+        joined = ContourSet.concatenate([self.contour_set[:5], moved[5:]])
+        self.assertEqual(len(joined), len(self.contours))
+        np.testing.assert_array_equal(joined[6], self.contours[6].reshape(-1, 2) + [7, -2])
+
+    def test_single_contour_features_accept_contour_set_entries(self):
+        from pipeline.tasks.feature_extraction import FEATURE_NAMES
+
+        for i, contour in enumerate(self.contours):
+            expected = extract_shape_features(contour, mask_shape=(480, 640), features=FEATURE_NAMES)
+            features = extract_shape_features(self.contour_set[i], mask_shape=(480, 640), features=FEATURE_NAMES)
+            self.assertEqual(list(features), list(expected))
+            if len(contour) == 5:
+                # cv2.fitEllipse is not deterministic for 5 points
+                expected.pop("eccentricity")
+            for name, value in expected.items():
+                self.assertAlmostEqual(features[name], value, msg=name)
+
+    def test_stages_accept_contour_sets(self):
+        expected = extract_shape_features_batch(self.contours, mask_shape=(480, 640))
+        table = extract_shape_features_batch(self.contour_set, mask_shape=(480, 640))
+        for name, column in expected.items():
+            np.testing.assert_allclose(table[name], column, equal_nan=True, err_msg=name)
+
+        attributes = [analyze_contour(record) for record in feature_table_to_records(expected)]
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        np.testing.assert_array_equal(
+            annotate_image(image, self.contour_set, attributes), annotate_image(image, self.contours, attributes)
+        )
+
+
+class LabelMapInputTest(SimpleTestCase):
+    def setUp(self):
+        self.image = np.zeros((480, 640, 3), dtype=np.uint8)
+        # Later polygons paint over earlier ones, as overlapping instances in a label map would
+        self.label_map = np.zeros((480, 640), dtype=np.int32)
+        for label, polygon in enumerate(random_polygons((480, 640), 30, seed=16), start=1):
+            cv2.fillPoly(self.label_map, [np.asarray(polygon, dtype=np.int32)], color=label)
+        labels = [label for label in range(1, 31) if (self.label_map == label).any()]
+        self.masks = [(self.label_map == label).astype(np.uint8) for label in labels]
+
+    def test_label_map_matches_per_object_masks(self):
+        expected = run_contour_pipeline(self.image, self.masks)
+        output = run_contour_pipeline(self.image, self.label_map)
+
+        self.assertEqual(len(output["contours"]), len(expected["contours"]))
+        for contour, reference in zip(output["contours"], expected["contours"]):
+            np.testing.assert_array_equal(contour, reference)
+        self.assertEqual(output["results"], expected["results"])
+
+        full_frame = preprocess_segmentation(self.image, self.label_map, roi=False)
+        for mask, reference in zip(full_frame, self.masks):
+            np.testing.assert_array_equal(mask, reference)
+
+    def test_label_map_streams_in_chunks(self):
+        expected = run_contour_pipeline(self.image, self.label_map)
+        chunks = list(iter_contour_pipeline(self.image, self.label_map, chunk_size=7))
+        self.assertEqual(len(chunks), -(-len(self.masks) // 7))
+        self.assertEqual([obj["results"] for chunk in chunks for obj in chunk], expected["results"])
+
+    def test_only_integer_maps_of_the_image_size_are_label_maps(self):
+        self.assertTrue(is_label_map(self.label_map, self.image.shape))
+        self.assertTrue(is_label_map(self.label_map.astype(np.uint16), self.image.shape[:2]))
+        self.assertFalse(is_label_map(self.label_map.astype(np.float32), self.image.shape))
+        self.assertFalse(is_label_map(self.label_map[:, :320], self.image.shape))
+        self.assertFalse(is_label_map(self.label_map.T, self.image.shape))
+        self.assertFalse(is_label_map(self.masks, self.image.shape))
+
+
+class StreamingPreprocessingTest(SimpleTestCase):
+    def test_segments_in_flight_are_bounded(self):
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        polygons = random_polygons((480, 640), 50, seed=17)
+        pulled = []
+
+        class Segments(list):
+            def __iter__(self):
+                for polygon in list.__iter__(self):
+                    pulled.append(polygon)
+                    yield polygon
+
+        masks = iter_preprocess_segmentation(image, Segments(polygons), max_workers=2, roi=True, window=3)
+        first = next(masks)
+        self.assertLessEqual(len(pulled), 3)
+        rest = list(masks)
+
+        expected = preprocess_segmentation(image, polygons, roi=True)
+        self.assertEqual(len(rest) + 1, len(expected))
+        for mask, reference in zip([first] + rest, expected):
+            np.testing.assert_array_equal(mask.mask, reference.mask)
+            self.assertEqual(mask.offset, reference.offset)
+
+    def test_generators_are_accepted(self):
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        polygons = random_polygons((480, 640), 20, seed=18)
+        masks = list(iter_preprocess_segmentation(image, (polygon for polygon in polygons), max_workers=2, roi=True))
+
+        expected = preprocess_segmentation(image, polygons, roi=True)
+        self.assertEqual(len(masks), len(expected))
+        for mask, reference in zip(masks, expected):
+            np.testing.assert_array_equal(mask.mask, reference.mask)
+
+
+class AnalyzeFolderCommandTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.directory.name, "images")
+        self.output_dir = os.path.join(self.directory.name, "out")
+        os.makedirs(self.input_dir)
+        for i in range(4):
+            image = np.zeros((240, 320, 3), dtype=np.uint8)
+            for polygon in random_polygons((240, 320), 3 + i, seed=20 + i):
+                cv2.fillPoly(image, [np.asarray(polygon, dtype=np.int32)], color=(255, 255, 255))
+            cv2.imwrite(os.path.join(self.input_dir, f"frame_{i}.jpg"), image)
+        with open(os.path.join(self.input_dir, "broken.jpg"), "wb") as f:
+            f.write(b"not an image")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_command(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("analyze_folder", self.input_dir, self.output_dir, "--model", "threshold", *args, stdout=out)
+        return out.getvalue()
+
+    def test_folder_is_processed_and_resumed(self):
+        import csv
+
+        summary = self.run_command("--debug", "--analysis-workers", "2", "--queue-size", "1")
+        self.assertIn("4 processed, 0 skipped, 1 failed", summary)
+        for i in range(4):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, f"frame_{i}.jpg")))
+            self.assertTrue(os.listdir(os.path.join(self.output_dir, f"frame_{i}")))
+
+        with open(os.path.join(self.output_dir, "features.csv")) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual({row["image"] for row in rows}, {f"frame_{i}.jpg" for i in range(4)})
+        self.assertTrue(all(row["area"] for row in rows))
+
+        # Finished images are skipped, the broken one is retried
+        self.assertIn("0 processed, 4 skipped, 1 failed", self.run_command())
+        with open(os.path.join(self.output_dir, "features.csv")) as f:
+            self.assertEqual(len(list(csv.DictReader(f))), len(rows))
+
+    def test_images_are_keyed_by_relative_path(self):
+        import csv
+
+        os.makedirs(os.path.join(self.input_dir, "north"))
+        shutil.copy(os.path.join(self.input_dir, "frame_1.jpg"), os.path.join(self.input_dir, "north", "frame_0.jpg"))
+        self.assertIn("5 processed, 0 skipped, 1 failed", self.run_command("--pattern", "**/*.jpg"))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "north", "frame_0.jpg")))
+        with open(os.path.join(self.output_dir, "features.csv")) as f:
+            images = {row["image"] for row in csv.DictReader(f)}
+        self.assertEqual(images, {*(f"frame_{i}.jpg" for i in range(4)), "north/frame_0.jpg"})
+        self.assertIn("0 processed, 5 skipped, 1 failed", self.run_command("--pattern", "**/*.jpg"))
+
+    def test_analysis_workers_share_the_preprocessing_pool(self):
+        import threading
+        from pipeline.tasks.folder_batch import core as folder_batch
+        from pipeline.tasks.preprocessing import core as preprocessing
+        from pipeline.tasks.segmentation import ThresholdSegmenter
+        from concurrent.futures import ThreadPoolExecutor
+
+        with mock.patch.object(preprocessing, "PREPROCESS_WORKERS", 2), mock.patch.object(preprocessing, "_executor", None), \
+                mock.patch.object(preprocessing, "ThreadPoolExecutor", wraps=ThreadPoolExecutor) as pools:
+            counts = folder_batch.process_folder(self.input_dir, self.output_dir, ThresholdSegmenter(), analysis_workers=4)
+            threads = [thread for thread in threading.enumerate() if thread.name.startswith("contour-iq-preprocess")]
+            preprocessing._executor.shutdown()
+        self.assertEqual(counts["processed"], 4)
+        pools.assert_called_once()
+        self.assertLessEqual(len(threads), 2)
+
+    def test_encoding_failures_are_reported(self):
+        from pipeline.tasks.folder_batch import core as folder_batch
+
+        with mock.patch.object(folder_batch.cv2, "imencode", return_value=(False, None)):
+            counts = folder_batch.process_folder(self.input_dir, self.output_dir, lambda image: [], write_workers=1)
+        self.assertEqual((counts["processed"], counts["failed"]), (0, 5))
+        self.assertEqual(folder_batch.read_checkpoint(self.output_dir), set())
+
+    def test_invalid_options(self):
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            self.run_command("--features", "not_a_feature")
+        with self.assertRaises(CommandError):
+            from django.core.management import call_command
+            call_command("analyze_folder", self.input_dir, self.output_dir, "--model", "no_such_model")
+
+
+class WarmupTest(SimpleTestCase):
+    def test_warm_up_leaves_no_metrics(self):
+        from pipeline.tasks.warmup import warm_up
+
+        self.assertGreater(warm_up(), 0)
+        self.assertNotIn("contour_iq_stage_seconds_count", render_metrics())
+
+    def test_default_segmenter_loaded_once(self):
+        from pipeline.tasks.segmentation import core as segmentation, ThresholdSegmenter
+
+        with mock.patch.object(segmentation, "DEFAULT_SEGMENTER", "threshold"), \
+                mock.patch.object(segmentation, "_segmenter", None), \
+                mock.patch.object(segmentation, "load_segmenter", wraps=segmentation.load_segmenter) as load:
+            segmenter = segmentation.get_segmenter()
+            self.assertIsInstance(segmenter, ThresholdSegmenter)
+            self.assertIs(segmentation.get_segmenter(), segmenter)
+            load.assert_called_once()
+
+
+class MicroBatchingTest(SimpleTestCase):
+    def images(self, count: int) -> list:
+        images = []
+        for i in range(count):
+            image = np.zeros((60, 80, 3), dtype=np.uint8)
+            image[5:5 + 5 * (i + 1), 10:20] = 255
+            images.append(image)
+        return images
+
+    def test_concurrent_calls_are_batched(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from common_utils.micro_batch.core import MicroBatcher
+        from pipeline.tasks.segmentation import StubSegmenter, ThresholdSegmenter, segment_batch
+
+        segmenter = StubSegmenter(call_seconds=0.05, image_seconds=0)
+        batcher = MicroBatcher(lambda images: segment_batch(segmenter, images), max_batch_size=4, max_wait=0.02)
+        images = self.images(8)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            labels = list(executor.map(batcher, images))
+
+        for image, label_map in zip(images, labels):
+            np.testing.assert_array_equal(label_map, ThresholdSegmenter()(image))
+        self.assertEqual(sum(segmenter.batch_sizes), 8)
+        self.assertLessEqual(max(segmenter.batch_sizes), 4)
+        self.assertLess(len(segmenter.batch_sizes), 8)
+
+    def test_errors_reach_every_caller_of_the_batch(self):
+        from concurrent.futures import wait
+        from common_utils.micro_batch.core import MicroBatcher
+
+        def fail(items):
+            raise RuntimeError("model failed")
+
+        batcher = MicroBatcher(fail, max_batch_size=3, max_wait=0.05)
+        futures = [batcher.submit(i) for i in range(3)]
+        wait(futures)
+        for future in futures:
+            self.assertIsInstance(future.exception(), RuntimeError)
+
+        batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_batch_size=2, max_wait=0)
+        self.assertEqual(batcher(21), 42)
+
+
+class ModelOutputConversionTest(SimpleTestCase):
+    image_shape = (400, 500, 3)
+
+    def mask_stack(self) -> np.ndarray:
+        masks = np.zeros((3, 40, 50), dtype=np.float32)
+        masks[0, 5:20, 10:30] = 1
+        cv2.ellipse(masks[1], (30, 28), (12, 6), 20, 0, 360, 1, -1)
+        masks[2, 2:4, 40:45] = 1
+        masks[2, 30:36, 2:6] = 1
+        return masks
+
+    def test_resized_masks_match_per_mask_resize(self):
+        from pipeline.tasks.segmentation import resize_mask_stack
+
+        masks = self.mask_stack()
+        resized = resize_mask_stack(masks, self.image_shape)
+        for mask, result in zip(masks, resized):
+            expected = cv2.resize(mask.astype(np.uint8) * 255, (500, 400), interpolation=cv2.INTER_NEAREST) > 127
+            np.testing.assert_array_equal(result, expected.astype(np.uint8))
+
+    def test_polygons_cover_the_resized_masks(self):
+        from pipeline.tasks.segmentation import mask_stack_to_polygons, resize_mask_stack
+
+        masks = self.mask_stack()
+        polygons = mask_stack_to_polygons(masks, self.image_shape)
+        self.assertIsInstance(polygons, ContourSet)
+        # One polygon per external outline: the last mask has two parts
+        self.assertEqual(len(polygons), 4)
+
+        # Axis-aligned boxes land exactly on the resized mask
+        full = resize_mask_stack(masks, self.image_shape)[0]
+        self.assertEqual(tuple(polygons.bboxes[0]), cv2.boundingRect(full))
+
+        reference = run_contour_pipeline(np.zeros(self.image_shape, dtype=np.uint8), [resize_mask_stack(masks, self.image_shape)[1]])
+        output = run_contour_pipeline(np.zeros(self.image_shape, dtype=np.uint8), polygons[1:2])
+        self.assertAlmostEqual(output["results"][0]["area"] / reference["results"][0]["area"], 1, delta=0.05)
+
+    def test_yolo_results(self):
+        from types import SimpleNamespace
+        from pipeline.tasks.segmentation import yolo_segmentation_to_masks, yolo_segmentation_to_polygons
+
+        masks = self.mask_stack()
+        tensor = SimpleNamespace(cpu=lambda: SimpleNamespace(numpy=lambda: masks))
+        xy = [np.array([[10.2, 10.7], [90.5, 10.0], [90.0, 60.4], [10.0, 60.0]], dtype=np.float32), np.zeros((0, 2))]
+        results = [SimpleNamespace(masks=SimpleNamespace(data=tensor, xy=xy))]
+
+        self.assertEqual(len(yolo_segmentation_to_masks(results, self.image_shape)), 3)
+        polygons = yolo_segmentation_to_polygons(results, self.image_shape)
+        self.assertEqual(polygons.to_polygons(), [[[10, 11], [90, 10], [90, 60], [10, 60]]])
+
+        empty = [SimpleNamespace(masks=None)]
+        self.assertEqual(yolo_segmentation_to_masks(empty, self.image_shape), [])
+        self.assertEqual(len(yolo_segmentation_to_polygons(empty, self.image_shape)), 0)
+
+
+class PersistenceTest(TransactionTestCase):
+    image_shape = (480, 640, 3)
+
+    def setUp(self):
+        spill = tempfile.TemporaryDirectory()
+        self.addCleanup(spill.cleanup)
+        self.spill_dir = spill.name
+
+    def records(self, count: int) -> list:
+        from pipeline.tasks.persistence.core import run_record
+
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        return [
+            run_record(run_contour_pipeline(image, random_polygons(self.image_shape, 10 + i, seed=i)), "test", self.image_shape, f"{i}.jpg")
+            for i in range(count)
+        ]
+
+    def test_runs_are_written_in_the_background(self):
+        from pipeline.models import AnalysisRun, AnalyzedObject, ObjectFeature
+        from pipeline.tasks.persistence import ResultWriter
+
+        records = self.records(3)
+        writer = ResultWriter(flush_interval=0.05, spill_dir=self.spill_dir)
+        for record in records:
+            writer.submit(record)
+        self.assertTrue(writer.flush(timeout=30))
+
+        self.assertEqual(AnalysisRun.objects.count(), 3)
+        run = AnalysisRun.objects.get(image_name="1.jpg")
+        record = records[1]
+        self.assertEqual((run.width, run.height, run.object_count), (640, 480, len(record.results)))
+        self.assertEqual(AnalyzedObject.objects.count(), sum(len(r.results) for r in records))
+
+        stored = run.analyzed_objects.get(index=2)
+        np.testing.assert_array_equal(np.frombuffer(stored.points, dtype="<i4").reshape(-1, 2), record.contours[2])
+        self.assertEqual(stored.attributes, record.attributes[2])
+        features = dict(ObjectFeature.objects.filter(run=run, object_index=2).values_list("name", "value"))
+        self.assertEqual(set(features), {k for k, v in record.results[2].items() if not isinstance(v, bool)})
+        self.assertAlmostEqual(features["area"], record.results[2]["area"])
+
+    def test_backlog_spills_to_disk_and_is_written_later(self):
+        import threading
+        from pipeline.models import AnalysisRun
+        from pipeline.tasks.persistence import ResultWriter
+        from pipeline.tasks.persistence.core import write_runs
+
+        database_up = threading.Event()
+        first_write = threading.Event()
+
+        def write(records):
+            first_write.set()
+            if not database_up.wait(timeout=0.2):
+                raise ConnectionError("database down")
+            write_runs(records)
+
+        writer = ResultWriter(buffer_size=1, flush_interval=0.01, spill_dir=self.spill_dir, write=write)
+        writer.RETRY_SECONDS = 0.05
+        records = self.records(4)
+        writer.submit(records[0])
+        first_write.wait(timeout=5)
+        for record in records[1:]:
+            writer.submit(record)
+        self.assertTrue(writer.spilled_files())
+
+        database_up.set()
+        self.assertTrue(writer.flush(timeout=30))
+        self.assertEqual(writer.spilled_files(), [])
+        self.assertEqual(sorted(AnalysisRun.objects.values_list("image_name", flat=True)), ["0.jpg", "1.jpg", "2.jpg", "3.jpg"])
+
+    def test_spill_files_are_written_once_by_concurrent_writers(self):
+        import threading
+        from pipeline.tasks.persistence import ResultWriter
+
+        written, lock = [], threading.Lock()
+
+        def write(records):
+            with lock:
+                written.extend(record.image_name for record in records)
+
+        records = self.records(6)
+        spiller = ResultWriter(spill_dir=self.spill_dir, write=write)
+        for record in records:
+            spiller._spill([record])
+        # A file claimed by a process that is gone is released
+        claimed = spiller.spilled_files()[0]
+        os.replace(claimed, f"{claimed}.999999999.claimed")
+
+        writers = [ResultWriter(flush_interval=0.01, spill_dir=self.spill_dir, write=write) for _ in range(3)]
+        for writer in writers:
+            writer._ensure_thread()
+        for writer in writers:
+            self.assertTrue(writer.flush(timeout=30))
+        self.assertEqual(sorted(written), [f"{i}.jpg" for i in range(6)])
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+    def test_spill_format_round_trips(self):
+        from pipeline.tasks.persistence.core import record_from_json, record_to_json
+
+        record = self.records(1)[0]
+        loaded = record_from_json(record_to_json(record))
+        for field, value in record._asdict().items():
+            if field == "contours":
+                self.assertEqual(loaded.contours.to_polygons(), value.to_polygons())
+            else:
+                self.assertEqual(getattr(loaded, field), value, field)
+
+    def test_foreign_spill_files_are_rejected(self):
+        import queue
+        import pickle
+        from pipeline.tasks.persistence import ResultWriter
+
+        written = []
+        writer = ResultWriter(flush_interval=0.01, spill_dir=self.spill_dir, write=written.extend)
+
+        class Payload:
+            def __reduce__(self):
+                return (os.mkdir, (os.path.join(self.spill_dir, "pwned"),))
+
+        Payload.spill_dir = self.spill_dir
+        with open(os.path.join(self.spill_dir, "planted.pickle"), "wb") as f:
+            pickle.dump(Payload(), f)
+        with open(os.path.join(self.spill_dir, "planted.jsonl"), "w") as f:
+            f.write('{"source": "planted"}\n')
+        writer._replay(queue.Queue())
+        self.assertEqual(written, [])
+        self.assertFalse(os.path.exists(os.path.join(self.spill_dir, "pwned")))
+        self.assertEqual(sorted(os.listdir(self.spill_dir)), ["planted.jsonl.bad", "planted.pickle"])
+
+        # A directory other users may write to, or that belongs to another user, is not read nor written
+        record = self.records(1)[0]
+        writer._spill([record])
+        os.chmod(self.spill_dir, 0o777)
+        writer._spill([record])
+        writer._replay(queue.Queue())
+        self.assertEqual((len(writer.spilled_files()), written), (1, []))
+        os.chmod(self.spill_dir, 0o700)
+        with mock.patch("os.getuid", return_value=os.getuid() + 1):
+            writer._replay(queue.Queue())
+        self.assertEqual(written, [])
+        writer._replay(queue.Queue())
+        self.assertEqual([run.image_name for run in written], ["0.jpg"])
+
+    def test_writer_survives_vanishing_files_and_failures(self):
+        import queue
+        from pipeline.models import AnalysisRun
+        from pipeline.tasks.persistence import ResultWriter
+
+        writer = ResultWriter(flush_interval=0.01, spill_dir=self.spill_dir)
+        # Taken by another worker between listing and loading
+        with mock.patch.object(writer, "spilled_files", return_value=[os.path.join(self.spill_dir, "gone.jsonl")]):
+            writer._replay(queue.Queue())
+
+        records = self.records(2)
+        with mock.patch.object(writer, "_store", side_effect=RuntimeError("unexpected")):
+            writer.submit(records[0])
+            self.assertTrue(writer.flush(timeout=30))
+        writer.submit(records[1])
+        self.assertTrue(writer.flush(timeout=30))
+        self.assertTrue(writer._thread.is_alive())
+        self.assertEqual(list(AnalysisRun.objects.values_list("image_name", flat=True)), ["1.jpg"])
+
+
+@unittest.skipIf(feature_export.core.pa is None, "requires pyarrow")
+class FeatureExportTest(SimpleTestCase):
+    image_shape = (240, 320, 3)
+
+    def outputs(self, count: int) -> list:
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        return [run_contour_pipeline(image, random_polygons(self.image_shape, 5 + i, seed=i)) for i in range(count)]
+
+    def test_batch_rows_match_the_pipeline_output(self):
+        from datetime import datetime, timezone
+
+        output = self.outputs(1)[0]
+        batch = feature_export.feature_batch(output, "a.jpg", "north", datetime(2026, 5, 1, 23, 30, tzinfo=timezone.utc))
+        rows = batch.to_pylist()
+        self.assertEqual(len(rows), len(output["results"]))
+        self.assertEqual(batch.schema, feature_export.core.feature_schema())
+        for row, result, box in zip(rows, output["results"], output["contours"].bboxes.tolist()):
+            self.assertEqual((row["image_id"], row["camera"], row["date"].isoformat()), ("a.jpg", "north", "2026-05-01"))
+            self.assertEqual([row["x"], row["y"], row["width"], row["height"]], box)
+            for name, value in result.items():
+                self.assertEqual(row[name], value)
+            # Features left out for an object are null, not NaN
+            if "eccentricity" not in result:
+                self.assertIsNone(row["eccentricity"])
+
+    def test_row_groups_never_mix_partitions(self):
+        import io
+        from datetime import datetime, timezone
+        from pyarrow import parquet
+
+        outputs = self.outputs(4)
+        days = [datetime(2026, 5, day, tzinfo=timezone.utc) for day in (1, 1, 2, 2)]
+        batches = [feature_export.feature_batch(output, f"{i}.jpg", "north", day) for i, (output, day) in enumerate(zip(outputs, days))]
+        data = b"".join(feature_export.iter_feature_table(batches, row_group_size=1000))
+
+        table = parquet.ParquetFile(io.BytesIO(data))
+        sizes = [table.metadata.row_group(i).num_rows for i in range(table.num_row_groups)]
+        expected = [sum(len(o["results"]) for o in outputs[:2]), sum(len(o["results"]) for o in outputs[2:])]
+        self.assertEqual(sizes, expected)
+
+    def test_folder_export_is_partitioned_and_appended(self):
+        from io import StringIO
+        from pyarrow import parquet
+        from django.core.management import call_command
+
+        with tempfile.TemporaryDirectory() as directory:
+            input_dir, output_dir = os.path.join(directory, "gate 1"), os.path.join(directory, "out")
+            os.makedirs(input_dir)
+            for i in range(3):
+                image = np.zeros(self.image_shape, dtype=np.uint8)
+                for polygon in random_polygons(self.image_shape, 3, seed=i):
+                    cv2.fillPoly(image, [np.asarray(polygon, dtype=np.int32)], color=(255, 255, 255))
+                cv2.imwrite(os.path.join(input_dir, f"frame_{i}.jpg"), image)
+            os.utime(os.path.join(input_dir, "frame_0.jpg"), (0, 0))
+
+            def run():
+                call_command("analyze_folder", input_dir, output_dir, "--model", "threshold", "--parquet", stdout=StringIO())
+                return parquet.read_table(os.path.join(output_dir, "features"), partitioning=feature_export.dataset_partitioning())
+
+            table = run()
+            self.assertEqual(set(table.column("camera").to_pylist()), {"gate 1"})
+            dates = {image: day for image, day in zip(table.column("image_id").to_pylist(), table.column("date").to_pylist())}
+            self.assertEqual(dates["frame_0.jpg"].isoformat(), "1970-01-01")
+            self.assertEqual(len(set(dates.values())), 2)
+
+            # A new image is appended in a new part file, finished ones are not written again
+            image = np.zeros(self.image_shape, dtype=np.uint8)
+            cv2.rectangle(image, (50, 50), (150, 120), (255, 255, 255), -1)
+            cv2.imwrite(os.path.join(input_dir, "frame_3.jpg"), image)
+            images = run().column("image_id").to_pylist()
+            self.assertEqual(sorted(set(images)), [f"frame_{i}.jpg" for i in range(4)])
+            self.assertEqual(len(images), table.num_rows + images.count("frame_3.jpg"))